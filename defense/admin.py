@@ -2,24 +2,24 @@
 from __future__ import unicode_literals
 
 # python libraries
-from collections import defaultdict
-from datetime import datetime
-import utils
+import json, utils
+from collections import OrderedDict
 
 # django modules
 from django.contrib import admin, messages
+from django.core.urlresolvers import reverse
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.utils import timezone
+from django.utils.html import format_html
 
 # project imports
 from models import Source, Country, Region, City, Stadium, Player, Coach, \
                    Referee, Team, PlayerTeam, CoachTeam, \
                    Tournament, TournamentTeam, TournamentPlayer, Game, \
                    GameTeam, GamePlayer, GameReferee, Goal, Card, SeasonTeamFinalStatus, \
-                   TournamentStatus
-from goalkeeper import parser_rsssf
-from goalkeeper.wiki_scrapers import ParaguayanChampionshipResultsScraper, \
-                                     ParaguayanTournamentScraper
-from importer import get_or_create_team, get_or_create_stadium, add_team_game, \
-    add_players_to_tournament_list
+                   TournamentStatus, ImportJob
+from instrumentation import format_report
+from jobs import enqueue_jobs
 
 
 
@@ -30,155 +30,113 @@ class SourceAdmin(admin.ModelAdmin):
 class TournamentAdmin(admin.ModelAdmin):
     list_display = ('name', 'country', 'start_date', 'end_date', 'champion', 'runnerup', 'season_champion')
     actions = ['collect_extra_info', 'collect_results']
-    objs_created = defaultdict(list)
+
+    def get_queryset(self, request):
+        # the names of the champion and the runnerup are fetched along
+        # with the tournaments
+        return super(TournamentAdmin, self).get_queryset(request).\
+            select_related('country').\
+            annotate(champion_name=self.__team_in_position_subquery(1),
+                     runnerup_name=self.__team_in_position_subquery(2))
+
+    def __team_in_position_subquery(self, position):
+        tournament_teams = TournamentTeam.objects.filter(tournament=OuterRef('pk'),
+                                                         final_position=position)
+        return Subquery(tournament_teams.order_by('id').values('team__name')[:1])
 
     def champion(self, obj):
-        tournament_teams = obj.tournamentteam_set.all()
-        for tournament_team in tournament_teams:
-            if tournament_team.final_position == 1:
-                return tournament_team.team.name
-        return ''
+        return obj.champion_name or ''
     champion.short_description = "Winner"
 
     def runnerup(self, obj):
-        tournament_teams = obj.tournamentteam_set.all()
-        for tournament_team in tournament_teams:
-            if tournament_team.final_position == 2:
-                return tournament_team.team.name
-        return ''
-
-    def __display_feedback_msg(self, request):
-        if self.objs_created:
-            msg = 'The action was completed successfully!\n'
-            for model, objs in self.objs_created.items():
-                '- It was created {0} objects of the type {1}\n'.format(model, len(objs))
-            self.message_user(request, msg, level=messages.SUCCESS)
-        else:
-            msg = 'No objects were created'
-            self.message_user(request, msg, level=messages.INFO)
-        return msg
+        return obj.runnerup_name or ''
+
+    def __enqueue_jobs(self, request, queryset, action):
+        jobs = enqueue_jobs(queryset, action)
+        status_url = reverse('admin:defense_importjob_changelist')
+        msg = format_html('{0} job(s) were queued, follow their progress in the '
+                          '<a href="{1}">import jobs page</a>', len(jobs), status_url)
+        self.message_user(request, msg, level=messages.SUCCESS)
 
     def collect_extra_info(self, request, queryset):
-        for obj in queryset:
-            tournament_obj = obj
-            source_obj = tournament_obj.source.all()[0]
-            py_ch_scrapper = ParaguayanTournamentScraper(source_obj.url)
-            tournament_dict = {
-                'name': obj.name,
-                'year': obj.year,
-                'additional_info': obj.additional_info
-            }
-            tournament_info = py_ch_scrapper.collect_tournament_info(tournament_dict)
-            if tournament_info:
-                self.objs_created = {}
-                information_collected = [option.strip() for option in obj.additional_info.split(';')]
-                if 'teams info' in information_collected:
-                    for team in tournament_info['teams']:
-                        # add teams to tournament
-                        team_obj = get_or_create_team(tournament_obj, team, source_obj)
-                        tt_obj = TournamentTeam.objects.create(tournament=tournament_obj,
-                                                               team=team_obj,
-                                                               source=source_obj)
-                        self.objs_created['TournamentTeam'].append(tt_obj)
-                if 'season statuses' in information_collected:
-                    for team in tournament_info['teams']:
-                        # create the teams' season final status
-                        team_obj = get_or_create_team(tournament_obj, team, source_obj)
-                        ss = SeasonTeamFinalStatus.objects.create(team=team_obj, season=obj.year,
-                                                                  position=int(team['position']),
-                                                                  points=int(team['points']),
-                                                                  games=int(team['games']),
-                                                                  wins=int(team['won']),
-                                                                  draws=int(team['drew']),
-                                                                  losses=int(team['lost']),
-                                                                  goals=int(team['gf']),
-                                                                  goals_conceded=int(team['gc']),
-                                                                  goals_difference=int(team['goals_difference']))
-                        self.objs_created['SeasonTeamFinalStatus'].append(ss)
-                        if team['international_status']:
-                            for status in team['international_status']:
-                                status_obj, created = TournamentStatus.objects.get_or_create(name=status)
-                                ss.status.add(status_obj)
-                                if created:
-                                    self.objs_created['TournamentStatus'].append(status_obj)
-        self.__display_feedback_msg(request)
+        self.__enqueue_jobs(request, queryset, 'collect_extra_info')
     collect_extra_info.short_description = 'Collect Extra Information'
 
     def collect_results(self, request, queryset):
-        def_prefix_tournament_file = 'campeonatos'
-        def_city = 'Asuncion'
-
-        for obj in queryset:
-            tournament_players = defaultdict(list)
-            tournament_obj = obj
-            source_obj = tournament_obj.source.all()[0]
-            tournament_dict = {
-                'name': obj.name,
-                'year': obj.year,
-                'start_string': obj.start_string,
-                'end_string': obj.end_string,
-                'results_local_file_name': '{0}{1}.html'.format(def_prefix_tournament_file, obj.year),
-                'num_teams': obj.number_of_teams
-            }
-            if int(obj.year) <= 2007:
-                results_tournament = parser_rsssf.get_data(tournament_dict)
-            else:
-                res_scraper = ParaguayanChampionshipResultsScraper(source_obj.url)
-                results_tournament = res_scraper.collect_championship_results(tournament_dict)
-            for result in results_tournament:
-                self.objs_created = {}
-                if isinstance(result, dict):   # tournaments <= 2007
-                    for game in result['games']:
-                        game_attrs = {
-                            'tournament': tournament_obj,
-                            'round': result['round']
-                        }
-                        if game['date']:
-                            game_attrs['datetime'] = datetime.strptime(game['date'], '%Y-%m-%d')
-                        if 'stadium' in game.keys() and game['stadium']:
-                            stadium_dict = {'name': game['stadium']}
-                            city_dict = {'name': def_city}
-                            game_attrs['stadium'] = get_or_create_stadium(stadium_dict, city_dict)
-                        if 'stage' in game.keys():
-                            game_attrs['stage'] = game['stage']
-                        game_obj = Game.objects.create(**game_attrs)
-                        game_obj.source.add(source_obj)
-                        self.objs_created['Game'].append(game_obj)
-                        # add home team to game
-                        game_players = add_team_game(tournament_obj, game_obj, source_obj,
-                                                     game['home_team'], game['away_team'],
-                                                     home=True)
-                        tournament_players = add_players_to_tournament_list(tournament_players,
-                                                                            game_players)
-                        # add away team to game
-                        game_players = add_team_game(tournament_obj, game_obj, source_obj,
-                                                     game['away_team'], game['home_team'],
-                                                     home=False)
-                        tournament_players = add_players_to_tournament_list(tournament_players,
-                                                                            game_players)
-                else:  # tournaments > 2007
-                    pass
-            # create tournament player models
-            for player_id, goals in tournament_players.items():
-                player_obj = Player.objects.get(id=player_id)
-                tournament_player_attrs = {
-                    'tournament': tournament_obj,
-                    'player': player_obj,
-                    'goals': len(goals)
-                }
-                tp = TournamentPlayer.objects.create(**tournament_player_attrs)
-                tp.source.add(source_obj)
-            # update the final position of teams in tournament
-            t_teams = TournamentTeam.objects.filter(tournament=tournament_obj).order_by('-points')
-            pos = 1
-            for team in t_teams:
-                team.final_position = pos
-                team.save()
-                pos += 1
-        self.message_user(request, "The action was completed successfully!")
+        self.__enqueue_jobs(request, queryset, 'collect_results')
     collect_results.short_description = "Collect Tournament Results"
 
 
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('tournament', 'action', 'status', 'progress', 'throughput', 'elapsed',
+                    'created_at', 'error_summary')
+    list_filter = ('status', 'action')
+    ordering = ('-created_at', )
+    list_select_related = ('tournament', )
+    readonly_fields = ('tournament', 'action', 'status', 'processed_items', 'total_items',
+                       'created_at', 'started_at', 'heartbeat_at', 'finished_at', 'error', 'report_details')
+    exclude = ('report', )
+    actions = ['display_reports']
+
+    def __get_report(self, obj):
+        return json.loads(obj.report, object_pairs_hook=OrderedDict) if obj.report else None
+
+    def __elapsed_seconds(self, obj):
+        if not obj.started_at:
+            return None
+        end = obj.finished_at or timezone.now()
+        return (end - obj.started_at).total_seconds()
+
+    def progress(self, obj):
+        if obj.total_items:
+            return '{0}/{1} ({2}%)'.format(obj.processed_items, obj.total_items,
+                                           100 * obj.processed_items / obj.total_items)
+        elif obj.processed_items:
+            return '{0}/?'.format(obj.processed_items)
+        else:
+            return 'Unknown'
+
+    def throughput(self, obj):
+        elapsed = self.__elapsed_seconds(obj)
+        if elapsed:
+            return '{0:.2f} items/s'.format(obj.processed_items / elapsed)
+        else:
+            return 'Unknown'
+
+    def elapsed(self, obj):
+        elapsed = self.__elapsed_seconds(obj)
+        if elapsed is None:
+            return 'Not started'
+        else:
+            return '{0:.0f}s'.format(elapsed)
+
+    def error_summary(self, obj):
+        if obj.error:
+            return obj.error.strip().split('\n')[-1]
+        else:
+            return ''
+    error_summary.short_description = 'Error'
+
+    def report_details(self, obj):
+        report = self.__get_report(obj)
+        if report is None:
+            return 'No report'
+        return format_html('{0}<pre>{1}</pre>', format_report(report), json.dumps(report, indent=2))
+    report_details.short_description = 'Report'
+
+    def display_reports(self, request, queryset):
+        # the rows created and where the time went in every
+        # job, as the feedback of the action
+        for job in queryset.select_related('tournament'):
+            report = self.__get_report(job)
+            if report is None:
+                self.message_user(request, '{0}: no report yet'.format(job), level=messages.INFO)
+            else:
+                level = messages.ERROR if job.status == 'failed' else messages.SUCCESS
+                self.message_user(request, '{0}: {1}'.format(job, format_report(report)), level=level)
+    display_reports.short_description = 'Display the reports of the jobs'
+
+
 class TournamentTeamAdmin(admin.ModelAdmin):
     list_display = ('tournament', 'team', 'points', 'games', 'wins', 'draws', 'losses',
                     'goals', 'goals_conceded', 'cards', 'final_position')
@@ -218,33 +176,32 @@ class GameAdmin(admin.ModelAdmin):
         else:
             return obj.stadium
 
-    def home(self, obj):
-        game_teams = obj.teams.all()
-        game_team1 = GameTeam.objects.get(game=obj, team=game_teams[0])
-        if game_team1.home:
-            return game_teams[0].name
+    def get_queryset(self, request):
+        # fetch everything the list columns need for the whole page at once
+        game_teams = GameTeam.objects.select_related('team').order_by('id')
+        return super(GameAdmin, self).get_queryset(request).\
+            select_related('tournament__country', 'stadium__city__region__country',
+                           'stadium__city__country').\
+            prefetch_related(Prefetch('gameteam_set', queryset=game_teams))
+
+    def __home_away_game_teams(self, obj):
+        game_teams = obj.gameteam_set.all()
+        if game_teams[0].home:
+            return game_teams[0], game_teams[1]
         else:
-            return game_teams[1].name
+            return game_teams[1], game_teams[0]
+
+    def home(self, obj):
+        game_team_home, game_team_away = self.__home_away_game_teams(obj)
+        return game_team_home.team.name
 
     def away(self, obj):
-        game_teams = obj.teams.all()
-        game_team1 = GameTeam.objects.get(game=obj, team=game_teams[0])
-        if game_team1.home:
-            return game_teams[1].name
-        else:
-            return game_teams[0].name
+        game_team_home, game_team_away = self.__home_away_game_teams(obj)
+        return game_team_away.team.name
 
     def score(self, obj):
-        game_teams = obj.teams.all()
-        game_team1 = GameTeam.objects.get(game=obj, team=game_teams[0])
-        game_team2 = GameTeam.objects.get(game=obj, team=game_teams[1])
-        if game_team1.home:
-            score_home = game_team1.goals
-            score_away = game_team2.goals
-        else:
-            score_away = game_team1.goals
-            score_home = game_team2.goals
-        ret = '%s - %s' % (score_home, score_away)
+        game_team_home, game_team_away = self.__home_away_game_teams(obj)
+        ret = '%s - %s' % (game_team_home.goals, game_team_away.goals)
         return ret
 
 
@@ -354,3 +311,4 @@ admin.site.register(GamePlayer, GamePlayerAdmin)
 admin.site.register(GameReferee)
 admin.site.register(Goal, GoalAdmin)
 admin.site.register(Card)
+admin.site.register(ImportJob, ImportJobAdmin)
@@ -6,3 +6,8 @@ from django.apps import AppConfig
 
 class DefenseConfig(AppConfig):
     name = 'defense'
+
+    def ready(self):
+        # connect the receivers that keep the stats of the teams
+        # and the cached values in sync and count the rows created
+        from defense import cache, instrumentation, team_stats
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import gc, json, os, time
+
+from collections import OrderedDict, defaultdict
+from defense.collectors import collect_results
+from defense.models import Country, City, Source, Team, Tournament
+from defense.resolver import import_run
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from goalkeeper import parser_rsssf
+from goalkeeper.fixtures import TESTDATA_DIR, TOURNAMENT_INFO, FixtureFetcher
+from goalkeeper.wiki_scrapers import ParaguayanChampionshipResultsScraper, \
+    ParaguayanTournamentScraper
+
+
+DEF_REPEAT = 3
+DEF_TOLERANCE = 0.2  # slowdown accepted before a stage is reported as a regression
+DEF_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata',
+                                 'benchmark_baseline.json')
+# season recorded in goalkeeper/testdata/campeonatos1998.html
+RSSSF_CHAMPIONSHIP = {
+    'name': 'Apertura',
+    'year': 1998,
+    'start_string': '',
+    'end_string': 'torneo clausura',
+    'results_local_file_name': 'campeonatos1998.html',
+    'num_teams': 12,
+}
+RSSSF_TEAMS = ['Olimpia', 'Cerro Porteño', 'Libertad', 'Guaraní', 'Nacional', 'Sportivo Luqueño',
+               'Sol de América', 'Cerro Corá', 'Atlético Colegiales', 'Sportivo San Lorenzo',
+               'Presidente Hayes', 'Tembetary']
+
+
+def parse_rsssf_results():
+    return parser_rsssf.read_championship_results(RSSSF_CHAMPIONSHIP, TESTDATA_DIR)
+
+
+def scrape_championship_results():
+    scraper = ParaguayanChampionshipResultsScraper('', fetcher=FixtureFetcher('results_2010.html'))
+    return scraper.collect_championship_results({'year': '2010'})
+
+
+def scrape_tournament_info():
+    scraper = ParaguayanTournamentScraper('', fetcher=FixtureFetcher('tournament_2010.html'))
+    return scraper.collect_tournament_info({'name': 'apertura', 'year': 2010,
+                                            'additional_info': TOURNAMENT_INFO})
+
+
+def create_rsssf_tournament():
+    # tournament of the recorded season along with the teams
+    # that already exist before its results are imported
+    country = Country.objects.create(name='Paraguay')
+    city = City.objects.create(name='Asuncion', country=country)
+    for team_name in RSSSF_TEAMS:
+        Team.objects.create(name=team_name, city=city)
+    source = Source.objects.create(name='RSSSF', url='http://www.rsssf.com/tablesp/para98.html')
+    tournament = Tournament.objects.create(name=RSSSF_CHAMPIONSHIP['name'], country=country,
+                                           year=RSSSF_CHAMPIONSHIP['year'],
+                                           start_string=RSSSF_CHAMPIONSHIP['start_string'],
+                                           end_string=RSSSF_CHAMPIONSHIP['end_string'],
+                                           number_of_teams=RSSSF_CHAMPIONSHIP['num_teams'])
+    tournament.source.add(source)
+    return tournament
+
+
+def import_rsssf_results():
+    # everything is rolled back so that every run starts from scratch
+    with transaction.atomic():
+        tournament = create_rsssf_tournament()
+        with import_run():
+            collect_results(tournament, defaultdict(list), data_dir=TESTDATA_DIR)
+        transaction.set_rollback(True)
+
+
+STAGES = OrderedDict([
+    ('rsssf_parser', parse_rsssf_results),
+    ('results_scraper', scrape_championship_results),
+    ('tournament_scraper', scrape_tournament_info),
+    ('collect_results', import_rsssf_results),
+])
+
+
+def time_stage(func, repeat=DEF_REPEAT):
+    """
+    Runs func repeat times and returns the best wall time
+    and the queries of a run
+    """
+    wall_times = []
+    num_queries = 0
+    for i in range(0, repeat):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.time()
+            func()
+            wall_times.append(time.time() - start)
+        num_queries = len(captured)
+    return {
+        'wall_time': round(min(wall_times), 4),
+        'queries': num_queries,
+    }
+
+
+def run_stage(func, repeat=DEF_REPEAT):
+    """
+    Results of time_stage along with the peak memory of the stage in
+    kilobytes. ru_maxrss is a high-water mark of the whole process, so
+    the stage runs in a forked child whose own peak is read once it
+    exits. The child works on a copy of the in-memory test database
+    """
+    if not hasattr(os, 'fork'):
+        result = time_stage(func, repeat)
+        result['peak_memory_kb'] = None
+        return result
+    gc.collect()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            output = {'result': time_stage(func, repeat)}
+        except Exception as e:
+            output = {'error': '{0}: {1}'.format(type(e).__name__, e)}
+            status = 1
+        with os.fdopen(write_fd, 'w') as f:
+            json.dump(output, f)
+        # the child mustn't run the cleanups of the parent (e.g. closing its database)
+        os._exit(status)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'r') as f:
+        output = f.read()
+    _, status, rusage = os.wait4(pid, 0)
+    output = json.loads(output) if output else {'error': 'exit status {0}'.format(status)}
+    if 'error' in output:
+        raise RuntimeError('The stage failed: {0}'.format(output['error']))
+    result = output['result']
+    result['peak_memory_kb'] = rusage.ru_maxrss  # kilobytes on linux
+    return result
+
+
+def run_benchmark(stages=None, repeat=DEF_REPEAT):
+    results = OrderedDict()
+    for name, func in STAGES.items():
+        if stages and name not in stages:
+            continue
+        results[name] = run_stage(func, repeat)
+    return results
+
+
+def load_baseline(file_name=DEF_BASELINE_FILE):
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+
+def save_baseline(results, file_name=DEF_BASELINE_FILE):
+    with open(file_name, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare_with_baseline(results, baseline, tolerance=DEF_TOLERANCE):
+    """
+    Stages slower than the baseline by more than tolerance or that
+    issue more queries, the time is compared as a ratio
+    """
+    regressions = OrderedDict()
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        problems = []
+        if base['wall_time'] and result['wall_time'] > base['wall_time'] * (1 + tolerance):
+            problems.append('{0:.2f}x slower'.format(result['wall_time'] / base['wall_time']))
+        if result['queries'] > base['queries']:
+            problems.append('{0} more queries'.format(result['queries'] - base['queries']))
+        if base.get('peak_memory_kb') and result.get('peak_memory_kb') and \
+                result['peak_memory_kb'] > base['peak_memory_kb'] * (1 + tolerance):
+            problems.append('{0} kb more memory'.format(result['peak_memory_kb'] - base['peak_memory_kb']))
+        if problems:
+            regressions[name] = problems
+    return regressions
@@ -0,0 +1,123 @@
+import logging, threading, uuid
+
+from defense.models import Game, GameTeam, Goal, TournamentTeam
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+
+logger = logging.getLogger(__name__)
+
+DEF_CACHE_ALIAS = 'default'
+
+_local = threading.local()
+
+
+def get_cache():
+    return caches[getattr(settings, 'DEFENSE_CACHE_ALIAS', DEF_CACHE_ALIAS)]
+
+
+def get_version_key(tournament_id):
+    return 'defense:tournament:{0}:version'.format(tournament_id)
+
+
+def get_tournament_version(tournament_id):
+    # the version never expires, when it is lost a new one
+    # is generated and the entries of the old one are ignored
+    cache = get_cache()
+    version_key = get_version_key(tournament_id)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+    return version
+
+
+def get_tournament_key(tournament_id, name):
+    return 'defense:tournament:{0}:{1}:{2}'.format(tournament_id, get_tournament_version(tournament_id), name)
+
+
+def get_tournament_value(tournament_id, name, compute, timeout=None):
+    """
+    Value of the tournament cached under name, compute is called when the
+    value isn't in the cache. The values are invalidated all at once by
+    changing the version of the tournament, the old entries just expire
+    """
+    cache = get_cache()
+    key = get_tournament_key(tournament_id, name)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        if timeout is None:
+            cache.set(key, value)
+        else:
+            cache.set(key, value, timeout)
+    return value
+
+
+def set_new_version(tournament_id):
+    logger.debug('Invalidating the cached values of the tournament %s', tournament_id)
+    get_cache().set(get_version_key(tournament_id), uuid.uuid4().hex, None)
+
+
+def invalidate_tournament(tournament_id):
+    # a new version is set once the transaction commits, so that the values
+    # aren't computed again from the rows that are still being written
+    transaction.on_commit(lambda: set_new_version(tournament_id))
+
+
+def get_pending_games():
+    if not hasattr(_local, 'pending_games'):
+        _local.pending_games = set()
+    return _local.pending_games
+
+
+def invalidate_games(game_ids):
+    """
+    Invalidates the tournaments of the games once the transaction commits.
+    The games changed in the transaction are gathered, so their tournaments
+    are looked up with a single query instead of one per row changed. The
+    games of a transaction rolled back are invalidated along with the next
+    one, which only costs computing their values again
+    """
+    pending_games = get_pending_games()
+    pending_games.update(game_ids)
+
+    def invalidate_pending_games():
+        # the first callback run takes the games of all the others
+        game_ids = list(pending_games)
+        pending_games.clear()
+        if game_ids:
+            for tournament_id in Game.objects.filter(id__in=game_ids).order_by().\
+                    values_list('tournament_id', flat=True).distinct():
+                set_new_version(tournament_id)
+    transaction.on_commit(invalidate_pending_games)
+
+
+###
+# Signals, the importer inserts the rows in bulk and invalidates
+# the tournament by itself, the ones saved or deleted elsewhere
+# are handled here
+###
+
+
+@receiver([post_save, post_delete], sender=GameTeam, dispatch_uid='cache_game_team_changed')
+@receiver([post_save, post_delete], sender=Goal, dispatch_uid='cache_goal_changed')
+def game_row_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_games([instance.game_id])
+
+
+@receiver(pre_delete, sender=Game, dispatch_uid='cache_game_deleted')
+def game_deleted(sender, instance, **kwargs):
+    # the game is gone when its rows are looked up, its
+    # tournament is taken from the game itself
+    invalidate_tournament(instance.tournament_id)
+
+
+@receiver([post_save, post_delete], sender=TournamentTeam, dispatch_uid='cache_tournament_team_changed')
+def tournament_team_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate_tournament(instance.tournament_id)
@@ -0,0 +1,186 @@
+
+from collections import defaultdict
+from datetime import datetime
+from defense import instrumentation
+from defense.importer import get_or_create_team, get_or_create_stadium, add_team_game, \
+    get_game_import_key, get_game_fingerprint
+from defense.models import Game, TournamentTeam, SeasonTeamFinalStatus, TournamentStatus
+from defense.unit_of_work import TournamentUnitOfWork
+from django.conf import settings
+from goalkeeper import parser_rsssf
+from goalkeeper.wiki_scrapers import ParaguayanChampionshipResultsScraper, \
+    ParaguayanTournamentScraper
+
+
+DEF_PREFIX_TOURNAMENT_FILE = 'campeonatos'
+DEF_CITY = 'Asuncion'
+LAST_RSSSF_YEAR = 2007  # results of later tournaments are scraped from wikipedia
+
+
+def no_progress(processed, total):
+    pass
+
+
+def get_page_url(tournament_obj, action):
+    # url of the page that the action downloads, if any
+    if action == 'collect_results' and int(tournament_obj.year) <= LAST_RSSSF_YEAR:
+        return None
+    sources = tournament_obj.source.all()
+    return sources[0].url if sources else None
+
+
+def collect_extra_info(tournament_obj, objs_created, progress=no_progress):
+    source_obj = tournament_obj.source.all()[0]
+    py_ch_scrapper = ParaguayanTournamentScraper(source_obj.url)
+    tournament_dict = {
+        'name': tournament_obj.name,
+        'year': tournament_obj.year,
+        'additional_info': tournament_obj.additional_info
+    }
+    tournament_info = py_ch_scrapper.collect_tournament_info(tournament_dict)
+    instrumentation.record_scraper(py_ch_scrapper)
+    if tournament_info:
+        information_collected = [option.strip() for option in tournament_obj.additional_info.split(';')]
+        # the progress is reported after every team, it is the heartbeat
+        # that keeps a long job from being taken as abandoned
+        num_passes = len([option for option in ['teams info', 'season statuses']
+                          if option in information_collected])
+        total_items, processed = len(tournament_info['teams']) * num_passes, 0
+        if 'teams info' in information_collected:
+            for team in tournament_info['teams']:
+                # add teams to tournament
+                team_obj = get_or_create_team(tournament_obj, team, source_obj)
+                tt_obj = TournamentTeam.objects.create(tournament=tournament_obj,
+                                                       team=team_obj,
+                                                       source=source_obj)
+                objs_created['TournamentTeam'].append(tt_obj)
+                processed += 1
+                progress(processed, total_items)
+        if 'season statuses' in information_collected:
+            for team in tournament_info['teams']:
+                # create the teams' season final status
+                team_obj = get_or_create_team(tournament_obj, team, source_obj)
+                ss = SeasonTeamFinalStatus.objects.create(team=team_obj, season=tournament_obj.year,
+                                                          position=int(team['position']),
+                                                          points=int(team['points']),
+                                                          games=int(team['games']),
+                                                          wins=int(team['won']),
+                                                          draws=int(team['drew']),
+                                                          losses=int(team['lost']),
+                                                          goals=int(team['gf']),
+                                                          goals_conceded=int(team['gc']),
+                                                          goals_difference=int(team['goals_difference']))
+                objs_created['SeasonTeamFinalStatus'].append(ss)
+                if team['international_status']:
+                    for status in team['international_status']:
+                        status_obj, created = TournamentStatus.objects.get_or_create(name=status)
+                        ss.status.add(status_obj)
+                        if created:
+                            objs_created['TournamentStatus'].append(status_obj)
+                processed += 1
+                progress(processed, total_items)
+    return objs_created
+
+
+def get_imported_games(tournament_obj):
+    # (id, fingerprint) of the games of the tournament by their import key,
+    # the games imported without key are by their id so that they are
+    # never found again in the results and get replaced
+    imported_games = {}
+    for game_id, import_key, fingerprint in Game.objects.filter(tournament=tournament_obj).\
+            values_list('id', 'import_key', 'fingerprint'):
+        imported_games[import_key or game_id] = (game_id, fingerprint)
+    return imported_games
+
+
+def get_data_dir():
+    # directory of the rsssf files, the RSSSF_DATA_DIR setting
+    # or the one relative to the working directory
+    return getattr(settings, 'RSSSF_DATA_DIR', parser_rsssf.DATA_DIR)
+
+
+def collect_results(tournament_obj, objs_created, progress=no_progress, data_dir=None):
+    """
+    Imports the results of the tournament, it can be run again: the games
+    whose results didn't change are skipped, the ones that changed are
+    updated and the ones that aren't in the results anymore are deleted
+    """
+    if data_dir is None:
+        data_dir = get_data_dir()
+    source_obj = tournament_obj.source.all()[0]
+    unit_of_work = TournamentUnitOfWork(tournament_obj, source_obj)
+    tournament_dict = {
+        'name': tournament_obj.name,
+        'year': tournament_obj.year,
+        'start_string': tournament_obj.start_string,
+        'end_string': tournament_obj.end_string,
+        'results_local_file_name': '{0}{1}.html'.format(DEF_PREFIX_TOURNAMENT_FILE, tournament_obj.year),
+        'num_teams': tournament_obj.number_of_teams
+    }
+    imported_games = {}
+    seen_keys = defaultdict(int)
+    if int(tournament_obj.year) <= LAST_RSSSF_YEAR:
+        # rounds are imported while the file is being parsed,
+        # so the total is unknown
+        results_tournament = instrumentation.timed_iter(
+            'parse', parser_rsssf.iter_championship_results(tournament_dict, data_dir))
+        total_rounds = 0
+        imported_games = get_imported_games(tournament_obj)
+    else:
+        res_scraper = ParaguayanChampionshipResultsScraper(source_obj.url)
+        results_tournament = res_scraper.collect_championship_results(tournament_dict)
+        instrumentation.record_scraper(res_scraper)
+        total_rounds = len(results_tournament)
+    for num_result, result in enumerate(results_tournament):
+        if isinstance(result, dict):   # tournaments <= 2007
+            for game in result['games']:
+                import_key = get_game_import_key(result['round'], game)
+                seen_keys[import_key] += 1
+                if seen_keys[import_key] > 1:
+                    # the same teams met more than once in the round
+                    import_key = '{0}#{1}'.format(import_key, seen_keys[import_key])
+                fingerprint = get_game_fingerprint(tournament_obj, result['round'], game)
+                game_id, imported_fingerprint = imported_games.pop(import_key, (None, None))
+                if fingerprint == imported_fingerprint:
+                    continue
+                game_attrs = {
+                    'tournament': tournament_obj,
+                    'round': result['round'],
+                    'import_key': import_key,
+                    'fingerprint': fingerprint
+                }
+                if game['date']:
+                    game_attrs['datetime'] = datetime.strptime(game['date'], '%Y-%m-%d')
+                if 'stadium' in game.keys() and game['stadium']:
+                    stadium_dict = {'name': game['stadium']}
+                    city_dict = {'name': DEF_CITY}
+                    game_attrs['stadium'] = get_or_create_stadium(stadium_dict, city_dict)
+                if 'stage' in game.keys():
+                    game_attrs['stage'] = game['stage']
+                # the game is written by the unit of work along with its sides
+                game_obj = Game(id=game_id, **game_attrs)
+                if game_id is None:
+                    unit_of_work.add_game(game_obj)
+                    objs_created['Game'].append(game_obj)
+                else:
+                    unit_of_work.replace_game(game_obj)
+                # add home team to game
+                add_team_game(tournament_obj, game_obj, source_obj,
+                              game['home_team'], game['away_team'],
+                              home=True, unit_of_work=unit_of_work)
+                # add away team to game
+                add_team_game(tournament_obj, game_obj, source_obj,
+                              game['away_team'], game['home_team'],
+                              home=False, unit_of_work=unit_of_work)
+        else:  # tournaments > 2007
+            pass
+        progress(num_result+1, total_rounds)
+    if seen_keys:
+        # the games left weren't found in the results, unless
+        # nothing could be read from them
+        for game_id, _ in imported_games.values():
+            unit_of_work.remove_game(game_id)
+    # the table and the final positions of the teams are updated along
+    # with the games
+    unit_of_work.flush()
+    return objs_created
@@ -1,12 +1,15 @@
 
-import itertools, utils, re
+import hashlib, itertools, json, utils, re
 
 from collections import defaultdict
-from defense.models import Player, Country, Team, \
+from defense import instrumentation, resolver
+from defense.models import Player, PlayerTeam, Country, Team, \
     Stadium, City, Region, StadiumTeam, TournamentTeam, \
-    GameTeam, Goal, GamePlayer, PlayerTeam
+    GameTeam, Goal
+from defense.unit_of_work import TournamentUnitOfWork
 from difflib import SequenceMatcher
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 
 
 num_pattern = re.compile('[^0-9]')
@@ -14,6 +17,23 @@ DEF_COUNTRY = 'paraguay'
 potential_compound_last_names = [{'last_name': 'silva', 'prefix': 'da'}]
 
 
+def create_unless_exists(model, obj_attrs, city):
+    """
+    Creates the object unless one with its normalized name exists. The
+    imports that run at the same time can all miss the name in their own
+    index, so the creations are serialized on the row of the city and the
+    name is looked up again in the database before inserting the row
+    """
+    with transaction.atomic():
+        list(City.objects.select_for_update().filter(id=city.id).values_list('id'))
+        obj = model.objects.filter(normalized_name=utils.normalize_name(obj_attrs['name'])).\
+            order_by('id').first()
+        if obj is None:
+            obj = model.objects.create(**obj_attrs)
+    resolver.register_obj(obj)
+    return obj
+
+
 def disambiguate_objs_by_name(objs, ref_name):
     similarity = []
     for obj in objs:
@@ -25,7 +45,7 @@ def disambiguate_objs_by_name(objs, ref_name):
 
 
 def search_most_similar_strings(model, name):
-    threshold = 0.50
+    threshold = resolver.SIMILARITY_THRESHOLD
     objs_to_return = []
     model_objs = model.objects.all()
     similar_ratios = []
@@ -43,12 +63,24 @@ def search_most_similar_strings(model, name):
 
 def search_obj_by_name(model, name):
     nor_name = utils.normalize_text(name).strip()
-    objs_to_return = model.objects.filter(name__icontains=nor_name)
+    # during an import run names are resolved against the in-memory
+    # index of the model instead of querying the database
+    name_index = resolver.get_name_index(model)
+    # the stored normalized names are looked up first, only names
+    # that aren't found there are searched as substrings
+    if name_index is not None:
+        objs_to_return = name_index.normalized(nor_name) or name_index.contains(nor_name)
+    else:
+        objs_to_return = list(model.objects.filter(normalized_name=utils.normalize_name(nor_name))) or \
+                         model.objects.filter(name__icontains=nor_name)
     if len(objs_to_return) == 1:
         return objs_to_return
     else:
         if len(objs_to_return) == 0:
-            objs_to_return = search_most_similar_strings(model, nor_name)
+            if name_index is not None:
+                objs_to_return = name_index.most_similar(nor_name)
+            else:
+                objs_to_return = search_most_similar_strings(model, nor_name)
         if len(objs_to_return) > 1:
             objs_to_return = [disambiguate_objs_by_name(objs_to_return, nor_name)]
     return objs_to_return
@@ -84,11 +116,6 @@ def extract_firstname_lastname_from_string(name_str):
     return {'first_name': first_name, 'last_name': last_name}
 
 
-def search_person_by_name(name):
-    dict_name = extract_firstname_lastname_from_string(name)
-    return Player.objects.filter(last_name__iexact=dict_name['last_name'])
-
-
 def create_new_person(person_dict):
     dict_name = extract_firstname_lastname_from_string(person_dict['name'])
     person_attrs = {'first_name': dict_name['first_name'],
@@ -96,44 +123,71 @@ def create_new_person(person_dict):
     if 'wikipage' in person_dict.keys() and person_dict['wikipage']:
         person_attrs['wikipage'] = person_dict['wikipage']
     if 'country' in person_dict.keys():
-        country = Country.objects.get_or_create(name__iexact=person_dict['country'])
+        country, _ = Country.objects.get_or_create(
+            normalized_name=utils.normalize_name(person_dict['country']),
+            defaults={'name': utils.format_text_to_save_db(person_dict['country'])})
         person_attrs['nationality'] = country
     return Player.objects.create(**person_attrs)
 
 
 def update_person(person_obj, person_dict):
     dict_name = extract_firstname_lastname_from_string(person_dict['name'])
-    person_obj.first_name = dict_name['first_name']
+    if dict_name['first_name']:
+        # a mention of the last name alone keeps the first name known
+        person_obj.first_name = dict_name['first_name']
     if 'country' in person_dict.keys():
         person_obj.nationality= person_dict['country']
     if 'wikipage' in person_dict.keys():
         person_obj.wikipage = person_dict['wikipage']
-    person_obj.save()
+    resolver.save_obj(person_obj)
+
 
+def load_player_index(last_name=None):
+    # all the players along with their teams, or only
+    # the ones with the last name given
+    players = Player.objects.all()
+    player_teams = PlayerTeam.objects.all()
+    if last_name is not None:
+        players = players.filter(normalized_last_name=last_name)
+        player_teams = player_teams.filter(player__normalized_last_name=last_name)
+    return resolver.PlayerIndex(players, player_teams.values_list('player_id', 'team_id'))
 
-def disambiguate_player(player_objs, tournament_obj):
-    tournament_teams = tournament_obj.teams.all()
-    players_str = ''
-    for player_obj in player_objs:
-        players_str += player_obj.name + ' '
-        player_teams = player_objs.team_set.all()
-        for team in player_teams:
-            if team in tournament_teams:
-                return player_obj
-    raise Exception('Couldnt disambiguate the players ', players_str)
 
+def load_tournament_teams(player_index, tournament_obj):
+    if not player_index.has_tournament(tournament_obj.id):
+        player_index.add_tournament_teams(tournament_obj.id, TournamentTeam.objects.
+                                          filter(tournament=tournament_obj).values_list('team_id', flat=True))
 
-def get_or_create_player(tournament_obj, player_dict):
+
+@instrumentation.timed('resolve')
+def get_or_create_player(tournament_obj, player_dict, team_obj=None):
     player_name = utils.normalize_text(player_dict['name'])
-    ret_obj = search_person_by_name(player_name)
-    if not ret_obj:
-        # the player doesn't exist yet
-        player_obj = create_new_person(player_dict)
-    elif len(ret_obj) > 1:
-        player_obj = disambiguate_player(ret_obj, tournament_obj)
+    team_id = team_obj.id if team_obj else None
+    # players are disambiguated by the team they scored for
+    # and the teams of the tournament
+    resolution_key = (tournament_obj.id, team_id, utils.normalize_name(player_name, stop_words=()))
+    player_obj = resolver.get_resolved(Player, resolution_key)
+    if player_obj is None:
+        dict_name = extract_firstname_lastname_from_string(player_name)
+        last_name = utils.normalize_name(dict_name['last_name'], stop_words=())
+        player_index = resolver.get_player_index(load_player_index)
+        if player_index is None:
+            player_index = load_player_index(last_name)
+        load_tournament_teams(player_index, tournament_obj)
+        player_obj = player_index.resolve(last_name, resolver.get_initial(dict_name['first_name']),
+                                          team_id, tournament_obj.id)
+        if player_obj is None:
+            # the player doesn't exist yet
+            player_obj = create_new_person(player_dict)
+        player_obj = resolver.set_resolved(Player, resolution_key, player_obj)
+        update_person(player_obj, player_dict)
+        # the player and the team are known to the next mentions
+        player_index.update(player_obj)
+        if team_id is not None:
+            player_index.add_team(player_obj.id, team_id)
+            player_index.add_tournament_teams(tournament_obj.id, [team_id])
     else:
-        player_obj = ret_obj[0]
-    update_person(player_obj, player_dict)
+        update_person(player_obj, player_dict)
     return player_obj
 
 
@@ -146,7 +200,7 @@ def create_new_team(team_dict, stadium_obj):
                   'city': stadium_obj.city}
     if 'wikipage' in team_dict.keys():
         team_attrs['wikipage'] = team_dict['wikipage']
-    return Team.objects.create(**team_attrs)
+    return create_unless_exists(Team, team_attrs, stadium_obj.city)
 
 
 def disambiguate_team(team_objs, tournament_obj):
@@ -170,30 +224,37 @@ def update_team(team_obj, team_dict):
         team_obj.foundation = team_dict['foundation']
     if 'wikipage' in team_dict.keys():
         team_obj.wikipage = team_dict['wikipage']
-    team_obj.save()
+    resolver.save_obj(team_obj)
+    resolver.register_obj(team_obj)
 
 
+@instrumentation.timed('resolve')
 def get_or_create_team(tournament_obj, team, source):
     team_name = utils.normalize_text(team['name'])
     team_name = team_name.replace('club', '').strip()  # delete word 'club'
-    ret_obj = search_obj_by_name(Team, team_name)
-    stadium = None
-    if not ret_obj:
-        # the team doesn't exist yet
-        if 'stadium' in team.keys() and 'city' in team.keys():
-            stadium = get_or_create_stadium(team['stadium'], team['city'])
-            team_obj = create_new_team(team, stadium)
+    # teams are disambiguated by the teams of the tournament
+    resolution_key = (tournament_obj.id, utils.normalize_name(team_name))
+    team_obj = resolver.get_resolved(Team, resolution_key)
+    if team_obj is None:
+        ret_obj = search_obj_by_name(Team, team_name)
+        stadium = None
+        if not ret_obj:
+            # the team doesn't exist yet
+            if 'stadium' in team.keys() and 'city' in team.keys():
+                stadium = get_or_create_stadium(team['stadium'], team['city'])
+                team_obj = create_new_team(team, stadium)
+            else:
+                raise Exception('The team {0} doesnt exist and a new one cannot be created because there are not '
+                                'information about city and stadium'.format(team_name))
+        elif len(ret_obj) > 1:
+            team_obj = disambiguate_team(ret_obj, tournament_obj)
         else:
-            raise Exception('The team {0} doesnt exist and a new one cannot be created because there are not '
-                            'information about city and stadium'.format(team_name))
-    elif len(ret_obj) > 1:
-        team_obj = disambiguate_team(ret_obj, tournament_obj)
-    else:
-        team_obj = ret_obj[0]
-    # associate the team with its stadium in case the association
-    # doesn't exists
-    if stadium and not team_obj.stadium.all():
-        StadiumTeam.objects.create(stadium=stadium, team=team_obj, source=source)
+            team_obj = ret_obj[0]
+        # associate the team with its stadium in case the association
+        # doesn't exists
+        if stadium and not team_obj.stadium.all():
+            StadiumTeam.objects.create(stadium=stadium, team=team_obj, source=source)
+        team_obj = resolver.set_resolved(Team, resolution_key, team_obj)
     update_team(team_obj, team)
     return team_obj
 
@@ -212,34 +273,37 @@ def create_new_stadium(stadium_dict, city):
         stadium_attrs['capacity'] = -1
     if 'wikipage' in stadium_dict.keys():
         stadium_attrs['wikipage'] = stadium_dict['wikipage']
-    return Stadium.objects.create(**stadium_attrs)
+    return create_unless_exists(Stadium, stadium_attrs, city)
 
 
 def update_stadium(stadium_obj, stadium_dict):
-    if len(stadium_dict['name']) > len(stadium_dict.name):
-        stadium_dict.name = stadium_dict['name']
-    stadium_obj.name = stadium_dict['name']
+    if len(stadium_dict['name']) > len(stadium_obj.name):
+        stadium_obj.name = utils.format_text_to_save_db(stadium_dict['name'])
     if 'capacity' in stadium_dict.keys():
-        stadium_obj.capacity = stadium_dict['capacity']
+        stadium_obj.capacity = int(num_pattern.sub('', stadium_dict['capacity']))
     if 'wikipage' in stadium_dict.keys():
         stadium_obj.wikipage = stadium_dict['wikipage']
-    stadium_obj.save()
+    resolver.save_obj(stadium_obj)
+    resolver.register_obj(stadium_obj)
 
 
+@instrumentation.timed('resolve')
 def get_or_create_stadium(stadium_dict, city_dict):
     stadium_name = utils.normalize_text(stadium_dict['name'])
     # delete word 'estadio'
     stadium_name = stadium_name.replace('estadio', '').strip()
-    ret_obj = search_obj_by_name(Stadium, stadium_name)
-    if not ret_obj:
-        # the stadium doesn't exist yet
-        city = get_or_create_city(city_dict)
-        stadium_obj = create_new_stadium(stadium_dict, city)
-    elif len(ret_obj) > 0:
-        raise Exception('Got more than one stadium')
-    else:
-        stadium_obj = ret_obj[0]
-        update_stadium(stadium_obj, stadium_dict)
+    resolution_key = utils.normalize_name(stadium_name)
+    stadium_obj = resolver.get_resolved(Stadium, resolution_key)
+    if stadium_obj is None:
+        ret_obj = search_obj_by_name(Stadium, stadium_name)
+        if not ret_obj:
+            # the stadium doesn't exist yet
+            city = get_or_create_city(city_dict)
+            return resolver.set_resolved(Stadium, resolution_key, create_new_stadium(stadium_dict, city))
+        elif len(ret_obj) > 1:
+            raise Exception('Got more than one stadium')
+        stadium_obj = resolver.set_resolved(Stadium, resolution_key, ret_obj[0])
+    update_stadium(stadium_obj, stadium_dict)
     return stadium_obj
 
 
@@ -254,38 +318,41 @@ def create_new_city(city_dict, region):
         city_attrs['wikipage'] = city_dict['wikipage']
     if region:
         city_attrs['region'] = region
-    return City.objects.create(**city_attrs)
+    city_obj = City.objects.create(**city_attrs)
+    resolver.register_obj(city_obj)
+    return city_obj
 
 
 def update_city(city_obj, city_dict):
     if len(city_dict['name']) > len(city_obj.name):
-        city_obj.name = city_dict['name']
-    city_obj.name = city_dict['name']
+        city_obj.name = utils.format_text_to_save_db(city_dict['name'])
     if 'wikipage' in city_dict.keys():
         city_obj.wikipage = city_dict['wikipage']
     if 'region' in city_dict.keys():
-        region = get_or_create_region(city_dict['region'])
-        city_obj.add(region)
-    city_obj.save()
+        city_obj.region = get_or_create_region(city_dict['region'])
+    resolver.save_obj(city_obj)
+    resolver.register_obj(city_obj)
 
 
 def get_or_create_city(city_dict):
     city_name = utils.normalize_text(city_dict['name'])
-    ret_obj = search_obj_by_name(City, city_name)
-    if not ret_obj:
-        # the city doesn't exist, the default country for
-        # all cities will be paraguay
-        country = Country.objects.get(name__iexact=DEF_COUNTRY)
-        if 'region' in city_dict:
-            region = get_or_create_region(city_dict['region'])
-        else:
-            region = None
-        city_obj = create_new_city(city_dict, region)
-    elif len(ret_obj) > 1:
-        raise Exception('Got more than one city')
-    else:
-        city_obj = ret_obj[0]
-        update_city(city_obj, city_dict)
+    resolution_key = utils.normalize_name(city_name)
+    city_obj = resolver.get_resolved(City, resolution_key)
+    if city_obj is None:
+        ret_obj = search_obj_by_name(City, city_name)
+        if not ret_obj:
+            # the city doesn't exist, the default country for
+            # all cities will be paraguay
+            country = Country.objects.get(normalized_name=DEF_COUNTRY)
+            if 'region' in city_dict:
+                region = get_or_create_region(city_dict['region'])
+            else:
+                region = None
+            return resolver.set_resolved(City, resolution_key, create_new_city(city_dict, region))
+        elif len(ret_obj) > 1:
+            raise Exception('Got more than one city')
+        city_obj = resolver.set_resolved(City, resolution_key, ret_obj[0])
+    update_city(city_obj, city_dict)
     return city_obj
 
 
@@ -297,52 +364,65 @@ def create_new_region(region_dict):
     region_attrs = {'name': utils.format_text_to_save_db(region_dict['name'])}
     if 'wikipage' in region_dict.keys():
         region_attrs['wikipage'] = region_dict['wikipage']
-    return Region.objects.create(**region_attrs)
+    region_obj = Region.objects.create(**region_attrs)
+    resolver.register_obj(region_obj)
+    return region_obj
 
 
 def get_or_create_region(region_dict):
     region_name = utils.normalize_text(region_dict['name'])
+    resolution_key = utils.normalize_name(region_name)
+    region_obj = resolver.get_resolved(Region, resolution_key)
+    if region_obj is not None:
+        return region_obj
     ret_objs = search_obj_by_name(Region, region_name)
     if not ret_objs:
         # the region doesn't exist, the default country for
         # all regions will be paraguay
-        country = Country.objects.get(name__iexact=DEF_COUNTRY)
+        country = Country.objects.get(normalized_name=DEF_COUNTRY)
         region_obj = create_new_region(region_dict)
     elif len(ret_objs) > 1:
         raise Exception('Got more than one region')
     else:
         region_obj = ret_objs[0]
-    return region_obj
+    return resolver.set_resolved(Region, resolution_key, region_obj)
 
 
-def update_team_info_in_tournament(tournament_obj, team_obj, source_obj,
-                                   game_team_obj, team_dict, rival_dict):
-    try:
-        tournament_team_obj = TournamentTeam.objects.get(tournament=tournament_obj,
-                                                         team=team_obj)
-    except ObjectDoesNotExist:
-        tournament_team_obj = TournamentTeam.objects.create(tournament=tournament_obj,
-                                                            team=team_obj,
-                                                            source=source_obj)
-    tournament_team_obj.games += 1
-    if game_team_obj.goals > int(rival_dict['score']):
-        team_result = 'won'
-        tournament_team_obj.wins += 1
-    elif game_team_obj.goals == int(rival_dict['score']):
-        team_result = 'drew'
-        tournament_team_obj.draws += 1
+def get_team_result(team_score, rival_score):
+    if team_score > rival_score:
+        return 'won'
+    elif team_score == rival_score:
+        return 'drew'
     else:
-        team_result = 'lost'
-        tournament_team_obj.losses += 1
-    tournament_team_obj.goals += len(team_dict['goals_info'])
-    tournament_team_obj.goals_conceded += len(rival_dict['goals_info'])
-    tournament_team_obj.points = (3 * tournament_team_obj.wins) + tournament_team_obj.draws
-    tournament_team_obj.save()
-    return team_result
+        return 'lost'
+
+
+def get_game_import_key(round, game):
+    # the same game is found again in the results whatever its score
+    return '{0}:{1}:{2}:{3}'.format(game.get('stage') or '', round,
+                                    utils.normalize_name(game['home_team']['name'], stop_words=()),
+                                    utils.normalize_name(game['away_team']['name'], stop_words=()))
+
+
+def get_game_fingerprint(tournament_obj, round, game):
+    # hash of everything that is imported of the game
+    content = [tournament_obj.id, round, game.get('stage') or '', game.get('date') or '',
+               game.get('stadium') or '']
+    for side in ['home_team', 'away_team']:
+        team_dict = game[side]
+        content.append([team_dict['name'], int(team_dict['score']),
+                        [[goal['author'], int(goal['minute']), goal['type'] or '']
+                         for goal in team_dict['goals_info']]])
+    return hashlib.sha1(json.dumps(content)).hexdigest()
 
 
 def add_team_game(tournament_obj, game_obj, source_obj, team_dict,
-                  rival_dict, home=True):
+                  rival_dict, home=True, unit_of_work=None):
+    # rows are collected in the unit of work, if none is given
+    # they are written before returning
+    flush = unit_of_work is None
+    if flush:
+        unit_of_work = TournamentUnitOfWork(tournament_obj, source_obj)
     team_obj = get_or_create_team(tournament_obj, team_dict, source_obj)
     game_team_attrs = {
         'game': game_obj,
@@ -350,75 +430,33 @@ def add_team_game(tournament_obj, game_obj, source_obj, team_dict,
         'home': home,
         'goals': int(team_dict['score'])
     }
-    game_team_obj = GameTeam.objects.create(**game_team_attrs)
-    # update team info in tournament
-    team_result = update_team_info_in_tournament(tournament_obj, team_obj, source_obj,
-                                                 game_team_obj, team_dict, rival_dict)
+    game_team_obj = GameTeam(**game_team_attrs)
+    unit_of_work.add_game_team(game_team_obj)
+    # the standings of the tournament are updated with the
+    # result of the game when the unit of work is flushed
+    team_result = get_team_result(game_team_obj.goals, int(rival_dict['score']))
     # create goal objects
     game_players = defaultdict(list)
     for goal in team_dict['goals_info']:
-        player_obj = get_or_create_player(tournament_obj, {'name': goal['author']})
+        player_obj = get_or_create_player(tournament_obj, {'name': goal['author']}, team_obj)
         goal_attrs = {
             'author': player_obj,
             'minute': int(goal['minute']),
-            'game': game_obj
+            'game': game_obj,
+            'team': team_obj
         }
         if goal['type']:
             if goal['type'] == 'penalty':
                 goal_attrs['type'] = 'penalty'
             if goal['type'] == 'own goal':
                 goal_attrs['own'] = True
-        goal_obj = Goal.objects.create(**goal_attrs)
-        goal_obj.source.add(source_obj)
-        # create/update game player models
-        try:
-            game_player_obj = GamePlayer.objects.get(game=game_obj, player=player_obj)
-            game_player_obj.goals += 1
-            game_player_obj.save()
-        except ObjectDoesNotExist:
-            game_player_attrs = {
-                'game': game_obj,
-                'player': player_obj,
-                'goals': 1
-            }
-            game_player_obj = GamePlayer.objects.create(**game_player_attrs)
-            game_player_obj.source.add(source_obj)
-        # create/update team player models
-        try:
-            team_player_obj = PlayerTeam.objects.get(player=player_obj)
-            if player_obj.id not in game_players.keys():
-                team_player_obj.games += 1
-                if team_result == 'won':
-                    team_player_obj.wins += 1
-                elif team_result == 'drew':
-                    team_player_obj.draws += 1
-                else:
-                    team_player_obj.losses += 1
-            team_player_obj.goals += 1
-            team_player_obj.save()
-        except ObjectDoesNotExist:
-            team_player_attrs = {
-                'player': player_obj,
-                'team': team_obj,
-                'games': 1,
-                'goals': 1
-            }
-            if team_result == 'won':
-                team_player_attrs['wins'] = 1
-            elif team_result == 'drew':
-                team_player_attrs['draws'] = 1
-            else:
-                team_player_attrs['losses'] = 1
-            player_team_obj = PlayerTeam.objects.create(**team_player_attrs)
-            player_team_obj.source.add(source_obj)
+        unit_of_work.add_goal(Goal(**goal_attrs))
+        # create/update game player and team player models
+        unit_of_work.add_game_player_goal(game_obj, player_obj)
+        unit_of_work.add_player_team_goal(player_obj, team_obj, team_result,
+                                          player_obj.id not in game_players.keys())
         game_players[player_obj.id].append(goal)
+    if flush:
+        unit_of_work.flush()
     return game_players
 
-
-def add_players_to_tournament_list(tournament_players, players):
-    for player_id, goals in players.items():
-        if player_id in tournament_players.keys():
-            tournament_players[player_id].extend(goals)
-        else:
-            tournament_players[player_id].append(goals)
-    return tournament_players
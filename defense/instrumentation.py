@@ -0,0 +1,243 @@
+import json, logging, threading, time
+
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.utils import CursorWrapper
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from functools import wraps
+
+
+logger = logging.getLogger(__name__)
+
+OTHER_STAGE = 'other'  # time and queries out of any stage
+
+_local = threading.local()
+
+
+class ExecuteWrapperCursor(CursorWrapper):
+    """
+    Cursor that runs its queries through wrapper, which is called as
+    the execute wrappers of django >= 2.0
+    """
+
+    def __init__(self, cursor, db, wrapper):
+        super(ExecuteWrapperCursor, self).__init__(cursor, db)
+        self.wrapper = wrapper
+
+    def execute(self, sql, params=None):
+        context = {'connection': self.db, 'cursor': self}
+        return self.wrapper(self.cursor.execute, sql, params, False, context)
+
+    def executemany(self, sql, param_list):
+        context = {'connection': self.db, 'cursor': self}
+        return self.wrapper(self.cursor.executemany, sql, param_list, True, context)
+
+
+@contextmanager
+def execute_wrapper(wrapper, using=DEFAULT_DB_ALIAS):
+    # django 1.11 doesn't ship connection.execute_wrapper(), the cursors
+    # of the connection are wrapped while the context is active. Every
+    # thread has its own connection so the other threads aren't affected
+    db = connections[using]
+    prev_prepare_cursor = db.__dict__.get('_prepare_cursor')
+    prepare_cursor = db._prepare_cursor
+
+    def wrapped_prepare_cursor(cursor):
+        return ExecuteWrapperCursor(prepare_cursor(cursor), db, wrapper)
+
+    db._prepare_cursor = wrapped_prepare_cursor
+    try:
+        yield
+    finally:
+        if prev_prepare_cursor is None:
+            del db._prepare_cursor
+        else:
+            db._prepare_cursor = prev_prepare_cursor
+
+
+class ImportReport(object):
+    """
+    Where an import run spends its time: calls, seconds and queries of
+    every stage (a stage doesn't count the ones of the stages nested in
+    it), rows created per model and pages downloaded
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+        self.stack = []
+        self.rows_created = defaultdict(int)
+        self.http = {'requests': 0, 'bytes': 0, 'time': 0.0, 'max_latency': 0.0}
+        self.num_queries = 0
+        self.db_time = 0.0
+        self.start = time.time()
+        self.total_time = 0.0
+
+    def get_stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'calls': 0, 'time': 0.0, 'queries': 0}
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        frame = {'name': name, 'nested_time': 0.0}
+        self.get_stage(name)['calls'] += 1
+        self.stack.append(frame)
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.stack.pop()
+            self.get_stage(name)['time'] += elapsed - frame['nested_time']
+            if self.stack:
+                self.stack[-1]['nested_time'] += elapsed
+
+    def add_stage_time(self, name, seconds, calls=1):
+        # time measured by someone else, e.g. a scraper
+        stage = self.get_stage(name)
+        stage['calls'] += calls
+        stage['time'] += seconds
+        if self.stack:
+            self.stack[-1]['nested_time'] += seconds
+
+    def execute(self, execute, sql, params, many, context):
+        self.num_queries += 1
+        self.get_stage(self.stack[-1]['name'] if self.stack else OTHER_STAGE)['queries'] += 1
+        start = time.time()
+        try:
+            return execute(sql, params)
+        finally:
+            self.db_time += time.time() - start
+
+    def add_rows(self, model, num_rows):
+        self.rows_created[model.__name__] += num_rows
+
+    def add_scraper_stats(self, stats):
+        self.add_stage_time('fetch', stats.fetch_time, stats.num_requests)
+        self.add_stage_time('parse', stats.parse_time)
+        self.http['requests'] += stats.num_requests
+        self.http['bytes'] += stats.num_bytes
+        self.http['time'] += stats.fetch_time
+        self.http['max_latency'] = max(self.http['max_latency'], stats.max_latency)
+
+    def finish(self):
+        # the time that no stage took is left to the other stage
+        self.total_time = time.time() - self.start
+        other = self.stages.pop(OTHER_STAGE, None) or {'calls': 0, 'time': 0.0, 'queries': 0}
+        staged_time = sum([stage['time'] for stage in self.stages.values()])
+        other['time'] = max(self.total_time - staged_time, 0.0)
+        self.stages[OTHER_STAGE] = other
+
+    def as_dict(self):
+        http = dict(self.http)
+        http['avg_latency'] = http['time'] / http['requests'] if http['requests'] else 0.0
+        return OrderedDict([
+            ('total_time', round(self.total_time, 3)),
+            ('queries', self.num_queries),
+            ('db_time', round(self.db_time, 3)),
+            ('stages', OrderedDict([(name, {'calls': stage['calls'], 'time': round(stage['time'], 3),
+                                            'queries': stage['queries']})
+                                    for name, stage in self.stages.items()])),
+            ('rows_created', OrderedDict(sorted(self.rows_created.items()))),
+            ('http', OrderedDict([(key, round(value, 3) if isinstance(value, float) else value)
+                                  for key, value in sorted(http.items())])),
+        ])
+
+    def to_json(self):
+        return json.dumps(self.as_dict())
+
+
+def format_report(report):
+    # one line summary of a report (as returned by as_dict)
+    stages = ', '.join(['{0} {1:.2f}s/{2}q'.format(name, stage['time'], stage['queries'])
+                        for name, stage in report['stages'].items()])
+    rows = ', '.join(['{0} {1}'.format(num_rows, model)
+                      for model, num_rows in report['rows_created'].items()]) or 'nothing'
+    return '{0} queries in {1:.2f}s ({2}); created {3}; downloaded {4} page(s), {5} bytes'.format(
+        report['queries'], report['total_time'], stages, rows,
+        report['http']['requests'], report['http']['bytes'])
+
+
+def get_current_report():
+    return getattr(_local, 'report', None)
+
+
+@contextmanager
+def instrument_run():
+    """
+    Collects the report of everything done inside the context, in
+    the current thread. Nested runs add to the outermost report
+    """
+    report = get_current_report()
+    if report is not None:
+        yield report
+        return
+    report = ImportReport()
+    _local.report = report
+    try:
+        with execute_wrapper(report.execute):
+            yield report
+    finally:
+        _local.report = None
+        report.finish()
+        logger.info('Import report: %s', report.to_json())
+
+
+@contextmanager
+def stage(name):
+    report = get_current_report()
+    if report is None:
+        yield
+    else:
+        with report.stage(name):
+            yield
+
+
+def timed(name):
+    # decorator that counts the calls to the function in the stage name
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_iter(name, iterable):
+    # counts in the stage name the time taken to produce every item,
+    # not the time the consumer spends with them
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def record_rows(model, num_rows):
+    report = get_current_report()
+    if report is not None and num_rows:
+        report.add_rows(model, num_rows)
+
+
+def record_scraper(scraper):
+    report = get_current_report()
+    if report is not None:
+        report.add_scraper_stats(scraper.stats)
+
+
+###
+# Signals, the rows inserted in bulk are recorded by
+# whoever inserts them
+###
+
+
+@receiver(post_save, dispatch_uid='instrumentation_obj_saved')
+def obj_saved(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        record_rows(sender, 1)
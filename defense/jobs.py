@@ -0,0 +1,177 @@
+
+import logging, threading, time, traceback
+
+from collections import defaultdict
+from datetime import timedelta
+from defense import collectors, instrumentation
+from defense.models import ImportJob
+from defense.resolver import import_run
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from goalkeeper.fetcher import get_default_fetcher
+
+
+logger = logging.getLogger(__name__)
+
+JOB_FUNCTIONS = {
+    'collect_results': collectors.collect_results,
+    'collect_extra_info': collectors.collect_extra_info,
+}
+DEF_POLL_INTERVAL = 5  # seconds
+DEF_STALE_TIMEOUT = 30 * 60  # seconds without progress before a running job is taken as abandoned
+
+
+def enqueue_jobs(tournaments, action):
+    return [ImportJob.objects.create(tournament=tournament_obj, action=action)
+            for tournament_obj in tournaments]
+
+
+def get_last_jobs(tournaments, action):
+    # last job of the action of every tournament
+    last_jobs = {}
+    for job in ImportJob.objects.filter(tournament__in=tournaments, action=action).\
+            select_related('tournament').order_by('id'):
+        last_jobs[job.tournament_id] = job
+    return last_jobs
+
+
+def requeue_stale_jobs(timeout=DEF_STALE_TIMEOUT):
+    # the jobs left running by a worker that died are queued again once
+    # they haven't reported progress for timeout seconds, the ones
+    # claimed before the heartbeat was kept go by their start
+    limit = timezone.now() - timedelta(seconds=timeout)
+    stale_jobs = ImportJob.objects.filter(Q(heartbeat_at__lt=limit) |
+                                          Q(heartbeat_at__isnull=True, started_at__lt=limit),
+                                          status='running')
+    num_requeued = stale_jobs.update(status='pending', started_at=None, heartbeat_at=None)
+    if num_requeued:
+        logger.warning('%s stale job(s) queued again', num_requeued)
+    return num_requeued
+
+
+def resume_jobs(tournaments, action, retry_failed=False, requeue_running=False,
+                stale_timeout=DEF_STALE_TIMEOUT):
+    """
+    Pending jobs of the action for the tournaments that weren't imported
+    yet, the pending jobs left by a previous run are reused. Tournaments
+    whose last job is done are skipped, as the ones whose last job failed
+    or is still running unless they are asked to be queued again. Returns
+    the pending jobs and the ones skipped
+    """
+    requeue_stale_jobs(stale_timeout)
+    last_jobs = get_last_jobs(tournaments, action)
+    pending_jobs, skipped_jobs = [], []
+    for tournament_obj in tournaments:
+        job = last_jobs.get(tournament_obj.id)
+        if job is None or (job.status == 'failed' and retry_failed):
+            job = ImportJob.objects.create(tournament=tournament_obj, action=action)
+        elif job.status == 'running' and requeue_running:
+            # the job was interrupted along with the process that ran it
+            ImportJob.objects.filter(id=job.id).update(status='pending', started_at=None, heartbeat_at=None,
+                                                       error='')
+            job.status = 'pending'
+        if job.status == 'pending':
+            pending_jobs.append(job)
+        else:
+            skipped_jobs.append(job)
+    return pending_jobs, skipped_jobs
+
+
+def claim_next_job(job_ids=None, stale_timeout=DEF_STALE_TIMEOUT):
+    # the conditional update guarantees that a pending job is
+    # claimed by only one worker
+    requeue_stale_jobs(stale_timeout)
+    pending_jobs = ImportJob.objects.filter(status='pending')
+    if job_ids is not None:
+        pending_jobs = pending_jobs.filter(id__in=job_ids)
+    for job_id in pending_jobs.order_by('id').values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        claimed = ImportJob.objects.filter(id=job_id, status='pending').\
+            update(status='running', started_at=now, heartbeat_at=now)
+        if claimed:
+            return ImportJob.objects.select_related('tournament').get(id=job_id)
+    return None
+
+
+def prefetch_pages(jobs):
+    # download at once the pages that the jobs will scrape, the
+    # scrapers then take them from the fetcher instead of the web
+    urls = []
+    for job in jobs.select_related('tournament').prefetch_related('tournament__source'):
+        url = collectors.get_page_url(job.tournament, job.action)
+        if url:
+            urls.append(url)
+    if urls:
+        logger.info('Prefetching %s page(s)', len(urls))
+        get_default_fetcher().prefetch(urls)
+    return urls
+
+
+def run_job(job):
+    def update_progress(processed, total):
+        # the progress tells the other workers that the job is still alive
+        job.processed_items = processed
+        job.total_items = total
+        job.heartbeat_at = timezone.now()
+        job.save(update_fields=['processed_items', 'total_items', 'heartbeat_at'])
+
+    logger.info('Running job %s', job)
+    with instrumentation.instrument_run() as report:
+        try:
+            with import_run():
+                JOB_FUNCTIONS[job.action](job.tournament, defaultdict(list), update_progress)
+            job.status = 'done'
+        except Exception:
+            logger.exception('Job %s failed', job)
+            job.status = 'failed'
+            job.error = traceback.format_exc()
+    # the report is complete once the run is finished, it
+    # doesn't count the save of the job
+    job.report = report.to_json()
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'report', 'finished_at'])
+    return job
+
+
+def run_worker(poll_interval=DEF_POLL_INTERVAL, stop_when_idle=False, job_ids=None,
+               stale_timeout=DEF_STALE_TIMEOUT):
+    try:
+        while True:
+            job = claim_next_job(job_ids, stale_timeout)
+            if job:
+                run_job(job)
+            elif stop_when_idle:
+                break
+            else:
+                time.sleep(poll_interval)
+    finally:
+        # every worker thread has its own database connection
+        connection.close()
+
+
+def run_workers(num_workers=1, poll_interval=DEF_POLL_INTERVAL, stop_when_idle=False, prefetch=True,
+                job_ids=None, stale_timeout=DEF_STALE_TIMEOUT):
+    # with job_ids the workers only process those jobs
+    prefetched_urls = []
+    if prefetch:
+        pending_jobs = ImportJob.objects.filter(status='pending')
+        if job_ids is not None:
+            pending_jobs = pending_jobs.filter(id__in=job_ids)
+        prefetched_urls = prefetch_pages(pending_jobs)
+    try:
+        workers = []
+        for i in range(0, num_workers):
+            worker = threading.Thread(target=run_worker, name='import-worker-{0}'.format(i+1),
+                                      args=(poll_interval, stop_when_idle, job_ids, stale_timeout))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+        # join with timeout so that the main thread can still be interrupted
+        while any([worker.is_alive() for worker in workers]):
+            for worker in workers:
+                worker.join(1)
+    finally:
+        # the pages of the jobs that didn't run (e.g. failed before
+        # scraping) mustn't be served to the next batch
+        get_default_fetcher().discard_prefetched(prefetched_urls)
@@ -0,0 +1,59 @@
+import warnings
+
+from defense import benchmark
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = 'Time the parsers, the scrapers and the import of the recorded fixtures ' \
+           'and compare them with the stored baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stage', action='append', dest='stages', choices=benchmark.STAGES.keys(),
+                            help='Stage to run (all of them by default)')
+        parser.add_argument('--repeat', type=int, default=benchmark.DEF_REPEAT,
+                            help='Times each stage is run, the best time is reported')
+        parser.add_argument('--baseline', default=benchmark.DEF_BASELINE_FILE,
+                            help='File with the results to compare with')
+        parser.add_argument('--save-baseline', action='store_true', default=False,
+                            help='Store the results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=benchmark.DEF_TOLERANCE,
+                            help='Slowdown accepted before a stage is reported as a regression')
+        parser.add_argument('--fail-on-regression', action='store_true', default=False,
+                            help='Exit with an error when a stage regressed')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The benchmark runs against a SQLite test database, '
+                               'use --settings=drfootball.benchmark_settings')
+        # the import is measured on an empty test database, kept in memory
+        # (the test name of the settings is the file database of the tests)
+        test_settings = connection.settings_dict['TEST']
+        test_name, test_settings['NAME'] = test_settings.get('NAME'), None
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with warnings.catch_warnings():
+                # the dates of the rsssf files are naive
+                warnings.simplefilter('ignore', RuntimeWarning)
+                results = benchmark.run_benchmark(options['stages'], options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            test_settings['NAME'] = test_name
+        baseline = benchmark.load_baseline(options['baseline'])
+        self.stdout.write('{0:<20} {1:>10} {2:>8} {3:>12} {4:>10}'.format(
+            'stage', 'time (s)', 'queries', 'memory (kb)', 'baseline'))
+        for name, result in results.items():
+            base = baseline.get(name)
+            ratio = '{0:.2f}x'.format(result['wall_time'] / base['wall_time']) \
+                if base and base['wall_time'] else '-'
+            self.stdout.write('{0:<20} {1:>10.4f} {2:>8} {3:>12} {4:>10}'.format(
+                name, result['wall_time'], result['queries'], result['peak_memory_kb'] or '-', ratio))
+        regressions = benchmark.compare_with_baseline(results, baseline, options['tolerance'])
+        for name, problems in regressions.items():
+            self.stderr.write('{0} regressed: {1}'.format(name, ', '.join(problems)))
+        if options['save_baseline']:
+            benchmark.save_baseline(results, options['baseline'])
+            self.stdout.write('Baseline stored in {0}'.format(options['baseline']))
+        if regressions and options['fail_on_regression']:
+            raise CommandError('{0} stage(s) regressed'.format(len(regressions)))
@@ -0,0 +1,113 @@
+import json, utils
+
+from collections import OrderedDict
+from defense.collectors import LAST_RSSSF_YEAR
+from defense.instrumentation import format_report
+from defense.jobs import JOB_FUNCTIONS, resume_jobs, run_workers
+from defense.models import ImportJob, Tournament
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+
+
+DEF_BATCH_SIZE = 10
+SOURCES = ('rsssf', 'wikipedia', 'all')
+
+
+class Command(BaseCommand):
+    help = 'Import the results or the extra information of the tournaments without the admin. ' \
+           'Every tournament is imported by an import job, so a run that was interrupted ' \
+           'resumes from the tournaments that weren\'t imported yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--action', default='collect_results', choices=sorted(JOB_FUNCTIONS.keys()),
+                            help='What to import of the tournaments')
+        parser.add_argument('--tournament', type=int, action='append', dest='tournament_ids',
+                            help='Id of a tournament to import')
+        parser.add_argument('--from-year', type=int, default=None)
+        parser.add_argument('--to-year', type=int, default=None)
+        parser.add_argument('--championships-file', default=None,
+                            help='CSV with the metadata of the championships (as data/campeonatos.csv), '
+                                 'the tournaments are matched by name and year')
+        parser.add_argument('--source', default='all', choices=SOURCES,
+                            help='Import only the tournaments published in rsssf (until {0}) or in '
+                                 'wikipedia'.format(LAST_RSSSF_YEAR))
+        parser.add_argument('--batch-size', type=int, default=DEF_BATCH_SIZE,
+                            help='Tournaments queued at once, the next batch is queued when the '
+                                 'previous one is finished')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of tournaments imported at the same time')
+        parser.add_argument('--retry-failed', action='store_true', default=False,
+                            help='Import again the tournaments whose last import failed')
+        parser.add_argument('--requeue-running', action='store_true', default=False,
+                            help='Import again the tournaments left running by an interrupted run, '
+                                 'make sure that no other worker is processing them')
+        parser.add_argument('--no-prefetch', action='store_false', dest='prefetch', default=True,
+                            help='Don\'t download the pages of a batch before importing it')
+
+    def get_championships_filter(self, file_name):
+        try:
+            championships = utils.csv_to_dict(file_name)
+        except IOError as e:
+            raise CommandError('Could not read {0}: {1}'.format(file_name, e))
+        championships_filter = Q(pk__in=[])
+        for championship in championships:
+            championships_filter |= Q(name__iexact=championship['name'].strip(),
+                                      year=int(championship['year']))
+        return championships_filter
+
+    def get_tournaments(self, options):
+        tournaments = Tournament.objects.all()
+        if options['tournament_ids']:
+            tournaments = tournaments.filter(id__in=options['tournament_ids'])
+        if options['from_year']:
+            tournaments = tournaments.filter(year__gte=options['from_year'])
+        if options['to_year']:
+            tournaments = tournaments.filter(year__lte=options['to_year'])
+        if options['championships_file']:
+            tournaments = tournaments.filter(self.get_championships_filter(options['championships_file']))
+        if options['source'] == 'rsssf':
+            tournaments = tournaments.filter(year__lte=LAST_RSSSF_YEAR)
+        elif options['source'] == 'wikipedia':
+            tournaments = tournaments.filter(year__gt=LAST_RSSSF_YEAR)
+        return list(tournaments.order_by('year', 'id'))
+
+    def write_job(self, job):
+        if job.report:
+            report = format_report(json.loads(job.report, object_pairs_hook=OrderedDict))
+        else:
+            report = 'no report'
+        line = '{0} {1} [job {2}, {3}]: {4}'.format(job.tournament.name, job.tournament.year, job.id,
+                                                    job.status, report)
+        if job.status == 'failed':
+            self.stderr.write(line)
+        else:
+            self.stdout.write(line)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('The batch size and the number of workers have to be positive')
+        tournaments = self.get_tournaments(options)
+        self.stdout.write('{0} tournament(s) selected'.format(len(tournaments)))
+        num_done, num_failed, num_skipped = 0, 0, 0
+        batch_size = options['batch_size']
+        for i in range(0, len(tournaments), batch_size):
+            # the status of the jobs is the checkpoint, the jobs of
+            # the tournaments already imported aren't queued again
+            pending_jobs, skipped_jobs = resume_jobs(tournaments[i:i+batch_size], options['action'],
+                                                     options['retry_failed'], options['requeue_running'])
+            for job in skipped_jobs:
+                self.stdout.write('Skipping {0} {1}, its last job is {2}'.format(
+                    job.tournament.name, job.tournament.year, job.status))
+            num_skipped += len(skipped_jobs)
+            if not pending_jobs:
+                continue
+            job_ids = [job.id for job in pending_jobs]
+            run_workers(num_workers=min(options['workers'], len(job_ids)), stop_when_idle=True,
+                        prefetch=options['prefetch'], job_ids=job_ids)
+            for job in ImportJob.objects.filter(id__in=job_ids).select_related('tournament').order_by('id'):
+                self.write_job(job)
+                if job.status == 'done':
+                    num_done += 1
+                else:
+                    num_failed += 1
+        self.stdout.write('{0} imported, {1} failed, {2} skipped'.format(num_done, num_failed, num_skipped))
@@ -0,0 +1,24 @@
+from defense.jobs import run_workers, DEF_POLL_INTERVAL, DEF_STALE_TIMEOUT
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Process the import jobs queued from the admin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of jobs processed at the same time')
+        parser.add_argument('--poll-interval', type=int, default=DEF_POLL_INTERVAL,
+                            help='Seconds to wait before checking again for new jobs')
+        parser.add_argument('--stale-timeout', type=int, default=DEF_STALE_TIMEOUT,
+                            help='Seconds without progress after which a running job is taken as '
+                                 'abandoned by its worker and queued again')
+        parser.add_argument('--once', action='store_true', default=False,
+                            help='Stop when there are no more pending jobs')
+        parser.add_argument('--no-prefetch', action='store_false', dest='prefetch', default=True,
+                            help='Don\'t download the pages of the pending jobs before processing them')
+
+    def handle(self, *args, **options):
+        run_workers(num_workers=options['workers'], poll_interval=options['poll_interval'],
+                    stop_when_idle=options['once'], prefetch=options['prefetch'],
+                    stale_timeout=options['stale_timeout'])
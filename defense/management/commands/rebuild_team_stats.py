@@ -0,0 +1,14 @@
+from defense.team_stats import rebuild_team_stats
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Recompute the all-time stats of the teams from the results of their games'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--team', type=int, action='append', dest='team_ids',
+                            help='Id of a team to recompute (all the teams by default)')
+
+    def handle(self, *args, **options):
+        num_updated = rebuild_team_stats(options['team_ids'])
+        self.stdout.write('{0} team(s) updated'.format(num_updated))
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:48
+from __future__ import unicode_literals
+
+import unicodedata
+
+from django.db import migrations, models
+from django.db.models import Case, CharField, Value, When
+
+
+BATCH_SIZE = 500
+NAME_STOP_WORDS = ('club', 'estadio')
+NORMALIZED_FIELDS = [
+    ('City', 'name', 'normalized_name', NAME_STOP_WORDS),
+    ('Country', 'name', 'normalized_name', NAME_STOP_WORDS),
+    ('Player', 'last_name', 'normalized_last_name', ()),
+    ('Region', 'name', 'normalized_name', NAME_STOP_WORDS),
+    ('Stadium', 'name', 'normalized_name', NAME_STOP_WORDS),
+    ('Team', 'name', 'normalized_name', NAME_STOP_WORDS),
+]
+
+
+def normalize_name(name, stop_words):
+    # copy of utils.normalize_name as it was when the names were added,
+    # later changes to it can't change what the migration writes
+    if not isinstance(name, unicode):
+        name = unicode(name, 'utf-8')
+    words = unicodedata.normalize('NFD', name).encode('ascii', 'ignore').lower().split()
+    return ' '.join([word for word in words if word not in stop_words])
+
+
+def backfill_normalized_names(apps, schema_editor):
+    # historical models don't run the save() of the models, so the
+    # normalized names are computed here and written with a single
+    # UPDATE ... CASE for every batch of rows
+    for model_name, field, normalized_field, stop_words in NORMALIZED_FIELDS:
+        model = apps.get_model('defense', model_name)
+        values = []
+        for pk, name, normalized_name in model.objects.values_list('pk', field, normalized_field):
+            value = normalize_name(name, stop_words)
+            if value != normalized_name:
+                values.append((pk, value))
+        for i in range(0, len(values), BATCH_SIZE):
+            batch = values[i:i+BATCH_SIZE]
+            whens = [When(pk=pk, then=Value(value)) for pk, value in batch]
+            model.objects.filter(pk__in=[pk for pk, _ in batch]).\
+                update(**{normalized_field: Case(*whens, output_field=CharField())})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defense', '0027_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='normalized_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='normalized_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='normalized_last_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='region',
+            name='normalized_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='stadium',
+            name='normalized_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='normalized_name',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(backfill_normalized_names, migrations.RunPython.noop),
+    ]
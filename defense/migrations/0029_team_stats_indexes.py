@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 15:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defense', '0028_normalized_names'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['total_games'], name='defense_tea_total_g_2cf617_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['wins'], name='defense_tea_wins_0d40f6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(fields=['goals'], name='defense_tea_goals_2bd22a_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defense', '0029_team_stats_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='report',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
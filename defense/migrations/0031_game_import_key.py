@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 16:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defense', '0030_importjob_report'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='import_key',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='goal',
+            name='team',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='defense.Team'),
+        ),
+        migrations.AddIndex(
+            model_name='game',
+            index=models.Index(fields=['tournament', 'import_key'], name='defense_gam_tournam_d25b62_idx'),
+        ),
+    ]
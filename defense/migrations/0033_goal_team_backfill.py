@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+from django.db import migrations
+
+
+BATCH_SIZE = 500
+IDS_CHUNK_SIZE = 1000  # ids of every IN (...), long lists can exceed the max_allowed_packet of mysql
+
+
+def chunks(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), IDS_CHUNK_SIZE):
+        yield ids[i:i+IDS_CHUNK_SIZE]
+
+
+def backfill_goal_teams(apps, schema_editor):
+    # the goals imported before they kept their side are given the side
+    # of the game that their author played for, so that a new import of
+    # their games can take them back from the players' teams. The goals
+    # whose author played for both sides, or none, are left without side
+    Goal = apps.get_model('defense', 'Goal')
+    GameTeam = apps.get_model('defense', 'GameTeam')
+    PlayerTeam = apps.get_model('defense', 'PlayerTeam')
+    goals = list(Goal.objects.filter(team__isnull=True).values_list('id', 'game_id', 'author_id'))
+    if not goals:
+        return
+    game_ids = set([game_id for _, game_id, _ in goals])
+    author_ids = set([author_id for _, _, author_id in goals])
+    game_teams, player_teams = defaultdict(set), defaultdict(set)
+    for game_ids_chunk in chunks(game_ids):
+        for game_id, team_id in GameTeam.objects.filter(game_id__in=game_ids_chunk).\
+                values_list('game_id', 'team_id'):
+            game_teams[game_id].add(team_id)
+    for author_ids_chunk in chunks(author_ids):
+        for player_id, team_id in PlayerTeam.objects.filter(player_id__in=author_ids_chunk).\
+                values_list('player_id', 'team_id'):
+            player_teams[player_id].add(team_id)
+    team_goals = defaultdict(list)
+    for goal_id, game_id, author_id in goals:
+        teams = game_teams[game_id] & player_teams[author_id]
+        if len(teams) == 1:
+            team_goals[teams.pop()].append(goal_id)
+    for team_id, goal_ids in team_goals.items():
+        for i in range(0, len(goal_ids), BATCH_SIZE):
+            Goal.objects.filter(id__in=goal_ids[i:i+BATCH_SIZE]).update(team_id=team_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('defense', '0032_importjob_heartbeat_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_goal_teams, migrations.RunPython.noop),
+    ]
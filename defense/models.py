@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 from django.db import models
+from utils import normalize_name
 
 # Define constants
 LEG_TYPES = (
@@ -82,6 +83,18 @@ TACTICS = (
     ('other', 'Other'),
 )
 
+JOB_ACTIONS = (
+    ('collect_results', 'Collect Tournament Results'),
+    ('collect_extra_info', 'Collect Extra Information'),
+)
+
+JOB_STATUSES = (
+    ('pending', 'Pending'),
+    ('running', 'Running'),
+    ('done', 'Done'),
+    ('failed', 'Failed'),
+)
+
 
 # used
 class Source(models.Model):
@@ -95,6 +108,11 @@ class Source(models.Model):
 # used
 class Country(models.Model):
     name = models.CharField(max_length=100)
+    normalized_name = models.CharField(max_length=100, default='', editable=False, db_index=True)
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super(Country, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return "%s" % self.name
@@ -102,18 +120,28 @@ class Country(models.Model):
 # used
 class Region(models.Model):
     name = models.CharField(max_length=100)
+    normalized_name = models.CharField(max_length=100, default='', editable=False, db_index=True)
     country = models.ForeignKey(Country)
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super(Region, self).save(*args, **kwargs)
+
     def __unicode__(self):
         return "%s, %s" % (self.name, self.country.name)
 
 # used
 class City(models.Model):
     name = models.CharField(max_length=100)
+    normalized_name = models.CharField(max_length=100, default='', editable=False, db_index=True)
     region = models.ForeignKey(Region, blank=True, null=True)
     country = models.ForeignKey(Country, default=1)  # 1 == Paraguay
     wikipage = models.URLField(blank=True, null=True)
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super(City, self).save(*args, **kwargs)
+
     def __unicode__(self):
         if self.region:
             return "%s, %s" % (self.name, self.region.country.name)
@@ -123,6 +151,7 @@ class City(models.Model):
 # used
 class Stadium(models.Model):
     name = models.CharField(max_length=100)
+    normalized_name = models.CharField(max_length=100, default='', editable=False, db_index=True)
     city = models.ForeignKey(City)
     capacity = models.IntegerField(null=True, blank=True)
     picture = models.ImageField(null=True, blank=True)
@@ -132,6 +161,10 @@ class Stadium(models.Model):
     longitude = models.FloatField(null=True, blank=True)
     wikipage = models.URLField(blank=True, null=True)
 
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super(Stadium, self).save(*args, **kwargs)
+
     def __unicode__(self):
         return "%s, %s" % (self.name, self.city)
 
@@ -139,6 +172,7 @@ class Stadium(models.Model):
 class Player(models.Model):
     first_name = models.CharField(max_length=100, default='')
     last_name = models.CharField(max_length=100, default='')
+    normalized_last_name = models.CharField(max_length=100, default='', editable=False, db_index=True)
     nationality = models.ForeignKey(Country, null=True, blank=True)
     birth_date = models.DateField(null=True, blank=True)
     picture = models.ImageField(null=True, blank=True)
@@ -150,6 +184,11 @@ class Player(models.Model):
                            choices=LEG_TYPES)
     wikipage = models.URLField(blank=True, null=True)
 
+    def save(self, *args, **kwargs):
+        # 'club' and 'estadio' are only dropped from names of teams and stadiums
+        self.normalized_last_name = normalize_name(self.last_name, stop_words=())
+        super(Player, self).save(*args, **kwargs)
+
     def __unicode__(self):
         return "{0} {1}".format(self.first_name, self.last_name)
 
@@ -180,6 +219,7 @@ class Referee(models.Model):
 # used
 class Team(models.Model):
     name = models.CharField(max_length=100)
+    normalized_name = models.CharField(max_length=100, default='', editable=False, db_index=True)
     city = models.ForeignKey(City)
     stadium = models.ManyToManyField(Stadium, through='StadiumTeam')
     badge = models.ImageField(null=True, blank=True)
@@ -198,6 +238,18 @@ class Team(models.Model):
     goals_conceded = models.IntegerField(default=0)
     wikipage = models.URLField(blank=True, null=True)
 
+    class Meta:
+        # all-time tables are sorted by the stats kept in the teams
+        indexes = [
+            models.Index(fields=['total_games']),
+            models.Index(fields=['wins']),
+            models.Index(fields=['goals']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super(Team, self).save(*args, **kwargs)
+
     def __unicode__(self):
         return "%s, %s" % (self.name, self.city)
 
@@ -330,6 +382,16 @@ class Game(models.Model):
     audience = models.IntegerField(null=True, blank=True)
     players = models.ManyToManyField(Player, through='GamePlayer')
     source = models.ManyToManyField(Source)
+    # identity of the game among the results of its tournament and hash of the
+    # results it was imported from, the games imported again are skipped
+    # while their results don't change
+    import_key = models.CharField(max_length=255, null=True, blank=True, editable=False)
+    fingerprint = models.CharField(max_length=40, blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tournament', 'import_key']),
+        ]
 
     def __unicode__(self):
         if self.datetime:
@@ -379,6 +441,8 @@ class Goal(models.Model):
     game = models.ForeignKey(Game, on_delete=models.CASCADE)
     assistant = models.ForeignKey(Player, on_delete=models.CASCADE, null=True,
                                   related_name='assistances')
+    # side of the game that the goal was listed under
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, null=True, blank=True)
     source = models.ManyToManyField(Source)
 
     def __unicode__(self):
@@ -393,4 +457,22 @@ class Card(models.Model):
     source = models.ManyToManyField(Source)
 
     def __unicode__(self):
-        return "%s, %s, %s" % (self.author, self.type, self.minute)
\ No newline at end of file
+        return "%s, %s, %s" % (self.author, self.type, self.minute)
+
+
+class ImportJob(models.Model):
+    tournament = models.ForeignKey(Tournament, on_delete=models.CASCADE)
+    action = models.CharField(max_length=50, choices=JOB_ACTIONS)
+    status = models.CharField(max_length=50, default='pending', choices=JOB_STATUSES,
+                              db_index=True)
+    processed_items = models.IntegerField(default=0)
+    total_items = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # last progress reported by the worker
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    report = models.TextField(blank=True, default='')  # json of the defense.instrumentation report
+
+    def __unicode__(self):
+        return "%s: %s (%s)" % (self.get_action_display(), self.tournament.name, self.status)
@@ -0,0 +1,99 @@
+import json
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+UNIQUE_FIELDS = ('id', 'pk')
+
+
+def reverse_ordering(ordering):
+    return tuple([order[1:] if order.startswith('-') else '-' + order for order in ordering])
+
+
+def get_seek_filter(ordering, values):
+    # rows that come after the values in the ordering given: the
+    # first fields are equal and the next one is past its value
+    seek, equal = None, Q()
+    for order, value in zip(ordering, values):
+        field_name = order.lstrip('-')
+        after = equal & Q(**{field_name + ('__lt' if order.startswith('-') else '__gt'): value})
+        seek = after if seek is None else seek | after
+        equal &= Q(**{field_name: value})
+    return seek
+
+
+class ApiPagination(CursorPagination):
+    """
+    Cursor pagination ordered by the cursor_ordering of the view, the
+    pages are read with an indexed seek instead of an offset. The cursor
+    keeps the values of all the fields of the ordering, which ends with
+    the id, so rows that share the first fields (e.g. the teams of a
+    tournament) are neither skipped nor repeated between pages
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = ('id',)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = tuple(getattr(view, 'cursor_ordering', self.ordering))
+        if ordering[-1].lstrip('-') not in UNIQUE_FIELDS:
+            ordering += ('id',)
+        return ordering
+
+    def decode_position(self, position):
+        try:
+            values = json.loads(position)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+        # the previous pages are read backwards from the first row of the page
+        ordering = reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(get_seek_filter(ordering, self.decode_position(position)))
+        # one more row tells whether there is a page after this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > len(self.page)
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for order in ordering:
+            field_name = order.lstrip('-')
+            value = instance[field_name] if isinstance(instance, dict) else getattr(instance, field_name)
+            values.append(value if isinstance(value, (int, long)) else unicode(value))
+        return json.dumps(values)
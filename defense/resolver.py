@@ -0,0 +1,409 @@
+
+import logging, threading, utils
+
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from defense import instrumentation
+from difflib import SequenceMatcher
+
+
+logger = logging.getLogger(__name__)
+
+SIMILARITY_THRESHOLD = 0.50
+
+_local = threading.local()
+
+
+def normalize_key(name):
+    return utils.normalize_text(name).strip().lower()
+
+
+def get_trigrams(key):
+    return set([key[i:i+3] for i in range(0, len(key)-2)])
+
+
+def length_window(length, min_ratio):
+    # SequenceMatcher.ratio() can't be greater than 2*min(la,lb)/(la+lb), so
+    # only names whose length is inside this window can reach min_ratio
+    if min_ratio <= 0:
+        return 0, float('inf')
+    return length * min_ratio / (2 - min_ratio), length * (2 - min_ratio) / min_ratio
+
+
+class NameIndex(object):
+    """
+    In-memory index of the objects of a model keyed on their normalized
+    names. It answers the same questions that search_obj_by_name asks to
+    the database (icontains and most similar strings) without scanning
+    the whole table for each mention
+    """
+
+    def __init__(self, objs=()):
+        self.objs = {}
+        self.keys = {}
+        self.exact_keys = defaultdict(set)
+        self.normalized_names = defaultdict(set)
+        self.sorted_keys = []
+        self.trigrams = defaultdict(set)
+        self.lengths = []
+        for obj in objs:
+            self.add(obj)
+
+    def __len__(self):
+        return len(self.objs)
+
+    def __sort(self, pks):
+        return [self.objs[pk] for pk in sorted(pks)]
+
+    def add(self, obj):
+        if obj.pk in self.objs:
+            self.remove(obj)
+        key = normalize_key(obj.name)
+        self.objs[obj.pk] = obj
+        # saves can be deferred to the end of the run, so the normalized
+        # name is computed instead of taken from the object
+        normalized_name = utils.normalize_name(obj.name)
+        self.keys[obj.pk] = (key, obj.name, normalized_name)
+        self.exact_keys[key].add(obj.pk)
+        self.normalized_names[normalized_name].add(obj.pk)
+        insort(self.sorted_keys, (key, obj.pk))
+        for trigram in get_trigrams(key):
+            self.trigrams[trigram].add(obj.pk)
+        insort(self.lengths, (len(obj.name), obj.pk))
+
+    def remove(self, obj):
+        if obj.pk not in self.objs:
+            return
+        key, name, normalized_name = self.keys.pop(obj.pk)
+        del self.objs[obj.pk]
+        self.exact_keys[key].discard(obj.pk)
+        if not self.exact_keys[key]:
+            del self.exact_keys[key]
+        self.normalized_names[normalized_name].discard(obj.pk)
+        if not self.normalized_names[normalized_name]:
+            del self.normalized_names[normalized_name]
+        del self.sorted_keys[bisect_left(self.sorted_keys, (key, obj.pk))]
+        for trigram in get_trigrams(key):
+            self.trigrams[trigram].discard(obj.pk)
+            if not self.trigrams[trigram]:
+                del self.trigrams[trigram]
+        del self.lengths[bisect_left(self.lengths, (len(name), obj.pk))]
+
+    def update(self, obj):
+        # the name of the object may have changed
+        self.add(obj)
+
+    def exact(self, name):
+        return self.__sort(self.exact_keys.get(normalize_key(name), ()))
+
+    def normalized(self, name):
+        # equivalent to normalized_name=utils.normalize_name(name)
+        return self.__sort(self.normalized_names.get(utils.normalize_name(name), ()))
+
+    def prefix(self, name):
+        key = normalize_key(name)
+        start = bisect_left(self.sorted_keys, (key,))
+        pks = []
+        for obj_key, pk in self.sorted_keys[start:]:
+            if not obj_key.startswith(key):
+                break
+            pks.append(pk)
+        return self.__sort(pks)
+
+    def __trigram_candidates(self, key):
+        key_trigrams = get_trigrams(key)
+        if not key_trigrams:
+            return None
+        postings = sorted([self.trigrams.get(trigram, set()) for trigram in key_trigrams], key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def contains(self, name):
+        # equivalent to name__icontains
+        key = normalize_key(name)
+        candidates = self.__trigram_candidates(key)
+        if candidates is None:
+            candidates = self.objs.keys()
+        return self.__sort([pk for pk in candidates if key in self.keys[pk][0]])
+
+    def most_similar(self, name, threshold=SIMILARITY_THRESHOLD):
+        # equivalent to search_most_similar_strings, the objects sharing
+        # trigrams with the name are compared first so that the best ratio
+        # found bounds the lengths of the remaining names worth comparing
+        key = normalize_key(name)
+        ratios = {}
+        best = 0.0
+        seeds = set()
+        for trigram in get_trigrams(key):
+            seeds.update(self.trigrams.get(trigram, ()))
+        for pk in seeds:
+            ratios[pk] = SequenceMatcher(None, name, self.keys[pk][1]).ratio()
+            best = max(best, ratios[pk])
+        min_len, max_len = length_window(len(name), max(best, threshold))
+        start = bisect_left(self.lengths, (int(min_len),))
+        end = bisect_right(self.lengths, (int(max_len + 1e-9) + 1,))
+        for obj_len, pk in self.lengths[start:end]:
+            if pk in ratios:
+                continue
+            sm = SequenceMatcher(None, name, self.keys[pk][1])
+            if sm.real_quick_ratio() < best or sm.quick_ratio() < best:
+                continue
+            ratios[pk] = sm.ratio()
+            best = max(best, ratios[pk])
+        if best <= threshold:
+            return []
+        return self.__sort([pk for pk, ratio in ratios.items() if ratio == best])
+
+
+def get_initial(first_name):
+    return utils.normalize_name(first_name, stop_words=())[:1]
+
+
+class PlayerIndex(object):
+    """
+    In-memory index of the players keyed on their normalized last name and
+    the initial of their first name, joined with the teams they played for
+    and the teams of the tournaments. A scorer is resolved with a couple of
+    lookups instead of querying the players that share the last name and
+    then the teams of every one of them
+    """
+
+    def __init__(self, players=(), player_teams=()):
+        self.players = {}
+        self.keys = {}
+        self.last_names = defaultdict(lambda: defaultdict(set))  # last name -> initial -> pks
+        self.teams = defaultdict(set)
+        self.tournament_teams = {}
+        for player in players:
+            self.add(player)
+        for player_id, team_id in player_teams:
+            self.add_team(player_id, team_id)
+
+    def __len__(self):
+        return len(self.players)
+
+    def add(self, player):
+        if player.pk in self.players:
+            self.remove(player)
+        key = (utils.normalize_name(player.last_name, stop_words=()), get_initial(player.first_name))
+        self.players[player.pk] = player
+        self.keys[player.pk] = key
+        self.last_names[key[0]][key[1]].add(player.pk)
+
+    def remove(self, player):
+        if player.pk not in self.players:
+            return
+        last_name, initial = self.keys.pop(player.pk)
+        del self.players[player.pk]
+        initials = self.last_names[last_name]
+        initials[initial].discard(player.pk)
+        if not initials[initial]:
+            del initials[initial]
+        if not initials:
+            del self.last_names[last_name]
+
+    def update(self, player):
+        # the first name of the player may have changed
+        self.add(player)
+
+    def add_team(self, player_id, team_id):
+        self.teams[player_id].add(team_id)
+
+    def has_tournament(self, tournament_id):
+        return tournament_id in self.tournament_teams
+
+    def add_tournament_teams(self, tournament_id, team_ids):
+        self.tournament_teams.setdefault(tournament_id, set()).update(team_ids)
+
+    def candidates(self, last_name, initial):
+        # the players without initial match any initial, as the
+        # names without initial match any player
+        initials = self.last_names.get(last_name, {})
+        if not initial:
+            return set().union(*initials.values())
+        return initials.get(initial, set()) | initials.get('', set())
+
+    def resolve(self, last_name, initial, team_id=None, tournament_id=None):
+        """
+        Player with the last name and initial given (None if there isn't
+        any). The ties are broken by preferring the players of the team,
+        then the ones of the teams of the tournament, then the ones whose
+        initial is the same and finally the oldest player
+        """
+        candidates = self.candidates(last_name, initial)
+        if not candidates:
+            return None
+        tournament_teams = self.tournament_teams.get(tournament_id, set())
+
+        def rank(pk):
+            teams = self.teams.get(pk, set())
+            return (team_id not in teams, not (teams & tournament_teams),
+                    self.keys[pk][1] != initial, pk)
+        return self.players[min(candidates, key=rank)]
+
+
+def get_field_values(obj):
+    # the importer assigns utf-8 encoded strings, while the ones
+    # loaded from the database are unicode
+    return [utils.to_unicode(getattr(obj, field.attname)) for field in obj._meta.concrete_fields]
+
+
+def get_changed_fields(obj, snapshot):
+    """
+    Names of the fields whose values differ from the snapshot, plus the
+    ones that save() derives from them (the non editable ones, as the
+    normalized names). The other fields aren't written, so the columns
+    updated in the database since the object was loaded (e.g. the stats
+    of the teams) aren't overwritten
+    """
+    fields = obj._meta.concrete_fields
+    changed = [field.name for field, value, loaded_value in zip(fields, get_field_values(obj), snapshot)
+               if not field.primary_key and value != loaded_value]
+    if not changed:
+        return []
+    return changed + [field.name for field in fields
+                      if not field.editable and not field.primary_key and field.name not in changed]
+
+
+class ImportRun(object):
+    """
+    State shared by all the lookups done during a single import run. Besides
+    the name indexes, it keeps a single instance per row (identity map), the
+    object each name was resolved to and the objects modified, which are
+    saved once when the run finishes instead of every time they change
+    """
+
+    def __init__(self):
+        self.name_indexes = {}
+        self.identity_map = {}
+        self.snapshots = {}
+        self.resolved = {}
+        self.dirty = OrderedDict()
+        self.player_index = None
+
+    def get_name_index(self, model):
+        if model not in self.name_indexes:
+            self.name_indexes[model] = NameIndex(model.objects.all())
+        return self.name_indexes[model]
+
+    def get_player_index(self, load_index):
+        if self.player_index is None:
+            self.player_index = load_index()
+        return self.player_index
+
+    def add_obj(self, obj):
+        # the first instance seen of a row is the one used during the run
+        key = (type(obj), obj.pk)
+        if key not in self.identity_map:
+            self.identity_map[key] = obj
+            self.snapshots[key] = get_field_values(obj)
+        return self.identity_map[key]
+
+    def get_resolved(self, model, key):
+        return self.resolved.get((model, key))
+
+    def set_resolved(self, model, key, obj):
+        obj = self.add_obj(obj)
+        self.resolved[(model, key)] = obj
+        return obj
+
+    def save_obj(self, obj):
+        self.add_obj(obj)
+        self.dirty[(type(obj), obj.pk)] = obj
+
+    @instrumentation.timed('write')
+    def flush(self):
+        # objects whose fields ended as they were loaded aren't saved,
+        # the others only write the fields that changed
+        num_saved = 0
+        for key, obj in self.dirty.items():
+            update_fields = get_changed_fields(obj, self.snapshots[key])
+            if update_fields:
+                obj.save(update_fields=update_fields)
+                self.snapshots[key] = get_field_values(obj)
+                num_saved += 1
+        self.dirty.clear()
+        return num_saved
+
+    def flush_after_failure(self):
+        # the error of the run is the one reported, not the one of the flush
+        try:
+            return self.flush()
+        except Exception:
+            logger.exception('Could not save the objects modified by a failed import run')
+            return 0
+
+
+def get_current_run():
+    return getattr(_local, 'run', None)
+
+
+@contextmanager
+def import_run():
+    prev_run = get_current_run()
+    run = prev_run or ImportRun()
+    _local.run = run
+    try:
+        yield run
+    except Exception:
+        # the objects modified before the failure are still written,
+        # as they were when their saves weren't deferred
+        if prev_run is None:
+            run.flush_after_failure()
+        raise
+    else:
+        # the outermost run writes the objects modified
+        if prev_run is None:
+            run.flush()
+    finally:
+        _local.run = prev_run
+
+
+def get_name_index(model):
+    run = get_current_run()
+    if run:
+        return run.get_name_index(model)
+    else:
+        return None
+
+
+def get_player_index(load_index):
+    # load_index builds the index the first time it is asked for in a run
+    run = get_current_run()
+    if run:
+        return run.get_player_index(load_index)
+    else:
+        return None
+
+
+def register_obj(obj):
+    # keep the indexes of the current run (if any) up to date
+    run = get_current_run()
+    if run and type(obj) in run.name_indexes:
+        run.name_indexes[type(obj)].update(obj)
+
+
+def get_resolved(model, key):
+    # object that the key was resolved to earlier in the current run
+    run = get_current_run()
+    if run:
+        return run.get_resolved(model, key)
+    else:
+        return None
+
+
+def set_resolved(model, key, obj):
+    run = get_current_run()
+    if run:
+        return run.set_resolved(model, key, obj)
+    else:
+        return obj
+
+
+def save_obj(obj):
+    # during an import run the save is deferred until the run finishes
+    run = get_current_run()
+    if run:
+        run.save_obj(obj)
+    else:
+        obj.save()
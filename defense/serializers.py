@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from defense.models import Team, Tournament, TournamentTeam, TournamentPlayer, Game, GameTeam, Goal
+from rest_framework import serializers
+
+
+class TournamentSerializer(serializers.ModelSerializer):
+    country = serializers.StringRelatedField()
+
+    class Meta:
+        model = Tournament
+        fields = ('id', 'name', 'year', 'country', 'league', 'start_date', 'end_date', 'edition',
+                  'points_for_victory', 'rounds', 'number_of_teams', 'system', 'season_champion')
+
+
+class TeamSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Team
+        fields = ('id', 'name', 'total_games', 'wins', 'draws', 'losses', 'goals', 'goals_conceded')
+
+
+class TournamentTeamSerializer(serializers.ModelSerializer):
+    team_name = serializers.CharField(source='team.name', read_only=True)
+
+    class Meta:
+        model = TournamentTeam
+        fields = ('id', 'tournament', 'team', 'team_name', 'final_position', 'points', 'games',
+                  'wins', 'draws', 'losses', 'goals', 'goals_conceded')
+
+
+class TournamentPlayerSerializer(serializers.ModelSerializer):
+    player_name = serializers.CharField(source='player.__unicode__', read_only=True)
+
+    class Meta:
+        model = TournamentPlayer
+        fields = ('id', 'tournament', 'player', 'player_name', 'goals')
+
+
+class GameTeamSerializer(serializers.ModelSerializer):
+    team_name = serializers.CharField(source='team.name', read_only=True)
+
+    class Meta:
+        model = GameTeam
+        fields = ('team', 'team_name', 'home', 'goals')
+
+
+class GoalSerializer(serializers.ModelSerializer):
+    author_name = serializers.CharField(source='author.__unicode__', read_only=True)
+
+    class Meta:
+        model = Goal
+        fields = ('id', 'game', 'author', 'author_name', 'minute', 'type', 'own')
+
+
+class GameSerializer(serializers.ModelSerializer):
+    stadium_name = serializers.CharField(source='stadium.name', read_only=True, allow_null=True)
+    teams = GameTeamSerializer(source='gameteam_set', many=True, read_only=True)
+    goals = GoalSerializer(source='goal_set', many=True, read_only=True)
+
+    class Meta:
+        model = Game
+        fields = ('id', 'tournament', 'round', 'stage', 'datetime', 'stadium', 'stadium_name',
+                  'audience', 'teams', 'goals')
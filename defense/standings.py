@@ -0,0 +1,157 @@
+
+from collections import OrderedDict
+from defense import cache, instrumentation
+from defense.models import GameTeam, Team, TournamentTeam
+from defense.unit_of_work import bulk_update, BATCH_SIZE
+from django.db import transaction
+
+
+STANDINGS_FIELDS = ['points', 'games', 'wins', 'draws', 'losses', 'goals',
+                    'goals_conceded', 'final_position']
+
+
+def get_game_result(game_obj):
+    # list of (team id, goals) of each side of the game
+    return [(game_team.team_id, game_team.goals) for game_team in game_obj.gameteam_set.all()]
+
+
+class Standings(object):
+    """
+    Table of a tournament computed in memory from the results of
+    its games
+    """
+
+    def __init__(self, tournament_obj):
+        self.tournament_obj = tournament_obj
+        self.points_for_victory = tournament_obj.points_for_victory
+        self.records = OrderedDict()
+        self.team_names = {}
+
+    def __get_record(self, team_id):
+        if team_id not in self.records:
+            self.records[team_id] = {'games': 0, 'wins': 0, 'draws': 0, 'losses': 0,
+                                     'goals': 0, 'goals_conceded': 0}
+        return self.records[team_id]
+
+    def add_result(self, game_result, sign=1):
+        # sign=-1 takes back a result that was previously added
+        if len(game_result) != 2:
+            return
+        (team_id, goals), (rival_id, rival_goals) = game_result
+        for team_id, goals, rival_goals in [(team_id, goals, rival_goals),
+                                            (rival_id, rival_goals, goals)]:
+            record = self.__get_record(team_id)
+            record['games'] += sign
+            if goals > rival_goals:
+                record['wins'] += sign
+            elif goals == rival_goals:
+                record['draws'] += sign
+            else:
+                record['losses'] += sign
+            record['goals'] += sign * goals
+            record['goals_conceded'] += sign * rival_goals
+
+    def get_points(self, team_id):
+        record = self.records[team_id]
+        return self.points_for_victory * record['wins'] + record['draws']
+
+    def get_table(self):
+        # tie-breakers: points, goal difference, goals scored,
+        # wins and finally the name of the team
+        def sort_key(team_id):
+            record = self.records[team_id]
+            return (-self.get_points(team_id), -(record['goals'] - record['goals_conceded']),
+                    -record['goals'], -record['wins'], self.team_names.get(team_id, ''), team_id)
+        return sorted(self.records.keys(), key=sort_key)
+
+    def load_game_teams(self):
+        # single pass over the sides of the tournament's games, which come
+        # ordered by game so the two sides of a game are consecutive
+        game_teams = GameTeam.objects.filter(game__tournament=self.tournament_obj).\
+            order_by('game_id', 'id').values_list('game_id', 'team_id', 'goals', 'team__name')
+        current_game, game_result = None, []
+        for game_id, team_id, goals, team_name in game_teams:
+            self.team_names[team_id] = team_name
+            if game_id != current_game:
+                self.add_result(game_result)
+                current_game, game_result = game_id, []
+            game_result.append((team_id, goals))
+        self.add_result(game_result)
+
+    def load_tournament_teams(self, tournament_teams, with_stats=True):
+        for tournament_team in tournament_teams:
+            if tournament_team.team_id in self.records:
+                continue
+            self.team_names[tournament_team.team_id] = tournament_team.team.name
+            record = self.__get_record(tournament_team.team_id)
+            if with_stats:
+                for field in record.keys():
+                    record[field] = getattr(tournament_team, field)
+
+    def load_team_names(self):
+        # the teams that came only with a result have no name yet,
+        # which breaks the last ties of the table
+        team_ids = [team_id for team_id in self.records.keys() if team_id not in self.team_names]
+        if team_ids:
+            self.team_names.update(Team.objects.filter(id__in=team_ids).values_list('id', 'name'))
+
+    def save(self, tournament_teams, source_obj=None):
+        # tournament_teams are the existing rows of the tournament, only the
+        # ones that changed are written back
+        self.load_team_names()
+        existing = OrderedDict()
+        for tournament_team in tournament_teams:
+            existing.setdefault(tournament_team.team_id, tournament_team)
+        new_tts, updated_tts = [], []
+        for position, team_id in enumerate(self.get_table()):
+            values = dict(self.records[team_id], points=self.get_points(team_id),
+                          final_position=position+1)
+            if team_id in existing:
+                tournament_team = existing[team_id]
+                if any([getattr(tournament_team, field) != values[field] for field in STANDINGS_FIELDS]):
+                    for field in STANDINGS_FIELDS:
+                        setattr(tournament_team, field, values[field])
+                    updated_tts.append(tournament_team)
+            else:
+                new_tts.append(TournamentTeam(tournament=self.tournament_obj, team_id=team_id,
+                                              source=source_obj, **values))
+        with transaction.atomic():
+            TournamentTeam.objects.bulk_create(new_tts, batch_size=BATCH_SIZE)
+            instrumentation.record_rows(TournamentTeam, len(new_tts))
+            bulk_update(updated_tts, STANDINGS_FIELDS)
+            if new_tts or updated_tts:
+                cache.invalidate_tournament(self.tournament_obj.id)
+        return new_tts + updated_tts
+
+
+@instrumentation.timed('standings')
+def update_standings(tournament_obj, source_obj):
+    # recompute the whole table of the tournament from its games
+    standings = Standings(tournament_obj)
+    tournament_teams = list(TournamentTeam.objects.filter(tournament=tournament_obj).
+                            select_related('team').order_by('id'))
+    standings.load_tournament_teams(tournament_teams, with_stats=False)
+    standings.load_game_teams()
+    standings.save(tournament_teams, source_obj)
+    return standings
+
+
+@instrumentation.timed('standings')
+def update_game_standings(tournament_obj, source_obj, new_results=(), old_results=()):
+    # apply the results of the games that were added (new_results), deleted
+    # (old_results) or corrected (both) on top of the current table. When
+    # the table doesn't add up to the sides of the games (e.g. it was never
+    # computed) it is recomputed from all the games instead
+    standings = Standings(tournament_obj)
+    tournament_teams = list(TournamentTeam.objects.filter(tournament=tournament_obj).
+                            select_related('team').order_by('id'))
+    standings.load_tournament_teams(tournament_teams)
+    for old_result in old_results:
+        standings.add_result(old_result, sign=-1)
+    for new_result in new_results:
+        standings.add_result(new_result)
+    num_sides = GameTeam.objects.filter(game__tournament=tournament_obj).count()
+    if sum([record['games'] for record in standings.records.values()]) != num_sides:
+        return update_standings(tournament_obj, source_obj)
+    standings.save(tournament_teams, source_obj)
+    return standings
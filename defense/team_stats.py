@@ -0,0 +1,181 @@
+import threading
+
+from collections import defaultdict
+from contextlib import contextmanager
+from defense.models import GameTeam, Team
+from django.db import transaction
+from django.db.models import Case, When, Value, F, Q, IntegerField, Sum
+from django.db.models.signals import pre_delete, post_delete, post_save
+from django.dispatch import receiver
+
+
+TEAM_STATS_FIELDS = ['total_games', 'wins', 'draws', 'losses', 'goals', 'goals_conceded']
+ALL_TIME_ORDERING = ('-wins', '-goals', 'name')
+
+_local = threading.local()
+
+
+def sum_if(condition, value=Value(1)):
+    return Sum(Case(When(condition, then=value), default=Value(0), output_field=IntegerField()))
+
+
+def get_team_stats(team_ids=None):
+    # all-time stats of the teams computed from the sides of the games in
+    # a single grouped query, every side is joined with the rival side of
+    # its game so games that miss a side aren't counted
+    rival = Q(game__gameteam__id__lt=F('id')) | Q(game__gameteam__id__gt=F('id'))
+    game_teams = GameTeam.objects.all()
+    if team_ids is not None:
+        game_teams = game_teams.filter(team_id__in=team_ids)
+    rows = game_teams.values('team_id').annotate(
+        total_games=sum_if(rival),
+        wins=sum_if(Q(game__gameteam__goals__lt=F('goals'))),
+        draws=sum_if(rival & Q(game__gameteam__goals=F('goals'))),
+        losses=sum_if(Q(game__gameteam__goals__gt=F('goals'))),
+        goals=sum_if(rival, F('goals')),
+        goals_conceded=sum_if(rival, F('game__gameteam__goals'))
+    ).order_by()
+    return dict((row['team_id'], dict((field, row[field] or 0) for field in TEAM_STATS_FIELDS))
+                for row in rows)
+
+
+def rebuild_team_stats(team_ids=None):
+    """
+    Recomputes from the games the stats stored in the teams (all the teams
+    unless team_ids is given), only the teams whose stats changed are
+    written. Returns the number of teams updated
+    """
+    stats = get_team_stats(team_ids)
+    teams = Team.objects.all()
+    if team_ids is not None:
+        teams = teams.filter(id__in=team_ids)
+    num_updated = 0
+    zeros = dict((field, 0) for field in TEAM_STATS_FIELDS)
+    with transaction.atomic():
+        for team_values in teams.values('id', *TEAM_STATS_FIELDS):
+            team_stats = stats.get(team_values['id'], zeros)
+            if any([team_values[field] != team_stats[field] for field in TEAM_STATS_FIELDS]):
+                num_updated += Team.objects.filter(id=team_values['id']).update(**team_stats)
+    return num_updated
+
+
+def get_team_deltas():
+    return defaultdict(lambda: dict((field, 0) for field in TEAM_STATS_FIELDS))
+
+
+def add_game_result(deltas, game_result, sign=1):
+    # same rules as the standings of a tournament, sign=-1
+    # takes back a result
+    (team_id, goals), (rival_id, rival_goals) = game_result
+    for team_id, goals, rival_goals in [(team_id, goals, rival_goals),
+                                        (rival_id, rival_goals, goals)]:
+        team_deltas = deltas[team_id]
+        team_deltas['total_games'] += sign
+        if goals > rival_goals:
+            team_deltas['wins'] += sign
+        elif goals == rival_goals:
+            team_deltas['draws'] += sign
+        else:
+            team_deltas['losses'] += sign
+        team_deltas['goals'] += sign * goals
+        team_deltas['goals_conceded'] += sign * rival_goals
+
+
+def apply_team_deltas(deltas):
+    # the deltas are added in the database so that concurrent
+    # imports don't overwrite each other
+    for team_id, team_deltas in deltas.items():
+        updates = dict((field, F(field) + team_deltas[field])
+                       for field in TEAM_STATS_FIELDS if team_deltas[field])
+        if updates:
+            Team.objects.filter(id=team_id).update(**updates)
+
+
+def add_new_game_teams(game_teams):
+    """
+    Adds to the stats of the teams the games completed by the game teams
+    just inserted, a game is counted once both of its sides exist
+    """
+    game_ids = set([game_team.game_id for game_team in game_teams])
+    if not game_ids:
+        return
+    sides = defaultdict(list)
+    for game_id, team_id, goals in GameTeam.objects.filter(game_id__in=game_ids).\
+            order_by('game_id', 'id').values_list('game_id', 'team_id', 'goals'):
+        sides[game_id].append((team_id, goals))
+    deltas = get_team_deltas()
+    for game_result in sides.values():
+        if len(game_result) == 2:
+            add_game_result(deltas, game_result)
+    apply_team_deltas(deltas)
+
+
+def take_back_game_results(game_results):
+    """
+    Subtracts from the stats of the teams the results (as lists of
+    (team id, goals) of their sides) of the games whose sides are about
+    to be deleted, the sides have to be deleted inside deltas_applied()
+    """
+    deltas = get_team_deltas()
+    for game_result in game_results:
+        if len(game_result) == 2:
+            add_game_result(deltas, game_result, sign=-1)
+    apply_team_deltas(deltas)
+
+
+@contextmanager
+def deltas_applied():
+    # the game teams deleted inside the context were already taken
+    # back from the stats of the teams, the signals leave them alone
+    _local.deltas_applied = True
+    try:
+        yield
+    finally:
+        _local.deltas_applied = False
+
+
+def get_all_time_table(order_by=ALL_TIME_ORDERING):
+    # the stats are stored in the teams, so the table is read
+    # through the indexes of the teams' stats
+    return Team.objects.order_by(*order_by)
+
+
+###
+# Signals, the game teams inserted or deleted through the importer are
+# handled by it, the ones edited or deleted elsewhere are handled here
+###
+
+
+def get_pending_teams():
+    if not hasattr(_local, 'pending_teams'):
+        _local.pending_teams = set()
+    return _local.pending_teams
+
+
+@receiver(pre_delete, sender=GameTeam, dispatch_uid='team_stats_game_team_pre_delete')
+def game_team_pre_delete(sender, instance, **kwargs):
+    # the rival of the side deleted loses the game too, its team is
+    # taken before the rows are gone
+    if getattr(_local, 'deltas_applied', False):
+        return
+    get_pending_teams().update(GameTeam.objects.filter(game_id=instance.game_id).
+                               values_list('team_id', flat=True))
+
+
+@receiver(post_delete, sender=GameTeam, dispatch_uid='team_stats_game_team_post_delete')
+def game_team_post_delete(sender, instance, **kwargs):
+    # the sides collected for deletion are all deleted before the first
+    # post_delete is sent, so the teams are recomputed only once
+    pending_teams = get_pending_teams()
+    if pending_teams:
+        team_ids = list(pending_teams)
+        pending_teams.clear()
+        rebuild_team_stats(team_ids)
+
+
+@receiver(post_save, sender=GameTeam, dispatch_uid='team_stats_game_team_post_save')
+def game_team_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    rebuild_team_stats(list(GameTeam.objects.filter(game_id=instance.game_id).
+                            values_list('team_id', flat=True)))
@@ -1,6 +1,1169 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import importlib, json, os, shutil, tempfile, time, utils, warnings
 
-# Create your tests here.
+from collections import defaultdict
+from datetime import datetime, timedelta
+from defense import cache, collectors, importer, instrumentation, jobs, resolver
+from defense.benchmark import RSSSF_CHAMPIONSHIP, create_rsssf_tournament
+from defense.management.commands import import_tournaments
+from defense.collectors import DEF_CITY, collect_results
+from defense.models import City, Country, Game, GamePlayer, GameTeam, Goal, ImportJob, Player, \
+    PlayerTeam, Source, Stadium, Team, Tournament, TournamentPlayer, TournamentTeam
+from defense.standings import STANDINGS_FIELDS, Standings, update_game_standings, update_standings
+from defense.team_stats import TEAM_STATS_FIELDS, add_new_game_teams, get_team_stats, rebuild_team_stats
+from defense.unit_of_work import TournamentUnitOfWork, create_with_sources
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.six import StringIO
+from django.utils import timezone
+from goalkeeper import parser_rsssf
+from goalkeeper.fixtures import TESTDATA_DIR, FixtureFetcher
+from goalkeeper.wiki_scrapers import ParaguayanChampionshipResultsScraper, ParaguayanTournamentScraper
+
+
+def import_rsssf_tournament(tournament_obj, data_dir=TESTDATA_DIR):
+    with warnings.catch_warnings():
+        # the dates of the rsssf files are naive
+        warnings.simplefilter('ignore', RuntimeWarning)
+        with resolver.import_run():
+            collect_results(tournament_obj, defaultdict(list), data_dir=data_dir)
+
+
+def get_player_name(player_obj):
+    return '{0} {1}'.format(player_obj.first_name, player_obj.last_name)
+
+
+def dump_tournament(tournament_obj):
+    # rows of the tournament by their natural keys, so that
+    # imports that assign other ids can be compared
+    sides = defaultdict(dict)
+    for game_team in GameTeam.objects.filter(game__tournament=tournament_obj).select_related('team'):
+        sides[game_team.game_id]['home' if game_team.home else 'away'] = game_team.team.name
+    game_keys = dict((game.id, (game.round, game.stage, sides[game.id].get('home'),
+                                sides[game.id].get('away'), str(game.datetime), game.stadium_id))
+                     for game in Game.objects.filter(tournament=tournament_obj))
+    return {
+        'games': sorted(game_keys.values()),
+        'game_teams': sorted([(game_keys[gt.game_id], gt.team.name, gt.home, gt.goals) for gt in
+                              GameTeam.objects.filter(game__tournament=tournament_obj).select_related('team')]),
+        'goals': sorted([(game_keys[goal.game_id], get_player_name(goal.author), goal.team.name,
+                          goal.minute, goal.type, goal.own) for goal in
+                         Goal.objects.filter(game__tournament=tournament_obj).select_related('author', 'team')]),
+        'game_players': sorted([(game_keys[gp.game_id], get_player_name(gp.player), gp.goals) for gp in
+                                GamePlayer.objects.filter(game__tournament=tournament_obj).
+                               select_related('player')]),
+        'player_teams': sorted([(get_player_name(pt.player), pt.team.name, pt.games, pt.wins, pt.draws,
+                                 pt.losses, pt.goals) for pt in
+                                PlayerTeam.objects.select_related('player', 'team')]),
+        'tournament_players': sorted([(get_player_name(tp.player), tp.goals) for tp in
+                                      TournamentPlayer.objects.filter(tournament=tournament_obj).
+                                     select_related('player')]),
+        'tournament_teams': sorted([(tt.team.name, tt.points, tt.games, tt.wins, tt.draws, tt.losses,
+                                     tt.goals, tt.goals_conceded, tt.final_position) for tt in
+                                    TournamentTeam.objects.filter(tournament=tournament_obj).
+                                   select_related('team')]),
+        'teams': sorted(Team.objects.values_list('name', *TEAM_STATS_FIELDS)),
+        'sources': dict((model.__name__, model.source.through.objects.count())
+                        for model in [Game, Goal, GamePlayer, PlayerTeam, TournamentPlayer]),
+    }
+
+
+class NameIndexTest(TestCase):
+    """
+    The index has to answer the lookups of search_obj_by_name as the
+    queries that it replaces, ties included
+    """
+
+    NAMES = ['Olimpia', 'Olimpia', 'Cerro Porteño', 'Cerro Cora', 'Cerro Coro', 'Sportivo Luqueño',
+             'Sportivo San Lorenzo', 'Libertad', 'Nacional', 'Sol de America', 'Guarani']
+    LOOKUPS = ['olimpia', 'cerro', 'cerro cor', 'sportivo', 'porte', 'sol de', 'lib', 'libertad',
+               'nacionales', 'guarany', 'olimpo', 'x', 'zzzz']
+
+    def setUp(self):
+        country = Country.objects.create(name='Paraguay')
+        city = City.objects.create(name='Asuncion', country=country)
+        for name in self.NAMES:
+            Team.objects.create(name=name, city=city)
+        self.index = resolver.NameIndex(Team.objects.all())
+
+    def test_exact(self):
+        self.assertEqual([team.name for team in self.index.exact('OLIMPIA')], ['Olimpia', 'Olimpia'])
+        self.assertEqual(self.index.exact('olimp'), [])
+
+    def test_normalized(self):
+        for name in self.LOOKUPS:
+            expected = list(Team.objects.filter(normalized_name=utils.normalize_name(name)).order_by('id'))
+            self.assertEqual(self.index.normalized(name), expected, name)
+
+    def test_prefix(self):
+        for name in self.LOOKUPS:
+            expected = list(Team.objects.filter(name__istartswith=name).order_by('id'))
+            self.assertEqual(self.index.prefix(name), expected, name)
+
+    def test_contains(self):
+        for name in self.LOOKUPS:
+            expected = list(Team.objects.filter(name__icontains=name).order_by('id'))
+            self.assertEqual(self.index.contains(name), expected, name)
+
+    def test_most_similar(self):
+        for name in self.LOOKUPS:
+            self.assertEqual(self.index.most_similar(name), importer.search_most_similar_strings(Team, name),
+                             name)
+        # both teams are as similar to the name
+        self.assertEqual([team.name for team in self.index.most_similar('Cerro Cor')],
+                         ['Cerro Cora', 'Cerro Coro'])
+
+    def test_search_obj_by_name(self):
+        expected = dict((name, importer.search_obj_by_name(Team, name)) for name in self.LOOKUPS)
+        with resolver.import_run():
+            for name in self.LOOKUPS:
+                self.assertEqual(list(importer.search_obj_by_name(Team, name)), list(expected[name]), name)
+
+    def test_update(self):
+        team = Team.objects.get(name='Guarani')
+        team.name = 'Club Guarani'
+        self.index.update(team)
+        self.assertEqual(self.index.exact('guarani'), [])
+        self.assertEqual(self.index.prefix('club'), [team])
+        self.index.remove(team)
+        self.assertEqual(self.index.contains('guarani'), [])
+
+
+class PlayerIndexTest(SimpleTestCase):
+
+    def get_index(self, names, player_teams=()):
+        players = []
+        for i, (first_name, last_name) in enumerate(names):
+            players.append(Player(id=i + 1, first_name=first_name, last_name=last_name))
+        return resolver.PlayerIndex(players, player_teams)
+
+    def resolve(self, player_index, *args, **kwargs):
+        player_obj = player_index.resolve(*args, **kwargs)
+        return player_obj.id if player_obj else None
+
+    def test_initials(self):
+        player_index = self.get_index([('Carlos', 'Paredes'), ('Juan', 'Paredes'), ('', 'Paredes'),
+                                       ('Carlos', 'Benítez')])
+        self.assertEqual(player_index.candidates('paredes', 'c'), set([1, 3]))
+        self.assertEqual(player_index.candidates('paredes', ''), set([1, 2, 3]))
+        self.assertEqual(player_index.candidates('paredes', 'm'), set([3]))
+        self.assertEqual(player_index.candidates('benitez', 'c'), set([4]))
+        self.assertEqual(player_index.candidates('ledesma', 'c'), set())
+        self.assertIsNone(self.resolve(player_index, 'ledesma', 'c'))
+
+    def test_tie_breakers(self):
+        # the players of the team first
+        player_index = self.get_index([('Carlos', 'Paredes'), ('Cesar', 'Paredes'), ('Cristian', 'Paredes')],
+                                      [(1, 10), (2, 20), (3, 30)])
+        player_index.add_tournament_teams(100, [20, 30])
+        self.assertEqual(self.resolve(player_index, 'paredes', 'c', team_id=30, tournament_id=100), 3)
+        # then the ones of the teams of the tournament
+        self.assertEqual(self.resolve(player_index, 'paredes', 'c', team_id=40, tournament_id=100), 2)
+        # then the ones whose initial is the same
+        player_index = self.get_index([('', 'Paredes'), ('Juan', 'Paredes'), ('Carlos', 'Paredes')])
+        self.assertEqual(self.resolve(player_index, 'paredes', 'c'), 3)
+        # and finally the oldest one
+        self.assertEqual(self.resolve(player_index, 'paredes', ''), 1)
+        self.assertEqual(self.resolve(player_index, 'paredes', 'm'), 1)
+
+    def test_update(self):
+        player_index = self.get_index([('', 'Paredes'), ('Juan', 'Paredes')])
+        player_obj = player_index.players[1]
+        player_obj.first_name = 'Carlos'
+        player_index.update(player_obj)
+        self.assertEqual(player_index.candidates('paredes', 'c'), set([1]))
+        player_index.remove(player_obj)
+        player_index.remove(player_index.players[2])
+        self.assertEqual(len(player_index), 0)
+        self.assertEqual(player_index.last_names, {})
+
+
+class GetOrCreatePlayerTest(TestCase):
+    """
+    Players that share the last name are told apart by the
+    team they scored for, with or without an import run
+    """
+
+    def setUp(self):
+        country_obj = Country.objects.create(name='Paraguay')
+        city_obj = City.objects.create(name='Asuncion', country=country_obj)
+        source_obj = Source.objects.create(name='RSSSF', url='http://www.rsssf.com/tablesp/para98.html')
+        self.tournament_obj = Tournament.objects.create(name='Apertura', country=country_obj, year=1998)
+        self.teams = dict((name, Team.objects.create(name=name, city=city_obj))
+                          for name in ['Olimpia', 'Libertad', 'Nacional'])
+        for name in ['Olimpia', 'Libertad']:
+            TournamentTeam.objects.create(tournament=self.tournament_obj, team=self.teams[name],
+                                          source=source_obj)
+        self.carlos = Player.objects.create(first_name='Carlos', last_name='paredes')
+        self.cesar = Player.objects.create(first_name='Cesar', last_name='paredes')
+        PlayerTeam.objects.create(player=self.carlos, team=self.teams['Olimpia'])
+        PlayerTeam.objects.create(player=self.cesar, team=self.teams['Libertad'])
+
+    def get_player(self, name, team_name):
+        return importer.get_or_create_player(self.tournament_obj, {'name': name}, self.teams[team_name]).id
+
+    def check_players(self):
+        self.assertEqual(self.get_player('C Paredes', 'Libertad'), self.cesar.id)
+        self.assertEqual(self.get_player('C Paredes', 'Olimpia'), self.carlos.id)
+        self.assertEqual(self.get_player('Paredes', 'Libertad'), self.cesar.id)
+        # a team without players named so takes the oldest of them
+        self.assertEqual(self.get_player('C Paredes', 'Nacional'), self.carlos.id)
+        # but not when the initial is different
+        new_player_id = self.get_player('M Paredes', 'Libertad')
+        self.assertNotIn(new_player_id, [self.carlos.id, self.cesar.id])
+        self.assertEqual(self.get_player('M Paredes', 'Libertad'), new_player_id)
+
+    def test_without_import_run(self):
+        self.check_players()
+
+    def test_import_run(self):
+        with resolver.import_run():
+            self.check_players()
+        self.assertEqual(Player.objects.filter(normalized_last_name='paredes').count(), 3)
+
+
+class TournamentUnitOfWorkTest(TestCase):
+
+    def import_game_by_game(self, tournament_obj):
+        # the rows of every game are written as soon as they are
+        # read, as the importer did before the unit of work
+        source_obj = tournament_obj.source.all()[0]
+        results = parser_rsssf.read_championship_results(RSSSF_CHAMPIONSHIP, TESTDATA_DIR)
+        for result in results:
+            for game in result['games']:
+                game_attrs = {'tournament': tournament_obj, 'round': result['round']}
+                if game['date']:
+                    game_attrs['datetime'] = datetime.strptime(game['date'], '%Y-%m-%d')
+                if game.get('stadium'):
+                    game_attrs['stadium'] = importer.get_or_create_stadium({'name': game['stadium']},
+                                                                           {'name': DEF_CITY})
+                if 'stage' in game:
+                    game_attrs['stage'] = game['stage']
+                game_obj = Game.objects.create(**game_attrs)
+                game_obj.source.add(source_obj)
+                importer.add_team_game(tournament_obj, game_obj, source_obj, game['home_team'],
+                                       game['away_team'], home=True)
+                importer.add_team_game(tournament_obj, game_obj, source_obj, game['away_team'],
+                                       game['home_team'], home=False)
+        update_standings(tournament_obj, source_obj)
+
+    def test_same_rows_as_game_by_game(self):
+        with transaction.atomic():
+            tournament_obj = create_rsssf_tournament()
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                self.import_game_by_game(tournament_obj)
+            expected = dump_tournament(tournament_obj)
+            transaction.set_rollback(True)
+        self.assertEqual(len(expected['games']), 132)
+        tournament_obj = create_rsssf_tournament()
+        import_rsssf_tournament(tournament_obj)
+        self.assertEqual(dump_tournament(tournament_obj), expected)
+
+    def test_failed_flush_writes_nothing(self):
+        tournament_obj = create_rsssf_tournament()
+        source_obj = tournament_obj.source.all()[0]
+        home, away = Team.objects.all()[:2]
+        unit_of_work = TournamentUnitOfWork(tournament_obj, source_obj)
+        game_obj = Game(tournament=tournament_obj, round=1)
+        unit_of_work.add_game(game_obj)
+        unit_of_work.add_game_team(GameTeam(game=game_obj, team=home, home=True, goals=1))
+        unit_of_work.add_game_team(GameTeam(game=game_obj, team=away, home=False, goals=0))
+        # a goal without author can't be inserted
+        unit_of_work.add_goal(Goal(game=game_obj, team=home, minute=10))
+        with self.assertRaises(IntegrityError):
+            unit_of_work.flush()
+        self.assertFalse(Game.objects.exists())
+        self.assertFalse(GameTeam.objects.exists())
+        self.assertEqual(Team.objects.get(id=home.id).total_games, 0)
+
+
+    def test_rows_of_other_imports_keep_their_sources(self):
+        tournament_obj = create_rsssf_tournament()
+        source_obj = tournament_obj.source.all()[0]
+        game_obj = Game.objects.create(tournament=tournament_obj, round=1)
+        players = [Player.objects.create(first_name='Roque', last_name=last_name)
+                   for last_name in ['Santa Cruz', 'Valdez']]
+        bulk_create = GamePlayer.objects.bulk_create
+
+        def concurrent_bulk_create(objs, **kwargs):
+            # another import inserts a row of the game in the meantime
+            GamePlayer.objects.create(game=game_obj, player=players[1], goals=1)
+            return bulk_create(objs, **kwargs)
+
+        GamePlayer.objects.bulk_create = concurrent_bulk_create
+        try:
+            new_ids = create_with_sources(GamePlayer, [GamePlayer(game=game_obj, player=players[0], goals=2)],
+                                          source_obj, ('game_id', 'player_id'), game_id__in=[game_obj.id])
+        finally:
+            del GamePlayer.objects.bulk_create
+        self.assertEqual(new_ids, [GamePlayer.objects.get(player=players[0]).id])
+        self.assertEqual(list(GamePlayer.source.through.objects.values_list('gameplayer_id', flat=True)), new_ids)
+
+
+class ImportRunTest(TestCase):
+
+    def setUp(self):
+        self.tournament_obj = create_rsssf_tournament()
+
+    def test_flush_keeps_team_stats(self):
+        # the team is renamed by the import while its stats are
+        # added by the unit of work
+        Team.objects.filter(name='Atlético Colegiales').update(name='Colegiales')
+        import_rsssf_tournament(self.tournament_obj)
+        team_obj = Team.objects.get(name='Atlético Colegiales')
+        self.assertEqual([getattr(team_obj, field) for field in TEAM_STATS_FIELDS], [22, 8, 6, 8, 22, 27])
+        self.assertEqual(team_obj.normalized_name, utils.normalize_name('Atlético Colegiales'))
+
+    def test_only_changed_fields_are_saved(self):
+        team_obj = Team.objects.get(name='Olimpia')
+        Team.objects.filter(id=team_obj.id).update(total_games=3)
+        other_team_obj = Team.objects.get(name='Libertad')
+        with self.assertNumQueries(1):
+            with resolver.import_run():
+                team_obj = resolver.set_resolved(Team, 'olimpia', team_obj)
+                team_obj.wikipage = 'https://es.wikipedia.org/wiki/Club_Olimpia'
+                resolver.save_obj(team_obj)
+                resolver.save_obj(resolver.set_resolved(Team, 'libertad', other_team_obj))
+        team_obj = Team.objects.get(id=team_obj.id)
+        self.assertEqual(team_obj.wikipage, 'https://es.wikipedia.org/wiki/Club_Olimpia')
+        self.assertEqual(team_obj.total_games, 3)
+
+    def test_failed_run_saves_modified_objects(self):
+        team_obj = Team.objects.get(name='Olimpia')
+        with self.assertRaises(ValueError):
+            with resolver.import_run():
+                team_obj = resolver.set_resolved(Team, 'olimpia', team_obj)
+                team_obj.name = 'Club Olimpia'
+                resolver.save_obj(team_obj)
+                raise ValueError('the import failed')
+        self.assertEqual(Team.objects.get(id=team_obj.id).name, 'Club Olimpia')
+        self.assertIsNone(resolver.get_current_run())
+
+
+class ConcurrentImportTest(TestCase):
+
+    def setUp(self):
+        self.tournament_obj = create_rsssf_tournament()
+
+    def test_extra_info_reports_every_team(self):
+        # tournament of the recorded page
+        tournament_obj = Tournament.objects.create(name='apertura', year=2010, country=self.tournament_obj.country,
+                                                   additional_info='teams info')
+        tournament_obj.source.add(self.tournament_obj.source.all()[0])
+        # the progress is the heartbeat of the job
+        scraper_class = collectors.ParaguayanTournamentScraper
+        collectors.ParaguayanTournamentScraper = \
+            lambda url: ParaguayanTournamentScraper(url, fetcher=FixtureFetcher('tournament_2010.html'))
+        calls = []
+        try:
+            with resolver.import_run():
+                collectors.collect_extra_info(tournament_obj, defaultdict(list),
+                                              lambda processed, total: calls.append((processed, total)))
+        finally:
+            collectors.ParaguayanTournamentScraper = scraper_class
+        self.assertEqual(calls, [(1, 3), (2, 3), (3, 3)])
+        self.assertEqual(TournamentTeam.objects.filter(tournament=tournament_obj).count(), 3)
+
+    def test_team_created_by_another_import(self):
+        team_dict = {'name': 'Rubio Ñu', 'stadium': {'name': 'La Arboleda'}, 'city': {'name': 'Asuncion'}}
+        source_obj = self.tournament_obj.source.all()[0]
+        with resolver.import_run():
+            importer.get_or_create_team(self.tournament_obj, {'name': 'Olimpia'}, source_obj)
+            # the index of this run was built before the other import
+            # created the team and its stadium
+            city_obj = City.objects.get(name='Asuncion')
+            stadium_obj = Stadium.objects.create(name='La Arboleda', city=city_obj)
+            team_obj = Team.objects.create(name='Rubio Ñu', city=city_obj)
+            self.assertEqual(importer.get_or_create_team(self.tournament_obj, team_dict, source_obj).id, team_obj.id)
+        self.assertEqual(Team.objects.filter(normalized_name=team_obj.normalized_name).count(), 1)
+        self.assertEqual(Stadium.objects.filter(normalized_name=stadium_obj.normalized_name).count(), 1)
+
+
+class MigrationsTest(TestCase):
+
+    def test_normalized_names_backfill(self):
+        country_obj = Country.objects.create(name='Paraguay')
+        city_obj = City.objects.create(name='Asunción', country=country_obj)
+        names = ['Club Olimpia', 'Cerro Porteño', 'Sportivo Luqueño', 'Guaraní']
+        for name in names:
+            Team.objects.create(name=name, city=city_obj)
+        Team.objects.update(normalized_name='')
+        City.objects.update(normalized_name='')
+        Team.objects.filter(name='Guaraní').update(normalized_name='guarani')
+        backfill = importlib.import_module('defense.migrations.0028_normalized_names')
+        backfill.BATCH_SIZE = 2
+        self.addCleanup(setattr, backfill, 'BATCH_SIZE', 500)
+        with CaptureQueriesContext(connection) as queries:
+            backfill.backfill_normalized_names(apps, None)
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        # the three teams left in two batches, the city in another one
+        self.assertEqual(len(updates), 3)
+        self.assertEqual(dict(Team.objects.values_list('name', 'normalized_name')),
+                         dict((name, utils.normalize_name(name)) for name in names))
+        self.assertEqual(City.objects.get().normalized_name, 'asuncion')
+
+    def test_goal_teams_backfill_in_chunks(self):
+        import_rsssf_tournament(create_rsssf_tournament())
+        goal_teams = dict(Goal.objects.values_list('id', 'team_id'))
+        Goal.objects.update(team=None)
+        backfill = importlib.import_module('defense.migrations.0033_goal_team_backfill')
+        backfill.IDS_CHUNK_SIZE = 10
+        self.addCleanup(setattr, backfill, 'IDS_CHUNK_SIZE', 1000)
+        with CaptureQueriesContext(connection) as queries:
+            backfill.backfill_goal_teams(apps, None)
+        reads = [query['sql'] for query in queries.captured_queries
+                 if query['sql'].startswith('SELECT "defense_gameteam"') or
+                 query['sql'].startswith('SELECT "defense_playerteam"')]
+        num_games = Goal.objects.values('game_id').distinct().count()
+        num_authors = Goal.objects.values('author_id').distinct().count()
+        self.assertEqual(len(reads), (num_games + 9) // 10 + (num_authors + 9) // 10)
+        self.assertEqual(dict(Goal.objects.values_list('id', 'team_id')), goal_teams)
+
+
+class ReimportTest(TestCase):
+    """
+    Importing the results again only writes the games whose results
+    changed, the rows end as a fresh import of the results would leave them
+    """
+
+    def setUp(self):
+        with transaction.atomic():
+            import_rsssf_tournament(create_rsssf_tournament())
+            self.expected = dump_tournament(Tournament.objects.get())
+            transaction.set_rollback(True)
+        self.tournament_obj = create_rsssf_tournament()
+        import_rsssf_tournament(self.tournament_obj)
+
+    def get_writes(self, queries):
+        return [query['sql'] for query in queries.captured_queries
+                if query['sql'].split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE')]
+
+    def test_unchanged_results(self):
+        with CaptureQueriesContext(connection) as queries:
+            import_rsssf_tournament(self.tournament_obj)
+        self.assertEqual(self.get_writes(queries), [])
+        self.assertEqual(dump_tournament(self.tournament_obj), self.expected)
+
+    def test_changed_results(self):
+        games = list(Game.objects.filter(tournament=self.tournament_obj).order_by('id')[:2])
+        Game.objects.filter(id__in=[game_obj.id for game_obj in games]).update(round=99, fingerprint='')
+        import_rsssf_tournament(self.tournament_obj)
+        self.assertEqual(dump_tournament(self.tournament_obj), self.expected)
+        for game_obj in games:
+            self.assertEqual(Game.objects.get(id=game_obj.id).round, game_obj.round)
+
+    def test_games_not_in_the_results(self):
+        home, away = Team.objects.all()[:2]
+        game_obj = Game.objects.create(tournament=self.tournament_obj, round=30, import_key='30:a:b')
+        GameTeam.objects.create(game=game_obj, team=home, home=True, goals=1)
+        GameTeam.objects.create(game=game_obj, team=away, home=False, goals=0)
+        import_rsssf_tournament(self.tournament_obj)
+        self.assertFalse(Game.objects.filter(id=game_obj.id).exists())
+        self.assertEqual(dump_tournament(self.tournament_obj), self.expected)
+
+    def test_goals_without_side(self):
+        # the goals imported before their side was kept
+        Goal.objects.update(team=None)
+        backfill = importlib.import_module('defense.migrations.0033_goal_team_backfill')
+        backfill.backfill_goal_teams(apps, None)
+        self.assertEqual(dump_tournament(self.tournament_obj), self.expected)
+        Game.objects.filter(tournament=self.tournament_obj).update(fingerprint='')
+        import_rsssf_tournament(self.tournament_obj)
+        self.assertEqual(dump_tournament(self.tournament_obj), self.expected)
+
+    def test_failed_flush_keeps_the_games(self):
+        game_obj = Game.objects.filter(tournament=self.tournament_obj).order_by('id')[0]
+        home = GameTeam.objects.filter(game=game_obj)[0].team
+        unit_of_work = TournamentUnitOfWork(self.tournament_obj, self.tournament_obj.source.all()[0])
+        unit_of_work.replace_game(Game(id=game_obj.id, tournament=self.tournament_obj, round=99,
+                                       fingerprint='changed'))
+        # a goal without author can't be inserted
+        unit_of_work.add_goal(Goal(game=game_obj, team=home, minute=10))
+        with self.assertRaises(IntegrityError):
+            unit_of_work.flush()
+        game_obj.refresh_from_db()
+        self.assertNotEqual(game_obj.round, 99)
+        self.assertNotEqual(game_obj.fingerprint, 'changed')
+        self.assertEqual(dump_tournament(self.tournament_obj), self.expected)
+
+
+@override_settings(RSSSF_DATA_DIR=TESTDATA_DIR)
+class ImportJobTest(TransactionTestCase):
+    """
+    The workers close their connection when they stop, so the jobs
+    are run outside the transaction of a TestCase
+    """
+
+    def setUp(self):
+        self.tournament_obj = create_rsssf_tournament()
+        # a tournament without source can't be imported
+        self.broken_tournament_obj = Tournament.objects.create(name='Clausura', year=1998,
+                                                               country=self.tournament_obj.country)
+
+    def run_job(self, job):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return jobs.run_job(job)
+
+    def test_claim_next_job(self):
+        first, second = jobs.enqueue_jobs([self.tournament_obj, self.broken_tournament_obj],
+                                          'collect_results')
+        job = jobs.claim_next_job()
+        self.assertEqual(job.id, first.id)
+        self.assertEqual(job.status, 'running')
+        self.assertIsNotNone(job.started_at)
+        self.assertEqual(job.heartbeat_at, job.started_at)
+        # the jobs claimed aren't claimed again
+        self.assertEqual(jobs.claim_next_job(job_ids=[first.id]), None)
+        self.assertEqual(jobs.claim_next_job().id, second.id)
+        self.assertEqual(jobs.claim_next_job(), None)
+
+    def test_run_job(self):
+        job = jobs.enqueue_jobs([self.tournament_obj], 'collect_results')[0]
+        job = self.run_job(jobs.claim_next_job())
+        job = ImportJob.objects.get(id=job.id)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.error, '')
+        self.assertIsNotNone(job.finished_at)
+        self.assertGreater(job.processed_items, 0)
+        self.assertGreaterEqual(job.heartbeat_at, job.started_at)
+        self.assertEqual(json.loads(job.report)['rows_created']['Game'], 132)
+        self.assertEqual(Game.objects.filter(tournament=self.tournament_obj).count(), 132)
+
+    def test_run_failed_job(self):
+        jobs.enqueue_jobs([self.broken_tournament_obj], 'collect_results')
+        job = ImportJob.objects.get(id=self.run_job(jobs.claim_next_job()).id)
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('IndexError', job.error)
+        self.assertIsNotNone(job.finished_at)
+        self.assertTrue(job.report)
+
+    def test_run_worker(self):
+        done_job, failed_job = jobs.enqueue_jobs([self.tournament_obj, self.broken_tournament_obj],
+                                                 'collect_results')
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            jobs.run_worker(stop_when_idle=True)
+        self.assertEqual(ImportJob.objects.get(id=done_job.id).status, 'done')
+        self.assertEqual(ImportJob.objects.get(id=failed_job.id).status, 'failed')
+
+    def test_requeue_stale_jobs(self):
+        stale_job, live_job = jobs.enqueue_jobs([self.tournament_obj, self.broken_tournament_obj],
+                                                'collect_results')
+        now = timezone.now()
+        ImportJob.objects.filter(id=stale_job.id).update(status='running', started_at=now - timedelta(hours=2),
+                                                         heartbeat_at=now - timedelta(hours=1))
+        ImportJob.objects.filter(id=live_job.id).update(status='running', started_at=now - timedelta(hours=2),
+                                                        heartbeat_at=now)
+        self.assertEqual(jobs.requeue_stale_jobs(timeout=30 * 60), 1)
+        stale_job = ImportJob.objects.get(id=stale_job.id)
+        self.assertEqual(stale_job.status, 'pending')
+        self.assertIsNone(stale_job.started_at)
+        self.assertEqual(ImportJob.objects.get(id=live_job.id).status, 'running')
+        # the workers take the stale jobs back by themselves
+        ImportJob.objects.filter(id=stale_job.id).update(status='running', heartbeat_at=None,
+                                                         started_at=now - timedelta(hours=1))
+        self.assertEqual(jobs.claim_next_job(stale_timeout=30 * 60).id, stale_job.id)
+        self.assertEqual(jobs.claim_next_job(stale_timeout=30 * 60), None)
+
+
+class TeamStatsTest(TestCase):
+    # games of the tests, (home, away, home goals, away goals)
+    RESULTS = [('A', 'B', 2, 1), ('B', 'C', 0, 0), ('C', 'A', 3, 1), ('A', 'C', 1, 1)]
+    # total games, wins, draws, losses, goals and goals conceded worked out by hand
+    EXPECTED = {
+        'A': [3, 1, 1, 1, 4, 5],
+        'B': [2, 0, 1, 1, 1, 2],
+        'C': [3, 1, 2, 0, 4, 2],
+    }
+
+    def setUp(self):
+        country_obj = Country.objects.create(name='Paraguay')
+        city_obj = City.objects.create(name='Asuncion', country=country_obj)
+        self.tournament_obj = Tournament.objects.create(name='Apertura', country=country_obj, year=1998)
+        self.teams = dict((name, Team.objects.create(name=name, city=city_obj)) for name in 'ABC')
+
+    def get_game_teams(self, results):
+        # the sides of the games, unsaved so that no signal is sent
+        game_teams = []
+        for home, away, home_goals, away_goals in results:
+            game_obj = Game.objects.create(tournament=self.tournament_obj, round=1)
+            game_teams.append(GameTeam(game=game_obj, team=self.teams[home], home=True, goals=home_goals))
+            game_teams.append(GameTeam(game=game_obj, team=self.teams[away], home=False, goals=away_goals))
+        return game_teams
+
+    def get_stats(self):
+        return dict((team_obj.name, [getattr(team_obj, field) for field in TEAM_STATS_FIELDS])
+                    for team_obj in Team.objects.all())
+
+    def test_rebuild_team_stats(self):
+        game_teams = self.get_game_teams(self.RESULTS)
+        # a game with a single side isn't counted
+        game_teams.extend(self.get_game_teams([('A', 'B', 5, 0)])[:1])
+        GameTeam.objects.bulk_create(game_teams)
+        self.assertEqual(rebuild_team_stats(), 3)
+        self.assertEqual(self.get_stats(), self.EXPECTED)
+        self.assertEqual(rebuild_team_stats(), 0)
+        self.assertEqual(rebuild_team_stats([self.teams['A'].id]), 0)
+
+    def test_add_new_game_teams(self):
+        game_teams = self.get_game_teams(self.RESULTS)
+        # the second side of the first game comes in the next batch
+        batches = [game_teams[:1], game_teams[1:5], game_teams[5:]]
+        for batch in batches:
+            GameTeam.objects.bulk_create(batch)
+            add_new_game_teams(batch)
+        self.assertEqual(self.get_stats(), self.EXPECTED)
+        self.assertEqual(get_team_stats(), dict((self.teams[name].id, dict(zip(TEAM_STATS_FIELDS, stats)))
+                                                for name, stats in self.EXPECTED.items()))
+        self.assertEqual(rebuild_team_stats(), 0)
+
+    def test_signals(self):
+        game_teams = self.get_game_teams(self.RESULTS)
+        GameTeam.objects.bulk_create(game_teams)
+        add_new_game_teams(game_teams)
+        # the first game ends 2-2
+        game_team_obj = GameTeam.objects.get(game=game_teams[1].game_id, team=self.teams['B'])
+        game_team_obj.goals = 2
+        game_team_obj.save()
+        stats = self.get_stats()
+        self.assertEqual(stats['A'], [3, 0, 2, 1, 4, 6])
+        self.assertEqual(stats['B'], [2, 0, 2, 0, 2, 2])
+        # the rival of a side deleted loses the game too
+        game_team_obj.delete()
+        stats = self.get_stats()
+        self.assertEqual(stats['A'], [2, 0, 1, 1, 2, 4])
+        self.assertEqual(stats['B'], [1, 0, 1, 0, 0, 0])
+        # the third game is deleted along with its sides
+        Game.objects.filter(id=game_teams[4].game_id).delete()
+        stats = self.get_stats()
+        self.assertEqual(stats['A'], [1, 0, 1, 0, 1, 1])
+        self.assertEqual(stats['C'], [2, 0, 2, 0, 1, 1])
+        self.assertEqual(rebuild_team_stats(), 0)
+
+    def test_unit_of_work_takes_back_results(self):
+        game_teams = self.get_game_teams(self.RESULTS)
+        GameTeam.objects.bulk_create(game_teams)
+        add_new_game_teams(game_teams)
+        source_obj = Source.objects.create(name='RSSSF', url='http://www.rsssf.com/tablesp/para98.html')
+        unit_of_work = TournamentUnitOfWork(self.tournament_obj, source_obj)
+        # the first game ends 1-1 and the third one is gone
+        game_obj = Game(id=game_teams[0].game_id, tournament=self.tournament_obj, round=1)
+        unit_of_work.replace_game(game_obj)
+        unit_of_work.add_game_team(GameTeam(game=game_obj, team=self.teams['A'], home=True, goals=1))
+        unit_of_work.add_game_team(GameTeam(game=game_obj, team=self.teams['B'], home=False, goals=1))
+        unit_of_work.remove_game(game_teams[4].game_id)
+        with CaptureQueriesContext(connection) as queries:
+            unit_of_work.flush()
+        # the stats are neither recomputed nor is every side deleted read again
+        self.assertFalse([query for query in queries.captured_queries if 'SUM(CASE' in query['sql']])
+        self.assertFalse([query for query in queries.captured_queries
+                          if 'FROM "defense_gameteam" WHERE "defense_gameteam"."game_id" = ' in query['sql']])
+        self.assertEqual(self.get_stats(), {'A': [2, 0, 2, 0, 2, 2], 'B': [2, 0, 2, 0, 1, 1],
+                                            'C': [2, 0, 2, 0, 1, 1]})
+        self.assertEqual(rebuild_team_stats(), 0)
+
+
+class ApiTest(TestCase):
+
+    def setUp(self):
+        country_obj = Country.objects.create(name='Paraguay')
+        city_obj = City.objects.create(name='Asuncion', country=country_obj)
+        source_obj = Source.objects.create(name='RSSSF', url='http://www.rsssf.com/tablesp/para98.html')
+        teams = [Team.objects.create(name='Team {0}'.format(i), city=city_obj) for i in range(0, 7)]
+        # the teams of a tournament share their positions until it is played
+        for year in [1998, 1999]:
+            tournament_obj = Tournament.objects.create(name='Apertura', country=country_obj, year=year)
+            for i, team_obj in enumerate(teams):
+                TournamentTeam.objects.create(tournament=tournament_obj, team=team_obj, source=source_obj,
+                                              final_position=i % 2)
+
+    def get_pages(self, url):
+        # ids of the rows of every page following the next links, and
+        # then going back from the last page through the previous links
+        pages, previous_pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.json()['results']])
+            url, previous_url = response.json()['next'], response.json()['previous']
+        while previous_url:
+            response = self.client.get(previous_url)
+            previous_pages.insert(0, [row['id'] for row in response.json()['results']])
+            previous_url = response.json()['previous']
+        return pages, previous_pages
+
+    def test_pagination(self):
+        expected = list(TournamentTeam.objects.order_by('tournament_id', 'final_position', 'id').
+                        values_list('id', flat=True))
+        pages, previous_pages = self.get_pages('/api/standings/?page_size=3')
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 3, 2])
+        self.assertEqual(previous_pages, pages[:-1])
+        pages, previous_pages = self.get_pages('/api/standings/?page_size=2&tournament={0}'.format(
+            Tournament.objects.get(year=1999).id))
+        self.assertEqual(sum(pages, []), expected[7:])
+
+    def test_all_time_table(self):
+        teams = list(Team.objects.order_by('id'))
+        for i, team_obj in enumerate(teams):
+            Team.objects.filter(id=team_obj.id).update(wins=i % 3, goals=i % 2)
+        expected = list(Team.objects.order_by('-wins', '-goals', 'name', 'id').values_list('id', flat=True))
+        pages, previous_pages = self.get_pages('/api/teams/?page_size=3')
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual(previous_pages, pages[:-1])
+        row = self.client.get('/api/teams/').json()['results'][0]
+        self.assertEqual((row['name'], row['wins'], row['goals']), ('Team 5', 2, 1))
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/standings/?cursor=cD1ub3Rqc29u').status_code, 404)
+
+    def test_etag(self):
+        response = self.client.get('/api/standings/')
+        etag = response['ETag']
+        self.assertIn('max-age=', response['Cache-Control'])
+        response = self.client.get('/api/standings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        TournamentTeam.objects.filter(final_position=1).update(points=3)
+        response = self.client.get('/api/standings/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class AdminTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.country_obj = Country.objects.create(name='Paraguay')
+        city_obj = City.objects.create(name='Asuncion', country=self.country_obj)
+        self.teams = [Team.objects.create(name=name, city=city_obj) for name in ['Olimpia', 'Cerro Porteño']]
+        self.source_obj = Source.objects.create(name='RSSSF', url='http://www.rsssf.com/tablesp/para98.html')
+
+    def add_tournaments(self, num_tournaments):
+        for i in range(0, num_tournaments):
+            tournament_obj = Tournament.objects.create(name='Apertura', country=self.country_obj,
+                                                       year=1990 + Tournament.objects.count())
+            for position, team_obj in enumerate(self.teams):
+                TournamentTeam.objects.create(tournament=tournament_obj, team=team_obj, source=self.source_obj,
+                                              final_position=position + 1)
+
+    def get_changelist(self, url, num_queries):
+        # session, user, the two counts of the changelist and its rows
+        with self.assertNumQueries(num_queries):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_tournament_changelist(self):
+        self.add_tournaments(2)
+        self.get_changelist('/admin/defense/tournament/', 5)
+        # the champion and the runnerup come along with the tournaments
+        self.add_tournaments(4)
+        response = self.get_changelist('/admin/defense/tournament/', 5)
+        self.assertContains(response, '<td class="field-champion">Olimpia</td>', count=6, html=True)
+        self.assertContains(response, '<td class="field-runnerup">Cerro Porteño</td>', count=6, html=True)
+
+    def add_games(self, tournament_obj, num_games):
+        stadium_obj = Stadium.objects.create(name='Defensores del Chaco', city=self.teams[0].city)
+        for i in range(0, num_games):
+            game_obj = Game.objects.create(tournament=tournament_obj, round=i + 1, stadium=stadium_obj,
+                                           datetime=timezone.make_aware(datetime(1998, 3, 1, 16)))
+            GameTeam.objects.create(game=game_obj, team=self.teams[i % 2], home=True, goals=2)
+            GameTeam.objects.create(game=game_obj, team=self.teams[(i + 1) % 2], home=False, goals=1)
+
+    def test_game_changelist(self):
+        self.add_tournaments(1)
+        tournament_obj = Tournament.objects.get()
+        self.add_games(tournament_obj, 2)
+        # the sides of the games of the page are prefetched in one query,
+        # the other two list the tournament of the filter and its country
+        self.get_changelist('/admin/defense/game/', 8)
+        self.add_games(tournament_obj, 8)
+        response = self.get_changelist('/admin/defense/game/', 8)
+        self.assertContains(response, '<td class="field-home">Olimpia</td>', count=5, html=True)
+        self.assertContains(response, '<td class="field-away">Olimpia</td>', count=5, html=True)
+
+    def test_import_job_reports(self):
+        self.add_tournaments(1)
+        tournament_obj = Tournament.objects.get()
+        with instrumentation.instrument_run() as report:
+            Team.objects.count()
+        done_job = ImportJob.objects.create(tournament=tournament_obj, action='collect_results', status='done',
+                                            report=report.to_json())
+        pending_job = ImportJob.objects.create(tournament=tournament_obj, action='collect_results')
+        response = self.client.post('/admin/defense/importjob/', {
+            'action': 'display_reports', '_selected_action': [done_job.id, pending_job.id]}, follow=True)
+        messages = [unicode(message) for message in response.context['messages']]
+        self.assertIn('{0}: {1}'.format(done_job, instrumentation.format_report(report.as_dict())), messages)
+        self.assertIn('{0}: no report yet'.format(pending_job), messages)
+        response = self.client.get('/admin/defense/importjob/{0}/change/'.format(done_job.id))
+        self.assertContains(response, '1 queries in')
+
+
+class InstrumentationTest(TestCase):
+
+    def test_stages(self):
+        with instrumentation.instrument_run() as report:
+            with instrumentation.stage('resolve'):
+                Team.objects.count()
+            with instrumentation.stage('write'):
+                Team.objects.count()
+                with instrumentation.stage('standings'):
+                    Team.objects.count()
+                    Team.objects.count()
+                    time.sleep(0.05)
+            Team.objects.count()
+            # nested runs add to the outermost report
+            with instrumentation.instrument_run() as nested_report:
+                self.assertIs(nested_report, report)
+        self.assertIsNone(instrumentation.get_current_report())
+        stages = report.as_dict()['stages']
+        self.assertEqual(stages.keys(), ['resolve', 'write', 'standings', 'other'])
+        self.assertEqual([stage['queries'] for stage in stages.values()], [1, 1, 2, 1])
+        self.assertEqual(report.num_queries, 5)
+        # the time of a stage doesn't count the stages nested in it
+        self.assertGreaterEqual(stages['standings']['time'], 0.05)
+        self.assertLess(stages['write']['time'], 0.05)
+        self.assertAlmostEqual(sum([stage['time'] for stage in stages.values()]), report.total_time, places=2)
+
+    def test_import_report(self):
+        tournament_obj = create_rsssf_tournament()
+        with instrumentation.instrument_run() as report:
+            with CaptureQueriesContext(connection) as queries:
+                import_rsssf_tournament(tournament_obj)
+        report = json.loads(report.to_json())
+        self.assertEqual(report['queries'], len(queries))
+        # the rows inserted in bulk are counted along with the saved ones
+        self.assertEqual(report['rows_created']['Game'], 132)
+        self.assertEqual(report['rows_created']['GameTeam'], 264)
+        self.assertEqual(report['rows_created']['Goal'], Goal.objects.count())
+        self.assertEqual(report['rows_created']['TournamentTeam'], 12)
+        for name in ['parse', 'resolve', 'write', 'standings']:
+            self.assertGreater(report['stages'][name]['calls'], 0)
+        self.assertGreater(report['stages']['write']['queries'], 0)
+        self.assertEqual(report['http']['requests'], 0)
+
+    def test_scraper_stats(self):
+        scraper = ParaguayanChampionshipResultsScraper('', fetcher=FixtureFetcher('results_2010.html'))
+        with instrumentation.instrument_run() as report:
+            scraper.collect_championship_results({'year': '2010'})
+            instrumentation.record_scraper(scraper)
+        report = report.as_dict()
+        self.assertEqual(report['http']['requests'], 1)
+        self.assertEqual(report['http']['bytes'], len(FixtureFetcher('results_2010.html').get('').content))
+        self.assertEqual(report['stages']['fetch']['calls'], 1)
+        self.assertGreater(report['stages']['parse']['time'], 0)
+        self.assertIn('downloaded 1 page(s)', instrumentation.format_report(report))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CacheInvalidationTest(TransactionTestCase):
+    """
+    The versions of the tournaments change when the transaction commits,
+    which never happens inside the transaction of a TestCase
+    """
+
+    def setUp(self):
+        country_obj = Country.objects.create(name='Paraguay')
+        self.city_obj = City.objects.create(name='Asuncion', country=country_obj)
+        self.tournament_obj = Tournament.objects.create(name='Apertura', country=country_obj, year=1998)
+        self.other_tournament_obj = Tournament.objects.create(name='Clausura', country=country_obj, year=1998)
+        self.team_obj = Team.objects.create(name='Olimpia', city=self.city_obj)
+        self.games = [Game.objects.create(tournament=self.tournament_obj, round=i) for i in range(1, 4)]
+        self.versions = self.get_versions()
+
+    def tearDown(self):
+        cache.get_cache().clear()
+
+    def get_versions(self):
+        return [cache.get_tournament_version(tournament_obj.id)
+                for tournament_obj in [self.tournament_obj, self.other_tournament_obj]]
+
+    def test_cached_values(self):
+        values = iter(['first', 'second'])
+        self.assertEqual(cache.get_tournament_value(self.tournament_obj.id, 'standings', lambda: next(values)),
+                         'first')
+        self.assertEqual(cache.get_tournament_value(self.tournament_obj.id, 'standings', lambda: next(values)),
+                         'first')
+        GameTeam.objects.create(game=self.games[0], team=self.team_obj, goals=1)
+        self.assertEqual(cache.get_tournament_value(self.tournament_obj.id, 'standings', lambda: next(values)),
+                         'second')
+
+    def test_rows_of_a_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                for game_obj in self.games:
+                    GameTeam.objects.create(game_id=game_obj.id, team=self.team_obj, goals=1)
+                # nothing changes until the transaction commits
+                self.assertEqual(self.get_versions(), self.versions)
+        # the tournament of the games is looked up once
+        game_lookups = [query for query in queries.captured_queries
+                        if 'FROM "defense_game"' in query['sql']]
+        self.assertEqual(len(game_lookups), 1)
+        versions = self.get_versions()
+        self.assertNotEqual(versions[0], self.versions[0])
+        self.assertEqual(versions[1], self.versions[1])
+
+    def test_rolled_back_rows(self):
+        with transaction.atomic():
+            GameTeam.objects.create(game=self.games[0], team=self.team_obj, goals=1)
+            transaction.set_rollback(True)
+        self.assertEqual(self.get_versions(), self.versions)
+
+    def test_deleted_rows(self):
+        game_team_obj = GameTeam.objects.create(game=self.games[0], team=self.team_obj, goals=1)
+        versions = self.get_versions()
+        game_team_obj.delete()
+        self.assertNotEqual(self.get_versions()[0], versions[0])
+        versions = self.get_versions()
+        # the game is gone when the tournament is invalidated
+        Game.objects.filter(id=self.games[1].id).delete()
+        self.assertNotEqual(self.get_versions()[0], versions[0])
+
+    def test_tournament_teams(self):
+        source_obj = Source.objects.create(name='RSSSF', url='http://www.rsssf.com/tablesp/para98.html')
+        TournamentTeam.objects.create(tournament=self.other_tournament_obj, team=self.team_obj,
+                                      source=source_obj)
+        versions = self.get_versions()
+        self.assertEqual(versions[0], self.versions[0])
+        self.assertNotEqual(versions[1], self.versions[1])
+
+
+@override_settings(RSSSF_DATA_DIR=TESTDATA_DIR)
+class ImportTournamentsCommandTest(TransactionTestCase):
+
+    def setUp(self):
+        self.apertura_obj = create_rsssf_tournament()
+        self.clausura_obj = Tournament.objects.create(name='Clausura', year=1998, country=self.apertura_obj.country,
+                                                      start_string='torneo clausura', end_string='',
+                                                      number_of_teams=12)
+        self.clausura_obj.source.add(self.apertura_obj.source.all()[0])
+        # a tournament without source can't be imported
+        self.broken_tournament_obj = Tournament.objects.create(name='Apertura', year=1997,
+                                                               country=self.apertura_obj.country)
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def import_tournaments(self, *args):
+        stdout, stderr = StringIO(), StringIO()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            call_command('import_tournaments', '--no-prefetch', *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def get_statuses(self, tournament_obj):
+        return list(ImportJob.objects.filter(tournament=tournament_obj).order_by('id').
+                    values_list('status', flat=True))
+
+    def test_interrupted_run_is_resumed(self):
+        run_workers = import_tournaments.run_workers
+
+        def interrupted_run_workers(job_ids, **kwargs):
+            # the process is killed while the second batch is running
+            if not ImportJob.objects.filter(status='done').exists():
+                return run_workers(job_ids=job_ids, **kwargs)
+            ImportJob.objects.filter(id__in=job_ids).update(status='running', started_at=timezone.now(),
+                                                            heartbeat_at=timezone.now())
+            raise KeyboardInterrupt()
+
+        import_tournaments.run_workers = interrupted_run_workers
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                self.import_tournaments('--from-year', '1998', '--batch-size', '1')
+        finally:
+            import_tournaments.run_workers = run_workers
+        self.assertEqual(self.get_statuses(self.apertura_obj), ['done'])
+        self.assertEqual(self.get_statuses(self.clausura_obj), ['running'])
+        num_games = Game.objects.filter(tournament=self.apertura_obj).count()
+        self.assertEqual(num_games, 132)
+        # the job left running isn't taken while it could still be alive
+        stdout, stderr = self.import_tournaments('--from-year', '1998', '--batch-size', '1')
+        self.assertIn('Skipping Apertura 1998, its last job is done', stdout)
+        self.assertIn('Skipping Clausura 1998, its last job is running', stdout)
+        self.assertIn('0 imported, 0 failed, 2 skipped', stdout)
+        stdout, stderr = self.import_tournaments('--from-year', '1998', '--batch-size', '1', '--requeue-running')
+        self.assertIn('1 imported, 0 failed, 1 skipped', stdout)
+        self.assertEqual(self.get_statuses(self.apertura_obj), ['done'])
+        self.assertEqual(self.get_statuses(self.clausura_obj), ['done'])
+        self.assertEqual(Game.objects.filter(tournament=self.apertura_obj).count(), num_games)
+
+    def test_retry_failed(self):
+        stdout, stderr = self.import_tournaments('--tournament', str(self.broken_tournament_obj.id))
+        self.assertIn('Apertura 1997', stderr)
+        self.assertIn('0 imported, 1 failed, 0 skipped', stdout)
+        stdout, stderr = self.import_tournaments('--tournament', str(self.broken_tournament_obj.id))
+        self.assertIn('0 imported, 0 failed, 1 skipped', stdout)
+        self.assertEqual(self.get_statuses(self.broken_tournament_obj), ['failed'])
+        stdout, stderr = self.import_tournaments('--tournament', str(self.broken_tournament_obj.id),
+                                                 '--retry-failed')
+        self.assertIn('0 imported, 1 failed, 0 skipped', stdout)
+        self.assertEqual(self.get_statuses(self.broken_tournament_obj), ['failed', 'failed'])
+
+    def test_championships_file(self):
+        file_name = os.path.join(self.tmp_dir, 'campeonatos.csv')
+        with open(file_name, 'w') as f:
+            f.write('name,year\n apertura ,1997\nClausura,1997\nApertura,2010\n')
+        stdout, stderr = self.import_tournaments('--championships-file', file_name)
+        self.assertIn('1 tournament(s) selected', stdout)
+        self.assertEqual(self.get_statuses(self.broken_tournament_obj), ['failed'])
+        self.assertFalse(ImportJob.objects.exclude(tournament=self.broken_tournament_obj).exists())
+        with self.assertRaises(CommandError):
+            self.import_tournaments('--championships-file', os.path.join(self.tmp_dir, 'missing.csv'))
+
+
+class StandingsTableTest(SimpleTestCase):
+
+    def get_table(self, results, team_names=None, points_for_victory=3):
+        standings = Standings(Tournament(points_for_victory=points_for_victory))
+        standings.team_names = team_names or {}
+        for result in results:
+            standings.add_result(result)
+        return standings
+
+    def test_points_for_victory(self):
+        results = [[(1, 2), (2, 0)], [(1, 1), (3, 1)], [(2, 0), (3, 0)]]
+        standings = self.get_table(results, points_for_victory=2)
+        self.assertEqual([standings.get_points(team_id) for team_id in [1, 2, 3]], [3, 1, 2])
+        standings = self.get_table(results)
+        self.assertEqual([standings.get_points(team_id) for team_id in [1, 2, 3]], [4, 1, 2])
+        self.assertEqual(standings.get_table(), [1, 3, 2])
+
+    def test_tie_breakers(self):
+        # 9 is a rival that only fills the table
+        cases = [
+            # goal difference
+            ([[(1, 3), (9, 0)], [(2, 1), (9, 0)]], [1, 2]),
+            # goals scored
+            ([[(2, 1), (9, 0)], [(1, 3), (9, 2)]], [1, 2]),
+            # wins, a win and a loss against three draws
+            ([[(2, 1), (9, 1)], [(2, 0), (9, 0)], [(2, 1), (9, 1)], [(1, 2), (9, 0)], [(1, 0), (9, 2)]],
+             [1, 2]),
+            # name
+            ([[(2, 1), (9, 0)], [(1, 1), (9, 0)]], [1, 2]),
+        ]
+        for results, expected in cases:
+            standings = self.get_table(results, {1: 'Guarani', 2: 'Olimpia', 9: 'Nacional'})
+            table = [team_id for team_id in standings.get_table() if team_id != 9]
+            self.assertEqual(table, expected, results)
+
+    def test_take_back_result(self):
+        standings = self.get_table([[(1, 2), (2, 0)], [(1, 1), (2, 1)]])
+        standings.add_result([(1, 2), (2, 0)], sign=-1)
+        self.assertEqual(standings.records[1], {'games': 1, 'wins': 0, 'draws': 1, 'losses': 0,
+                                                'goals': 1, 'goals_conceded': 1})
+
+
+class UpdateStandingsTest(TestCase):
+
+    def setUp(self):
+        country = Country.objects.create(name='Paraguay')
+        city = City.objects.create(name='Asuncion', country=country)
+        self.teams = [Team.objects.create(name=name, city=city)
+                      for name in ['Olimpia', 'Cerro Porteño', 'Libertad', 'Guarani']]
+        self.tournament_obj = Tournament.objects.create(name='Apertura', year=1998, country=country,
+                                                        points_for_victory=2)
+        self.source_obj = Source.objects.create(name='RSSSF', url='http://www.rsssf.com/tablesp/para98.html')
+
+    def add_game(self, home_goals, away_goals, home, away):
+        game_obj = Game.objects.create(tournament=self.tournament_obj, round=1)
+        GameTeam.objects.create(game=game_obj, team=self.teams[home], home=True, goals=home_goals)
+        GameTeam.objects.create(game=game_obj, team=self.teams[away], home=False, goals=away_goals)
+        return game_obj
+
+    def get_standings(self):
+        return [tuple([tt.team.name] + [getattr(tt, field) for field in STANDINGS_FIELDS]) for tt in
+                TournamentTeam.objects.filter(tournament=self.tournament_obj).
+                select_related('team').order_by('final_position')]
+
+    def get_full_standings(self):
+        # the table recomputed from all the games
+        with transaction.atomic():
+            update_standings(self.tournament_obj, self.source_obj)
+            standings = self.get_standings()
+            transaction.set_rollback(True)
+        return standings
+
+    def test_update_standings(self):
+        self.add_game(2, 0, 0, 1)
+        self.add_game(1, 1, 2, 3)
+        self.add_game(0, 1, 0, 2)
+        self.add_game(3, 1, 1, 3)
+        update_standings(self.tournament_obj, self.source_obj)
+        # name, points, games, wins, draws, losses, goals, goals conceded, position
+        self.assertEqual(self.get_standings(), [
+            ('Libertad', 3, 2, 1, 1, 0, 2, 1, 1),
+            ('Olimpia', 2, 2, 1, 0, 1, 2, 1, 2),
+            ('Cerro Porteño', 2, 2, 1, 0, 1, 3, 3, 3),
+            ('Guarani', 1, 2, 0, 1, 1, 2, 4, 4),
+        ])
+        # nothing is written when the table didn't change, the
+        # other queries open and close a savepoint
+        with self.assertNumQueries(4):
+            update_standings(self.tournament_obj, self.source_obj)
+
+    def test_incremental_updates(self):
+        self.add_game(2, 0, 0, 1)
+        update_standings(self.tournament_obj, self.source_obj)
+        # a new game
+        game_obj = self.add_game(1, 1, 2, 3)
+        update_game_standings(self.tournament_obj, self.source_obj,
+                              new_results=[[(self.teams[2].id, 1), (self.teams[3].id, 1)]])
+        self.assertEqual(self.get_standings(), self.get_full_standings())
+        # a corrected result
+        GameTeam.objects.filter(game=game_obj, team=self.teams[3]).update(goals=2)
+        update_game_standings(self.tournament_obj, self.source_obj,
+                              new_results=[[(self.teams[2].id, 1), (self.teams[3].id, 2)]],
+                              old_results=[[(self.teams[2].id, 1), (self.teams[3].id, 1)]])
+        self.assertEqual(self.get_standings(), self.get_full_standings())
+        self.assertEqual(self.get_standings()[0][:2], ('Olimpia', 2))
+        # a deleted game
+        game_obj.delete()
+        update_game_standings(self.tournament_obj, self.source_obj,
+                              old_results=[[(self.teams[2].id, 1), (self.teams[3].id, 2)]])
+        self.assertEqual(self.get_standings(), self.get_full_standings())
+        self.assertEqual([(row[0], row[2]) for row in self.get_standings()],
+                         [('Olimpia', 1), ('Guarani', 0), ('Libertad', 0), ('Cerro Porteño', 1)])
+
+    def test_stale_table_is_recomputed(self):
+        self.add_game(2, 0, 0, 1)
+        update_standings(self.tournament_obj, self.source_obj)
+        # a game that the table doesn't count yet
+        self.add_game(1, 1, 2, 3)
+        update_game_standings(self.tournament_obj, self.source_obj,
+                              old_results=[[(self.teams[0].id, 2), (self.teams[1].id, 0)]],
+                              new_results=[[(self.teams[0].id, 2), (self.teams[1].id, 0)]])
+        self.assertEqual(self.get_standings(), self.get_full_standings())
+        self.assertEqual(len(self.get_standings()), 4)
+
+    def test_flush_updates_the_table(self):
+        self.add_game(2, 0, 0, 1)
+        removed_game_obj = self.add_game(1, 1, 2, 3)
+        update_standings(self.tournament_obj, self.source_obj)
+        unit_of_work = TournamentUnitOfWork(self.tournament_obj, self.source_obj)
+        game_obj = Game(tournament=self.tournament_obj, round=2)
+        unit_of_work.add_game(game_obj)
+        unit_of_work.add_game_team(GameTeam(game=game_obj, team=self.teams[3], home=True, goals=3))
+        unit_of_work.add_game_team(GameTeam(game=game_obj, team=self.teams[0], home=False, goals=1))
+        unit_of_work.remove_game(removed_game_obj.id)
+        with CaptureQueriesContext(connection) as queries:
+            unit_of_work.flush()
+        # the table is updated with the results of the two games,
+        # without reading the sides of all the games of the tournament
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('SELECT "defense_gameteam"."game_id"') and
+                          '"defense_game"."tournament_id"' in query['sql']])
+        self.assertEqual(self.get_standings(), self.get_full_standings())
+        self.assertEqual([(row[0], row[2], row[-1]) for row in self.get_standings()],
+                         [('Guarani', 1, 1), ('Olimpia', 2, 2), ('Libertad', 0, 3), ('Cerro Porteño', 1, 4)])
@@ -0,0 +1,283 @@
+
+from collections import OrderedDict, defaultdict
+from defense import cache, instrumentation, team_stats
+from defense.models import Game, GameTeam, Goal, GamePlayer, PlayerTeam, TournamentPlayer
+from django.db import transaction
+from django.db.models import Case, Count, When, Value
+
+
+BATCH_SIZE = 500
+GAME_IMPORT_FIELDS = ['round', 'datetime', 'stadium', 'stage', 'fingerprint']
+PLAYER_TEAM_FIELDS = ['games', 'wins', 'draws', 'losses', 'goals']
+RESULT_FIELDS = {'won': 'wins', 'drew': 'draws', 'lost': 'losses'}
+
+
+def bulk_update(objs, fields, batch_size=BATCH_SIZE):
+    # django 1.11 doesn't ship bulk_update, issue a single UPDATE
+    # with a CASE expression per field for every batch of objects
+    if not objs:
+        return 0
+    model = type(objs[0])
+    num_updated = 0
+    for i in range(0, len(objs), batch_size):
+        batch = objs[i:i+batch_size]
+        updates = {}
+        for field in fields:
+            model_field = model._meta.get_field(field)
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, field))) for obj in batch]
+            updates[field] = Case(*whens, output_field=model_field)
+        num_updated += model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+    return num_updated
+
+
+def link_sources(model, obj_ids, source_obj):
+    # insert the rows of the m2m table obj<->source in a single query
+    if not obj_ids:
+        return
+    m2m_field = model._meta.get_field('source')
+    through = m2m_field.remote_field.through
+    obj_attr = '{0}_id'.format(m2m_field.m2m_field_name())
+    source_attr = '{0}_id'.format(m2m_field.m2m_reverse_field_name())
+    through.objects.bulk_create([through(**{obj_attr: obj_id, source_attr: source_obj.id})
+                                 for obj_id in obj_ids], batch_size=BATCH_SIZE)
+    instrumentation.record_rows(through, len(obj_ids))
+
+
+def create_with_sources(model, objs, source_obj, key_fields, **lookup):
+    # bulk_create doesn't return the ids of the new rows on mysql, so they
+    # are taken from the rows matching the lookup that didn't exist before.
+    # Other imports can insert rows in between, only the ones whose natural
+    # key (the values of key_fields) is the key of one of objs are taken
+    if not objs:
+        return []
+    existing_ids = set(model.objects.filter(**lookup).values_list('id', flat=True))
+    model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    instrumentation.record_rows(model, len(objs))
+    if all([obj.pk is not None for obj in objs]):
+        # the backend returned them
+        new_ids = sorted([obj.pk for obj in objs])
+    else:
+        keys = set([tuple([getattr(obj, field) for field in key_fields]) for obj in objs])
+        new_ids = sorted([row[0] for row in model.objects.filter(**lookup).values_list('id', *key_fields)
+                          if row[0] not in existing_ids and tuple(row[1:]) in keys])
+    link_sources(model, new_ids, source_obj)
+    return new_ids
+
+
+class TournamentUnitOfWork(object):
+    """
+    Collects in memory the rows generated while importing the results
+    of a tournament and writes them in bulk inside a single transaction
+    """
+
+    def __init__(self, tournament_obj, source_obj):
+        self.tournament_obj = tournament_obj
+        self.source_obj = source_obj
+        self.__reset()
+
+    def __reset(self):
+        self.games = []
+        self.replaced_games = []
+        self.removed_game_ids = []
+        self.old_results = []
+        self.game_teams = []
+        self.goals = []
+        self.game_players = OrderedDict()
+        self.player_teams = OrderedDict()
+
+    def add_game(self, game_obj):
+        # the game is saved along with its sides and goals, the rows that
+        # reference it get its id once it is saved
+        self.games.append(game_obj)
+
+    def replace_game(self, game_obj):
+        # the results of the game changed since it was imported, its rows
+        # are replaced by the ones added from now on and the fields that
+        # are imported are updated along with them
+        self.replaced_games.append(game_obj)
+
+    def remove_game(self, game_id):
+        # the game isn't among the results anymore
+        self.removed_game_ids.append(game_id)
+
+    def add_game_team(self, game_team_obj):
+        self.game_teams.append(game_team_obj)
+
+    def add_goal(self, goal_obj):
+        self.goals.append(goal_obj)
+
+    def add_game_player_goal(self, game_obj, player_obj):
+        # new games don't have an id yet, they are told apart by the instance
+        key = (id(game_obj), player_obj.id)
+        if key not in self.game_players:
+            self.game_players[key] = [game_obj, 0]
+        self.game_players[key][1] += 1
+
+    def __get_player_team_deltas(self, player_id, team_id):
+        if player_id not in self.player_teams:
+            self.player_teams[player_id] = {'team_id': team_id, 'games': 0, 'wins': 0,
+                                            'draws': 0, 'losses': 0, 'goals': 0}
+        return self.player_teams[player_id]
+
+    def add_player_team_goal(self, player_obj, team_obj, team_result, new_game):
+        deltas = self.__get_player_team_deltas(player_obj.id, team_obj.id)
+        if new_game:
+            deltas['games'] += 1
+            deltas[RESULT_FIELDS[team_result]] += 1
+        deltas['goals'] += 1
+
+    def __take_back_player_teams(self, game_ids, sides):
+        # the goals of the old games are subtracted from the players' teams,
+        # the goals imported without their side can't be taken back
+        player_goals = Goal.objects.filter(game_id__in=game_ids, team__isnull=False).\
+            values_list('game_id', 'author_id', 'team_id').annotate(num_goals=Count('id')).order_by()
+        for game_id, player_id, team_id, num_goals in player_goals:
+            rivals_goals = [goals for side_id, goals in sides[game_id].items() if side_id != team_id]
+            if team_id not in sides[game_id] or len(rivals_goals) != 1:
+                continue
+            goals, rival_goals = sides[game_id][team_id], rivals_goals[0]
+            if goals > rival_goals:
+                team_result = 'won'
+            elif goals == rival_goals:
+                team_result = 'drew'
+            else:
+                team_result = 'lost'
+            deltas = self.__get_player_team_deltas(player_id, team_id)
+            deltas['games'] -= 1
+            deltas[RESULT_FIELDS[team_result]] -= 1
+            deltas['goals'] -= num_goals
+
+    def __flush_old_games(self):
+        game_ids = [game_obj.id for game_obj in self.replaced_games] + self.removed_game_ids
+        if not game_ids:
+            return
+        sides = defaultdict(dict)
+        for game_id, team_id, goals in GameTeam.objects.filter(game_id__in=game_ids).\
+                values_list('game_id', 'team_id', 'goals'):
+            sides[game_id][team_id] = goals
+        # the results of the old games are taken back from the standings
+        self.old_results = [game_sides.items() for game_sides in sides.values()]
+        self.__take_back_player_teams(game_ids, sides)
+        GamePlayer.objects.filter(game_id__in=game_ids).delete()
+        Goal.objects.filter(game_id__in=game_ids).delete()
+        # the results of the old games are taken back from the
+        # stats of the teams, instead of recomputing them
+        team_stats.take_back_game_results(self.old_results)
+        with team_stats.deltas_applied():
+            GameTeam.objects.filter(game_id__in=game_ids).delete()
+        Game.objects.filter(id__in=self.removed_game_ids).delete()
+
+    def __flush_games(self):
+        for game_obj in self.replaced_games:
+            # the fields that aren't imported are left as they are
+            game_obj.save(update_fields=GAME_IMPORT_FIELDS)
+        for game_obj in self.games:
+            game_obj.save()
+        link_sources(Game, [game_obj.id for game_obj in self.games], self.source_obj)
+        # the rows were given the games before they had an id
+        for obj in self.game_teams + self.goals:
+            obj.game_id = obj.game.id
+
+    def __flush_game_players(self):
+        # the games have an id by now
+        game_players = OrderedDict()
+        for (_, player_id), (game_obj, goals) in self.game_players.items():
+            key = (game_obj.id, player_id)
+            game_players[key] = game_players.get(key, 0) + goals
+        game_ids = set([game_id for game_id, _ in game_players.keys()])
+        existing = {(gp.game_id, gp.player_id): gp for gp in
+                    GamePlayer.objects.filter(game_id__in=game_ids)}
+        new_gps, updated_gps = [], []
+        for (game_id, player_id), goals in game_players.items():
+            if (game_id, player_id) in existing:
+                gp = existing[(game_id, player_id)]
+                gp.goals += goals
+                updated_gps.append(gp)
+            else:
+                new_gps.append(GamePlayer(game_id=game_id, player_id=player_id, goals=goals))
+        create_with_sources(GamePlayer, new_gps, self.source_obj, ('game_id', 'player_id'), game_id__in=game_ids)
+        bulk_update(updated_gps, ['goals'])
+
+    def __flush_player_teams(self):
+        player_ids = self.player_teams.keys()
+        existing = {}
+        # the player's team is looked up only by the player, when there
+        # are many the oldest one gets updated
+        for pt in PlayerTeam.objects.filter(player_id__in=player_ids).order_by('-id'):
+            existing[pt.player_id] = pt
+        new_pts, updated_pts = [], []
+        for player_id, deltas in self.player_teams.items():
+            if player_id in existing:
+                if not any([deltas[field] for field in PLAYER_TEAM_FIELDS]):
+                    continue
+                pt = existing[player_id]
+                for field in PLAYER_TEAM_FIELDS:
+                    setattr(pt, field, getattr(pt, field) + deltas[field])
+                updated_pts.append(pt)
+            elif any([deltas[field] > 0 for field in PLAYER_TEAM_FIELDS]):
+                pt_attrs = dict((field, deltas[field]) for field in PLAYER_TEAM_FIELDS)
+                new_pts.append(PlayerTeam(player_id=player_id, team_id=deltas['team_id'], **pt_attrs))
+        create_with_sources(PlayerTeam, new_pts, self.source_obj, ('player_id', 'team_id'),
+                            player_id__in=[pt.player_id for pt in new_pts])
+        bulk_update(updated_pts, PLAYER_TEAM_FIELDS)
+
+    def __flush_tournament_players(self):
+        # the goals are counted among all the goals of the tournament,
+        # so the ones of the games skipped by the import are kept
+        player_goals = dict(Goal.objects.filter(game__tournament=self.tournament_obj).
+                            values_list('author_id').annotate(num_goals=Count('id')).order_by())
+        existing, stale_ids = {}, []
+        for tp in TournamentPlayer.objects.filter(tournament=self.tournament_obj).order_by('id'):
+            if tp.player_id in existing or tp.player_id not in player_goals:
+                stale_ids.append(tp.id)
+            else:
+                existing[tp.player_id] = tp
+        new_tps, updated_tps = [], []
+        for player_id, goals in player_goals.items():
+            if player_id not in existing:
+                new_tps.append(TournamentPlayer(tournament=self.tournament_obj, player_id=player_id,
+                                                goals=goals))
+            elif existing[player_id].goals != goals:
+                existing[player_id].goals = goals
+                updated_tps.append(existing[player_id])
+        create_with_sources(TournamentPlayer, new_tps, self.source_obj, ('player_id',),
+                            tournament=self.tournament_obj)
+        bulk_update(updated_tps, ['goals'])
+        TournamentPlayer.objects.filter(id__in=stale_ids).delete()
+
+    def __flush_standings(self):
+        # the standings are saved with the bulk_update of this module
+        from defense.standings import update_game_standings
+        # the games have an id by now
+        new_results = OrderedDict()
+        for game_team_obj in self.game_teams:
+            new_results.setdefault(game_team_obj.game_id, []).append((game_team_obj.team_id,
+                                                                     game_team_obj.goals))
+        update_game_standings(self.tournament_obj, self.source_obj,
+                              new_results.values(), self.old_results)
+
+    def has_changes(self):
+        return bool(self.games or self.replaced_games or self.removed_game_ids or
+                    self.game_teams or self.goals)
+
+    @instrumentation.timed('write')
+    def flush(self):
+        if not self.has_changes():
+            # nothing changed since the last import
+            return
+        with transaction.atomic():
+            self.__flush_old_games()
+            self.__flush_games()
+            GameTeam.objects.bulk_create(self.game_teams, batch_size=BATCH_SIZE)
+            instrumentation.record_rows(GameTeam, len(self.game_teams))
+            # bulk_create doesn't send signals, the stats of the teams are
+            # updated with the games completed by the new sides
+            team_stats.add_new_game_teams(self.game_teams)
+            create_with_sources(Goal, self.goals, self.source_obj, ('game_id', 'author_id', 'minute'),
+                                game_id__in=set([goal.game_id for goal in self.goals]))
+            self.__flush_game_players()
+            self.__flush_player_teams()
+            self.__flush_tournament_players()
+            self.__flush_standings()
+            cache.invalidate_tournament(self.tournament_obj.id)
+        self.__reset()
@@ -0,0 +1,13 @@
+from defense import views
+from rest_framework import routers
+
+
+router = routers.DefaultRouter()
+router.register(r'teams', views.TeamViewSet)
+router.register(r'tournaments', views.TournamentViewSet)
+router.register(r'standings', views.TournamentTeamViewSet)
+router.register(r'scorers', views.TournamentPlayerViewSet)
+router.register(r'games', views.GameViewSet)
+router.register(r'goals', views.GoalViewSet)
+
+urlpatterns = router.urls
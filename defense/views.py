@@ -1,6 +1,139 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.shortcuts import render
+import hashlib
 
-# Create your views here.
+from defense import cache, team_stats
+from defense.models import Tournament, TournamentTeam, TournamentPlayer, Game, GameTeam, Goal
+from defense.pagination import ApiPagination
+from defense.serializers import TeamSerializer, TournamentSerializer, TournamentTeamSerializer, \
+    TournamentPlayerSerializer, GameSerializer, GoalSerializer
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+DEF_CACHE_MAX_AGE = 5 * 60  # seconds
+
+
+def get_int_param(request, name):
+    value = request.query_params.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: 'A valid integer is required.'})
+
+
+class ReadOnlyApiViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    The responses to GET carry an ETag computed from their content and can
+    be cached by clients and proxies for API_CACHE_MAX_AGE seconds. A request
+    whose If-None-Match matches the ETag gets a 304 without body
+    """
+    pagination_class = ApiPagination
+    filter_params = {}  # query param -> lookup of the queryset
+
+    def get_queryset(self):
+        queryset = super(ReadOnlyApiViewSet, self).get_queryset()
+        for param, lookup in self.filter_params.items():
+            value = get_int_param(self.request, param)
+            if value is not None:
+                queryset = queryset.filter(**{lookup: value})
+        return queryset
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ReadOnlyApiViewSet, self).finalize_response(request, response, *args, **kwargs)
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            response.render()
+            etag = quote_etag(hashlib.md5(response.content).hexdigest())
+            response['ETag'] = etag
+            patch_cache_control(response, public=True,
+                                max_age=getattr(settings, 'API_CACHE_MAX_AGE', DEF_CACHE_MAX_AGE))
+            response = get_conditional_response(request, etag=etag, response=response)
+        return response
+
+
+class TournamentViewSet(ReadOnlyApiViewSet):
+    queryset = Tournament.objects.select_related('country')
+    serializer_class = TournamentSerializer
+
+    def get_tournament_id(self):
+        try:
+            return int(self.kwargs[self.lookup_field])
+        except ValueError:
+            raise Http404
+
+    def get_cached_data(self, name, compute):
+        # the tables of a tournament are served from the cache
+        # until the importer writes new results
+        return cache.get_tournament_value(self.get_tournament_id(), name, compute)
+
+    @action(detail=True)
+    def standings(self, request, pk=None):
+        def get_standings():
+            # the whole table in a single query
+            tournament_teams = TournamentTeam.objects.filter(tournament_id=self.get_object().id).\
+                select_related('team').order_by('final_position', 'id')
+            return TournamentTeamSerializer(tournament_teams, many=True).data
+        return Response(self.get_cached_data('standings', get_standings))
+
+    @action(detail=True)
+    def fixtures(self, request, pk=None):
+        def get_fixtures():
+            # all the games of the tournament, whatever their number,
+            # in three queries
+            games = GameViewSet.queryset.filter(tournament_id=self.get_object().id).\
+                order_by('round', 'datetime', 'id')
+            return GameSerializer(games, many=True).data
+        return Response(self.get_cached_data('fixtures', get_fixtures))
+
+    @action(detail=True)
+    def scorers(self, request, pk=None):
+        def get_scorers():
+            tournament_players = TournamentPlayer.objects.filter(tournament_id=self.get_object().id).\
+                select_related('player').order_by('-goals', 'id')
+            return TournamentPlayerSerializer(tournament_players, many=True).data
+        return Response(self.get_cached_data('scorers', get_scorers))
+
+
+class TeamViewSet(ReadOnlyApiViewSet):
+    # all-time table, read from the stats kept in the teams
+    queryset = team_stats.get_all_time_table()
+    serializer_class = TeamSerializer
+    cursor_ordering = team_stats.ALL_TIME_ORDERING
+
+
+class TournamentTeamViewSet(ReadOnlyApiViewSet):
+    queryset = TournamentTeam.objects.select_related('team')
+    serializer_class = TournamentTeamSerializer
+    cursor_ordering = ('tournament_id', 'final_position', 'id')
+    filter_params = {'tournament': 'tournament_id', 'team': 'team_id'}
+
+
+class TournamentPlayerViewSet(ReadOnlyApiViewSet):
+    queryset = TournamentPlayer.objects.select_related('player')
+    serializer_class = TournamentPlayerSerializer
+    cursor_ordering = ('tournament_id', '-goals', 'id')
+    filter_params = {'tournament': 'tournament_id', 'player': 'player_id'}
+
+
+class GameViewSet(ReadOnlyApiViewSet):
+    queryset = Game.objects.select_related('stadium').prefetch_related(
+        Prefetch('gameteam_set', queryset=GameTeam.objects.select_related('team').order_by('-home', 'id')),
+        Prefetch('goal_set', queryset=Goal.objects.select_related('author').order_by('minute', 'id')))
+    serializer_class = GameSerializer
+    filter_params = {'tournament': 'tournament_id', 'round': 'round', 'team': 'gameteam__team_id'}
+
+
+class GoalViewSet(ReadOnlyApiViewSet):
+    queryset = Goal.objects.select_related('author')
+    serializer_class = GoalSerializer
+    filter_params = {'game': 'game_id', 'tournament': 'game__tournament_id', 'player': 'author_id'}
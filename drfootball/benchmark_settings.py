@@ -0,0 +1,25 @@
+# Settings of the import benchmark (manage.py benchmark_import), the
+# numbers are comparable only when taken against the same database engine.
+# The stages run against an in-memory test database, nothing is written to disk.
+# The tests get a file database instead, the workers of import_tournaments
+# open connections of their own, which don't see an in-memory database
+
+from drfootball.settings import *
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+        'TEST': {
+            'NAME': os.path.join(tempfile.gettempdir(), 'drfootball_test.sqlite3'),
+        },
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+PAGE_CACHE = None
@@ -10,11 +10,14 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
-import os
+import os, tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Files written at run time (caches) are kept out of the project tree
+RUNTIME_DIR = os.path.join(tempfile.gettempdir(), 'drfootball')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/1.11/howto/deployment/checklist/
@@ -126,3 +129,51 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.11/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Read-only API, its responses can be cached by clients and proxies
+# for API_CACHE_MAX_AGE seconds
+
+REST_FRAMEWORK = {
+    'DEFAULT_PERMISSION_CLASSES': ('rest_framework.permissions.AllowAny',),
+    'DEFAULT_PAGINATION_CLASS': 'defense.pagination.ApiPagination',
+    'PAGE_SIZE': 50,
+}
+
+API_CACHE_MAX_AGE = 5 * 60  # seconds
+
+
+# Values computed from the data of the tournaments (standings, fixtures,
+# scorers) are cached under keys versioned per tournament. The cache is kept
+# in files so that the versions changed by the import workers are seen by
+# the web processes, a local-memory cache is only valid for a single process
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(RUNTIME_DIR, 'cache'),
+        'TIMEOUT': 24 * 60 * 60,  # seconds
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+DEFENSE_CACHE_ALIAS = 'default'
+
+
+# Snapshots of the pages downloaded by the scrapers, set OFFLINE to True
+# to replay the imports only from the pages already in the cache
+
+PAGE_CACHE = {
+    'DIR': os.path.join(RUNTIME_DIR, 'page_cache'),
+    'TTL': 24 * 60 * 60,  # seconds
+    'MAX_SIZE': 200 * 1024 * 1024,  # bytes
+    'OFFLINE': False,
+}
+
+
+# Directory of the RSSSF result files (campeonatos<year>.html) imported by
+# collect_results, relative to the working directory
+
+RSSSF_DATA_DIR = 'data'
@@ -3,16 +3,85 @@
 __author__ = 'jorgesaldivar'
 
 
-import parser_rsssf, utils
+import argparse, json, multiprocessing, os, re, parser_rsssf, utils
 
 
-if __name__ == '__main__':
-    dict_championships = []
-    meta_championships = utils.csv_to_dict('../data/campeonatos.csv')
+DEF_CHAMPIONSHIPS_FILE = '../data/campeonatos.csv'
+DEF_DATA_DIR = '../data'
+DEF_OUTPUT_DIR = '../data/results'
+LAST_RSSSF_YEAR = 2007  # results of later seasons are scraped from wikipedia
+
+not_word_pattern = re.compile('[^a-z0-9]+')
+
+
+def select_championships(meta_championships, from_year=None, to_year=LAST_RSSSF_YEAR):
+    selected = []
     for meta_championship in meta_championships:
-        if int(meta_championship['year']) <= 2007:
-            print('Championship %s', meta_championship['name'])
-            dict_championships.append(parser_rsssf.get_data(meta_championship))
-        else:
-            print('here')
-    print ('Finished!')
\ No newline at end of file
+        year = int(meta_championship['year'])
+        if year > LAST_RSSSF_YEAR:
+            continue
+        if from_year and year < from_year:
+            continue
+        if to_year and year > to_year:
+            continue
+        selected.append(meta_championship)
+    return selected
+
+
+def parse_championship(args):
+    championship, data_dir = args
+    return parser_rsssf.read_championship_results(championship, data_dir)
+
+
+def iter_championships_results(championships, data_dir=DEF_DATA_DIR, num_workers=None):
+    # the rss files of the seasons are independent so they are parsed in
+    # a pool of processes, imap gives back the results in the order of
+    # the championships no matter which process finishes first
+    pool = multiprocessing.Pool(num_workers)
+    try:
+        tasks = [(championship, data_dir) for championship in championships]
+        for championship, results in zip(championships, pool.imap(parse_championship, tasks)):
+            yield championship, results
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def get_results_file_name(championship):
+    name = not_word_pattern.sub('_', utils.normalize_text(championship['name']).lower()).strip('_')
+    return '{0}_{1}.json'.format(championship['year'], name)
+
+
+def write_championship_results(championship, results, output_dir=DEF_OUTPUT_DIR):
+    file_name = os.path.join(output_dir, get_results_file_name(championship))
+    with open(file_name, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    return file_name
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Parse the results of the championships '
+                                                     'published in rsssf')
+    arg_parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                            help='number of processes used to parse the seasons')
+    arg_parser.add_argument('--from-year', type=int, default=None)
+    arg_parser.add_argument('--to-year', type=int, default=LAST_RSSSF_YEAR)
+    arg_parser.add_argument('--championships-file', default=DEF_CHAMPIONSHIPS_FILE)
+    arg_parser.add_argument('--data-dir', default=DEF_DATA_DIR)
+    arg_parser.add_argument('--output-dir', default=DEF_OUTPUT_DIR)
+    args = arg_parser.parse_args()
+
+    meta_championships = utils.csv_to_dict(args.championships_file)
+    championships = select_championships(meta_championships, args.from_year, args.to_year)
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    for championship, results in iter_championships_results(championships, args.data_dir, args.workers):
+        file_name = write_championship_results(championship, results, args.output_dir)
+        print('Championship {0} {1}: {2} rounds -> {3}'.format(championship['name'], championship['year'],
+                                                               len(results), file_name))
+    print ('Finished!')
+
+
+if __name__ == '__main__':
+    main()
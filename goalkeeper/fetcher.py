@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-s
+
+__author__ = 'jorgesaldivar'
+
+import logging, requests, threading, time
+from collections import OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+from page_cache import PageNotCached, get_default_page_cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urlparse import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+DEF_TIMEOUT = (5, 30)  # seconds to connect and to read
+DEF_RETRIES = 3
+DEF_BACKOFF_FACTOR = 0.5  # waits 0.5s, 1s, 2s... between retries
+DEF_POOL_SIZE = 10
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEF_CONCURRENCY = DEF_POOL_SIZE  # more threads than pooled connections would discard them
+DEF_HOST_DELAY = 0.2  # seconds between the start of two requests to the same host
+DEF_PREFETCH_TTL = 30 * 60  # seconds a prefetched page waits to be asked for
+USER_AGENT = 'drfootball (+https://github.com/joausaga/drfootball)'
+
+
+class FetchMetrics(object):
+    """
+    Counters of the requests done by a fetcher
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.num_failures = 0
+        self.num_bytes = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.num_cache_hits = 0
+        self.num_revalidations = 0
+
+    def record(self, latency, num_bytes=0, failed=False):
+        with self.lock:
+            self.num_requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.num_bytes += num_bytes
+            if failed:
+                self.num_failures += 1
+
+    def record_cache_hit(self, revalidated=False):
+        with self.lock:
+            if revalidated:
+                self.num_revalidations += 1
+            else:
+                self.num_cache_hits += 1
+
+
+class Fetcher(object):
+    """
+    Downloads pages through a single pooled session, so the connections
+    (and their TLS handshakes) to a host are reused among requests. Failed
+    connections and server errors are retried with exponential backoff.
+    When a page cache is given, the pages are read from it while they are
+    fresh and revalidated with the server once they get stale
+    """
+
+    def __init__(self, timeout=DEF_TIMEOUT, retries=DEF_RETRIES, backoff_factor=DEF_BACKOFF_FACTOR,
+                 pool_size=DEF_POOL_SIZE, cache=None, prefetch_ttl=DEF_PREFETCH_TTL):
+        self.timeout = timeout
+        self.cache = cache
+        self.prefetch_ttl = prefetch_ttl
+        self.lock = threading.Lock()
+        self.prefetched = {}
+        self.metrics = FetchMetrics()
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                   max_retries=Retry(total=retries, backoff_factor=backoff_factor,
+                                                     status_forcelist=RETRY_STATUSES,
+                                                     raise_on_status=False))
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = USER_AGENT
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def prefetch(self, urls, max_concurrency=DEF_CONCURRENCY, host_delay=DEF_HOST_DELAY):
+        # download the pages concurrently and keep them until they are
+        # asked for (as many times as they appear in urls) or until they
+        # are older than prefetch_ttl
+        pages = fetch_all(urls, self, max_concurrency, host_delay)
+        now = time.time()
+        with self.lock:
+            self.__expire_prefetched(now)
+            for url, page in pages.items():
+                if not isinstance(page, Exception):
+                    self.prefetched[url] = [page, urls.count(url), now]
+        return pages
+
+    @contextmanager
+    def prefetching(self, urls, max_concurrency=DEF_CONCURRENCY, host_delay=DEF_HOST_DELAY):
+        # the pages of urls are kept only while the context is active,
+        # those not asked for aren't served to whoever comes next
+        self.prefetch(urls, max_concurrency, host_delay)
+        try:
+            yield
+        finally:
+            self.discard_prefetched(urls)
+
+    def discard_prefetched(self, urls=None):
+        with self.lock:
+            if urls is None:
+                self.prefetched.clear()
+            for url in urls or []:
+                self.prefetched.pop(url, None)
+
+    def __expire_prefetched(self, now):
+        if self.prefetch_ttl is None:
+            return
+        for url in [url for url, (page, uses, fetched_at) in self.prefetched.items()
+                    if now - fetched_at > self.prefetch_ttl]:
+            del self.prefetched[url]
+
+    def __pop_prefetched(self, url):
+        with self.lock:
+            self.__expire_prefetched(time.time())
+            if url not in self.prefetched:
+                return None
+            page, uses, fetched_at = self.prefetched[url]
+            if uses > 1:
+                self.prefetched[url][1] -= 1
+            else:
+                del self.prefetched[url]
+            return page
+
+    def get(self, url, headers=None):
+        page = self.__pop_prefetched(url)
+        if page is not None:
+            return page
+        if self.cache is None:
+            return self.__request(url, headers)
+        meta = self.cache.get_meta(url)
+        if meta and (self.cache.offline or self.cache.is_fresh(meta)):
+            page = self.cache.get_page(url, meta)
+            if page is not None:
+                self.metrics.record_cache_hit()
+                return page
+            meta = None
+        if self.cache.offline:
+            raise PageNotCached(url)
+        request_headers = dict(headers or {})
+        if meta:
+            request_headers.update(self.cache.get_conditional_headers(meta))
+        response = self.__request(url, request_headers)
+        if meta and response.status_code == 304:
+            page = self.cache.get_page(url, self.cache.refresh(url, meta))
+            if page is not None:
+                self.metrics.record_cache_hit(revalidated=True)
+                return page
+            # the snapshot went away meanwhile, it is downloaded again
+            response = self.__request(url, headers)
+        if response.status_code == 200:
+            self.cache.put(url, response)
+        return response
+
+    def __request(self, url, headers=None):
+        start = time.time()
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            self.metrics.record(time.time() - start, failed=True)
+            raise
+        latency = time.time() - start
+        self.metrics.record(latency, len(response.content), response.status_code >= 400)
+        logger.debug('GET %s %s (%.3fs)', url, response.status_code, latency)
+        return response
+
+    def __get_connection_pools(self):
+        pools = self.adapter.poolmanager.pools
+        return [pools[key] for key in pools.keys()]
+
+    def get_metrics(self):
+        # urllib3 counts the connections opened by each pool, every
+        # other request went through a connection that was reused
+        pools = self.__get_connection_pools()
+        num_connections = sum([pool.num_connections for pool in pools])
+        num_http_requests = sum([pool.num_requests for pool in pools])
+        metrics = self.metrics
+        with metrics.lock:
+            return {
+                'requests': metrics.num_requests,
+                'cache_hits': metrics.num_cache_hits,
+                'cache_revalidations': metrics.num_revalidations,
+                'failures': metrics.num_failures,
+                'bytes': metrics.num_bytes,
+                'avg_latency': metrics.total_latency / metrics.num_requests if metrics.num_requests else 0.0,
+                'max_latency': metrics.max_latency,
+                'connections_opened': num_connections,
+                'connections_reused': max(num_http_requests - num_connections, 0),
+            }
+
+    def close(self):
+        self.session.close()
+
+
+class HostThrottle(object):
+    """
+    Spaces out the requests sent to the same host by at least delay
+    seconds, no matter the thread that sends them
+    """
+
+    def __init__(self, delay=DEF_HOST_DELAY):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.next_slots = {}
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slots.get(host, 0))
+            self.next_slots[host] = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def fetch_all(urls, fetcher=None, max_concurrency=DEF_CONCURRENCY, host_delay=DEF_HOST_DELAY):
+    """
+    Downloads the pages in a pool of at most max_concurrency threads. The
+    pages are returned by url in the order given, a page that couldn't be
+    downloaded is replaced by the exception raised
+    """
+    fetcher = fetcher or get_default_fetcher()
+    throttle = HostThrottle(host_delay)
+    urls = list(OrderedDict.fromkeys(urls))
+
+    def fetch(url):
+        throttle.wait(url)
+        try:
+            return url, fetcher.get(url)
+        except Exception as e:
+            logger.warning('Could not download %s: %s', url, e)
+            return url, e
+
+    if not urls:
+        return OrderedDict()
+    pool = ThreadPool(max(min(max_concurrency, len(urls)), 1))
+    try:
+        return OrderedDict(pool.map(fetch, urls))
+    finally:
+        pool.close()
+        pool.join()
+
+
+_default_fetcher = None
+_default_fetcher_lock = threading.Lock()
+
+
+def get_default_fetcher():
+    # fetcher shared by all the scrapers of the process
+    global _default_fetcher
+    with _default_fetcher_lock:
+        if _default_fetcher is None:
+            _default_fetcher = Fetcher(cache=get_default_page_cache())
+        return _default_fetcher
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io, os
+
+
+# pages recorded from the sources, shared by the tests and the import benchmark
+TESTDATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testdata')
+TOURNAMENT_INFO = 'teams info; season statuses; top scorers; coach substitutions; team buyers; ' \
+                  'game top audiences; team cards; referees; team audiences'
+
+
+class FixturePage(object):
+
+    def __init__(self, file_name):
+        self.status_code = 200
+        with io.open(os.path.join(TESTDATA_DIR, file_name), encoding='utf-8') as f:
+            self.text = f.read()
+        self.content = self.text.encode('utf-8')
+
+
+class FixtureFetcher(object):
+    """
+    Serves a page stored in testdata/ whatever the url requested
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def get(self, url, headers=None):
+        return FixturePage(self.file_name)
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-s
+
+__author__ = 'jorgesaldivar'
+
+import hashlib, json, logging, os, tempfile, threading, time
+
+
+logger = logging.getLogger(__name__)
+
+DEF_TTL = 24 * 60 * 60  # seconds
+DEF_MAX_SIZE = 200 * 1024 * 1024  # bytes
+BLOBS_DIR = 'blobs'
+URLS_DIR = 'urls'
+
+
+class PageNotCached(Exception):
+    pass
+
+
+class CachedPage(object):
+    """
+    Page replayed from the cache, it offers the attributes of
+    requests' responses that are used by the scrapers
+    """
+
+    def __init__(self, url, content, meta):
+        self.url = url
+        self.content = content
+        self.status_code = meta['status_code']
+        self.encoding = meta['encoding']
+        self.headers = {}
+        if meta['etag']:
+            self.headers['ETag'] = meta['etag']
+        if meta['last_modified']:
+            self.headers['Last-Modified'] = meta['last_modified']
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', 'replace')
+
+
+def get_hash(data):
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    return hashlib.sha1(data).hexdigest()
+
+
+def write_file(file_name, data):
+    # write to a temporary file first so that other processes
+    # never read a file that is half written
+    fd, tmp_file_name = tempfile.mkstemp(dir=os.path.dirname(file_name), prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_file_name, file_name)
+    except (IOError, OSError):
+        if os.path.exists(tmp_file_name):
+            os.remove(tmp_file_name)
+        raise
+
+
+class PageCache(object):
+    """
+    Snapshots of the downloaded pages kept on disk. The content of the
+    pages is stored once per digest (blobs/) and every url points to
+    the digest of its last snapshot together with the validators
+    (ETag, Last-Modified) needed to revalidate it (urls/). Entries
+    younger than ttl are served without asking the server, and the
+    least recently used ones are evicted when the blobs exceed max_size.
+    In offline mode pages are only replayed from the cache
+    """
+
+    def __init__(self, cache_dir, ttl=DEF_TTL, max_size=DEF_MAX_SIZE, offline=False):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = threading.Lock()
+        for dir_name in [BLOBS_DIR, URLS_DIR]:
+            path = os.path.join(cache_dir, dir_name)
+            if not os.path.isdir(path):
+                try:
+                    os.makedirs(path)
+                except OSError:
+                    # created meanwhile by another process
+                    if not os.path.isdir(path):
+                        raise
+
+    def __meta_file_name(self, url):
+        return os.path.join(self.cache_dir, URLS_DIR, get_hash(url) + '.json')
+
+    def __blob_file_name(self, digest):
+        return os.path.join(self.cache_dir, BLOBS_DIR, digest)
+
+    def get_meta(self, url):
+        try:
+            with open(self.__meta_file_name(url), 'rb') as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(meta, dict) or not os.path.exists(self.__blob_file_name(meta.get('digest', ''))):
+            return None
+        return meta
+
+    def is_fresh(self, meta):
+        return self.ttl is not None and time.time() - meta['fetched_at'] < self.ttl
+
+    def get_page(self, url, meta):
+        # the entry can be evicted or replaced by another process after
+        # get_meta, a missing or partial snapshot is a miss (None)
+        try:
+            with open(self.__blob_file_name(meta['digest']), 'rb') as f:
+                content = f.read()
+            if len(content) != meta['size']:
+                return None
+            # the mtime of the metadata file tells when the entry was last used
+            os.utime(self.__meta_file_name(url), None)
+        except (IOError, OSError):
+            return None
+        return CachedPage(url, content, meta)
+
+    def put(self, url, response):
+        digest = get_hash(response.content)
+        blob_file_name = self.__blob_file_name(digest)
+        if not os.path.exists(blob_file_name):
+            write_file(blob_file_name, response.content)
+        meta = {
+            'url': url,
+            'digest': digest,
+            'size': len(response.content),
+            'status_code': response.status_code,
+            'encoding': response.encoding or response.apparent_encoding,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'fetched_at': time.time(),
+        }
+        write_file(self.__meta_file_name(url), json.dumps(meta))
+        self.evict()
+        return meta
+
+    def refresh(self, url, meta):
+        # the server said that the snapshot is still valid
+        meta['fetched_at'] = time.time()
+        write_file(self.__meta_file_name(url), json.dumps(meta))
+        return meta
+
+    def get_conditional_headers(self, meta):
+        headers = {}
+        if meta['etag']:
+            headers['If-None-Match'] = meta['etag']
+        if meta['last_modified']:
+            headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+
+    def __list_entries(self):
+        urls_dir = os.path.join(self.cache_dir, URLS_DIR)
+        entries = []
+        for file_name in os.listdir(urls_dir):
+            meta_file_name = os.path.join(urls_dir, file_name)
+            try:
+                with open(meta_file_name, 'rb') as f:
+                    meta = json.load(f)
+                entries.append((os.path.getmtime(meta_file_name), meta_file_name, meta))
+            except (IOError, OSError, ValueError):
+                continue
+        return sorted(entries)
+
+    def get_size(self):
+        blobs_dir = os.path.join(self.cache_dir, BLOBS_DIR)
+        size = 0
+        for file_name in os.listdir(blobs_dir):
+            try:
+                size += os.path.getsize(os.path.join(blobs_dir, file_name))
+            except OSError:
+                # evicted meanwhile by another process
+                continue
+        return size
+
+    def evict(self):
+        if self.max_size is None or self.get_size() <= self.max_size:
+            return
+        with self.lock:
+            entries = self.__list_entries()
+            references = {}
+            for _, _, meta in entries:
+                references[meta['digest']] = references.get(meta['digest'], 0) + 1
+            size = self.get_size()
+            for _, meta_file_name, meta in entries:
+                if size <= self.max_size:
+                    break
+                logger.debug('Evicting %s from the page cache', meta['url'])
+                try:
+                    os.remove(meta_file_name)
+                except OSError:
+                    pass
+                references[meta['digest']] -= 1
+                if references[meta['digest']] == 0:
+                    try:
+                        os.remove(self.__blob_file_name(meta['digest']))
+                        size -= meta['size']
+                    except OSError:
+                        pass
+
+    def clear(self):
+        for dir_name in [BLOBS_DIR, URLS_DIR]:
+            path = os.path.join(self.cache_dir, dir_name)
+            for file_name in os.listdir(path):
+                os.remove(os.path.join(path, file_name))
+
+
+def get_default_page_cache():
+    # the cache is configured through the PAGE_CACHE setting,
+    # scrapers run outside django don't use it
+    try:
+        from django.conf import settings
+        from django.core.exceptions import ImproperlyConfigured
+    except ImportError:
+        return None
+    try:
+        options = getattr(settings, 'PAGE_CACHE', None)
+    except ImproperlyConfigured:
+        return None
+    if not options:
+        return None
+    return PageCache(options['DIR'], ttl=options.get('TTL', DEF_TTL),
+                     max_size=options.get('MAX_SIZE', DEF_MAX_SIZE),
+                     offline=options.get('OFFLINE', False))
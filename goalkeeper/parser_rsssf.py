@@ -2,74 +2,255 @@
 
 __author__ = 'jorgesaldivar'
 
-import re, codecs, utils
+import re, codecs, os, utils
 from datetime import date
 
+DATA_DIR = 'data'
+
 months = ['jan', 'feb', 'mar', 'apr', 'may', 'jun',
           'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+month_numbers = dict([(month, i+1) for i, month in enumerate(months)])
 
 alpha_pattern = re.compile(r'[^A-Za-záéíóúñ\s]', re.UNICODE)
 num_pattern = re.compile('[^0-9]')
 alphanum_pattern = re.compile('[^\s\w]', re.UNICODE)
 not_num_pattern = re.compile('[0-9]')
+not_digit_pattern = re.compile(r'\D', re.UNICODE)
+round_pattern = re.compile('round|first leg|second leg')
+playoff_stage_pattern = re.compile('liguilla|cuadrangulares|quarterfinals')
+final_stage_pattern = re.compile('final|championship playoff')
+
+# kinds of the lines found inside a round
+BLANK_LINE = 'blank'
+GAME_LINE = 'game'
+DATE_LINE = 'date'
+GOALS_LINE = 'goals'
+GOALS_START_LINE = 'goals_start'
+GOALS_END_LINE = 'goals_end'
+OTHER_LINE = 'other'
+
+# kinds of the tokens of a game line
+WORD_TOKEN = 'word'
+SCORE_TOKEN = 'score'
+MARK_TOKEN = 'mark'  # brackets and parentheses, they close the teams
+
+
+class RsssfToken(object):
+    """
+    Word of a game line along with its kind and where it starts
+    in the line once its blanks are collapsed
+    """
+    __slots__ = ('kind', 'text', 'start')
+
+    def __init__(self, text, start):
+        self.text = text
+        self.start = start
+        if '-' in text:
+            self.kind = SCORE_TOKEN
+        elif '[' in text or ']' in text or '(' in text or ')' in text:
+            self.kind = MARK_TOKEN
+        else:
+            self.kind = WORD_TOKEN
+
+    @property
+    def score(self):
+        # goals of both sides of a result, e.g. 2-1
+        sides = self.text.split('-')
+        return extract_number(sides[0]), extract_number(sides[1])
+
+
+class GoalToken(object):
+    """
+    Goal of a goals line, its author is None when the goal is
+    only a minute of the previous author (e.g. J. Paredes 30, 77)
+    """
+    __slots__ = ('author', 'minute', 'type', 'times')
+
+    def __init__(self, author, minute, type, times):
+        self.author = author
+        self.minute = minute
+        self.type = type
+        self.times = times
+
+
+class RsssfLine(object):
+    """
+    Line of a RSSSF results file. It is lowercased once when it is read,
+    while its kind and the position of the month in it are worked out
+    the first time they are needed, so game lines are never split in
+    search of a date
+    """
+    __slots__ = ('text', 'lowered', '_kind', '_segments', '_month_pos', '_collapsed', '_tokens',
+                 '_goal_sides')
+
+    def __init__(self, text):
+        self.text = text
+        self.lowered = text.lower()
+        self._kind = None
+        self._segments = None
+        self._month_pos = None
+        self._collapsed = None
+        self._tokens = None
+        self._goal_sides = None
+
+    @classmethod
+    def from_tokens(cls, tokens):
+        # line made of the tokens of another line, which aren't split again
+        line = cls(' '.join([token.text for token in tokens]))
+        line._segments = [token.text for token in tokens]
+        return line
+
+    @property
+    def segments(self):
+        if self._segments is None:
+            self._segments = self.text.split(' ')
+        return self._segments
+
+    @property
+    def collapsed(self):
+        # the text with its blanks collapsed into single spaces
+        if self._collapsed is None:
+            self._collapsed = ' '.join(self.text.split())
+        return self._collapsed
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            self._tokens = []
+            start = 0
+            for word in self.collapsed.split(' '):
+                self._tokens.append(RsssfToken(word, start))
+                start += len(word) + 1
+        return self._tokens
+
+    @property
+    def goal_sides(self):
+        # goals of the home and the away team when the line separates
+        # them with ';' or '/', None when it doesn't
+        if self._goal_sides is None:
+            separator = ''
+            if ';' in self.text:
+                separator = ';'
+            if '/' in self.text:
+                separator = '/'
+            if separator != '':
+                sides = self.text.split(separator)
+                self._goal_sides = (lex_goals(sides[0]), lex_goals(sides[1]))
+            else:
+                self._goal_sides = ()
+        return self._goal_sides or None
+
+    def tail(self, text):
+        # rest of the line after the first occurrence of text, its
+        # tokens are reused when the rest starts at one of them
+        collapsed = self.collapsed
+        end = collapsed.find(text) + len(text)
+        for pos, token in enumerate(self.tokens):
+            if token.start >= end:
+                if collapsed[end:token.start].strip() == '':
+                    return RsssfLine.from_tokens(self.tokens[pos:])
+                break
+        return RsssfLine(collapsed[end:len(collapsed)].strip())
+
+    @property
+    def month_pos(self):
+        # position of the first segment that is a month, -1 if there is none
+        if self._month_pos is None:
+            self._month_pos = -1
+            for pos, segment in enumerate(self.segments):
+                if alpha_pattern.sub('', segment).lower() in month_numbers:
+                    self._month_pos = pos
+                    break
+        return self._month_pos
+
+    @property
+    def month(self):
+        if self.month_pos < 0:
+            return 0
+        return month_numbers[alpha_pattern.sub('', self.segments[self.month_pos]).lower()]
+
+    @property
+    def has_date(self):
+        return self.month_pos >= 0
+
+    @property
+    def kind(self):
+        # the checks follow the order in which the parser
+        # looks at the lines of a round
+        if self._kind is None:
+            if self.text.strip() == '':
+                self._kind = BLANK_LINE
+            elif '-' in self.text or u'\x96' in self.text:
+                self._kind = GAME_LINE
+            elif self.has_date:
+                self._kind = DATE_LINE
+            elif '[' in self.text and ']' in self.text:
+                self._kind = GOALS_LINE
+            elif '[' in self.text:
+                self._kind = GOALS_START_LINE
+            elif ']' in self.text:
+                self._kind = GOALS_END_LINE
+            else:
+                self._kind = OTHER_LINE
+        return self._kind
+
+
+def to_line(line):
+    if isinstance(line, RsssfLine):
+        return line
+    return RsssfLine(line)
+
+
+def lex_lines(lines):
+    for line in lines:
+        yield RsssfLine(format_txt(line))
 
 
 def extract_number(str):
-    return int(''.join([s for s in str if s.isdigit()]))
+    return int(not_digit_pattern.sub('', str))
 
 
 def is_date_in_line(line):
-    line_tokens = line.split(' ')
-    for line_token in line_tokens:
-        line_token = alpha_pattern.sub('', line_token)
-        for m in months:
-            if m == line_token.lower():
-                return True
-    return False
+    return to_line(line).has_date
 
 
 def get_game_date(line, date_round, year):
-    if is_date_in_line(line):
+    line = to_line(line)
+    if line.has_date:
         return get_round_date(line, year)
     else:
         return date_round
 
 
 def get_game_info(line, date_round, year, stadium=''):
-    line = " ".join(line.split())
-    line_result = line.split(' ')
+    line = to_line(line)
     home_team, away_team = [], []
     found_result = False
     home_goals, away_goals = 0, 0
     pen_home, pen_away = 0, 0
-    penalties = 'pen' in line
-    for element in line_result:
-        if '-' in element:
+    penalties = 'pen' in line.collapsed
+    for token in line.tokens:
+        if token.kind == SCORE_TOKEN:
             if not found_result:
                 found_result = True
-                home_goals = extract_number(element.split('-')[0])
-                away_goals = extract_number(element.split('-')[1])
+                home_goals, away_goals = token.score
             else:
                 if penalties:
-                    pen_home = extract_number(element.split('-')[0])
-                    pen_away = extract_number(element.split('-')[1])
+                    pen_home, pen_away = token.score
                     break
-        else:
-            if '[' not in element and ']' not in element and \
-               '(' not in element and ')' not in element:
-                if not found_result:
-                    home_team.append(element.strip())
-                else:
-                    if 'player' in element:
-                        break
-                    away_team.append(element.strip())
+        elif token.kind == WORD_TOKEN:
+            if not found_result:
+                home_team.append(token.text)
             else:
-                break
+                if 'player' in token.text:
+                    break
+                away_team.append(token.text)
+        else:
+            break
     home_team = ' '.join(home_team)
     away_team = ' '.join(away_team)
 
-    line_last_part = line[line.find(away_team)+len(away_team):len(line)].strip()
-    date_game = get_game_date(line_last_part, date_round, year)
+    date_game = get_game_date(line.tail(away_team), date_round, year)
 
     game = {'date': date_game, 'stadium': stadium,
             'home_team': {'name': home_team, 'score': int(home_goals),
@@ -95,88 +276,65 @@ def format_txt(text):
 
 
 def to_month_number(month_letter):
-    month_letter = month_letter.lower()
-    return months.index(month_letter) + 1
+    return month_numbers[month_letter.lower()]
 
 
 def get_round_date(line, year):
-    reg_exp_open = ''
-    reg_exp_close = ''
-
-    if '[' in line:
-        reg_exp_open = '\['
-        reg_exp_close = '\]'
-    elif '(' in line:
-        reg_exp_open = '\('
-        reg_exp_close = '\)'
-    if reg_exp_open != '' and \
-       reg_exp_close != '':
-        line_segments = line.strip().split(' ')
-        # search month in line
-        month, i, idx_month = '', 0, 0
-        while i < len(line_segments):
-            segment = alpha_pattern.sub('', line_segments[i]).lower()
-            for m in months:
-                if m == segment:
-                    month = segment
-                    idx_month = i
-                    i = len(line_segments)
-                    break
-            i += 1
-        # get day
-        days = line_segments[idx_month+1]
-        if '-' in days:
-            days_vec = days.split('-')
+    line = to_line(line)
+    if '[' not in line.text and '(' not in line.text:
+        return None
+    if line.text != line.text.strip():
+        line = RsssfLine(line.text.strip())
+    # get day, which comes after the month (or after
+    # the first word if there is no month in the line)
+    days = line.segments[max(line.month_pos, 0)+1]
+    if '-' in days:
+        days_vec = days.split('-')
+        try:
+            day = int(num_pattern.sub('', days_vec[1]))
+        except ValueError:
+            day = int(num_pattern.sub('', days_vec[0]))
+    else:
+        if ',' in days:
+            days_vec = days.split(',')
             try:
                 day = int(num_pattern.sub('', days_vec[1]))
             except ValueError:
                 day = int(num_pattern.sub('', days_vec[0]))
         else:
-            if ',' in days:
-                days_vec = days.split(',')
-                try:
-                    day = int(num_pattern.sub('', days_vec[1]))
-                except ValueError:
-                    day = int(num_pattern.sub('', days_vec[0]))
-            else:
-                day = int(num_pattern.sub('', days))
-        try:
-            return date(int(year), int(to_month_number(month)), int(day)).isoformat()
-        except Exception as e:
-            return None
-    else:
+            day = int(num_pattern.sub('', days))
+    try:
+        return date(int(year), line.month, int(day)).isoformat()
+    except Exception as e:
         return None
 
 
 def is_a_round_line(line, next_line, year):
     year = str(year)
-    if 'round' in line.lower() or \
-       'first leg' in line.lower() or \
-       'second leg' in line.lower():
+    line = to_line(line).lowered
+    if round_pattern.search(line):
         return True
-    elif 'semifinals' in line.lower() and \
-         next_line != '':
+    elif 'semifinals' in line and \
+         to_line(next_line).text != '':
         return True
-    elif 'playoff for third libertadores place' in line.lower() and \
+    elif 'playoff for third libertadores place' in line and \
          year == '1999':
         return True
-    elif 'runners-up playoff' in line.lower() and year == '2001':
+    elif 'runners-up playoff' in line and year == '2001':
         return True
-    elif 'playoff for copa sudamericana 2006' in line.lower() and year == '2005':
+    elif 'playoff for copa sudamericana 2006' in line and year == '2005':
         return True
     else:
         return False
 
 
 def update_championship_stage(line, current_stage):
-    if 'liguilla' in line.lower() or \
-       'cuadrangulares' in line.lower() or \
-       'quarterfinals' in line.lower():
+    line = to_line(line).lowered
+    if playoff_stage_pattern.search(line):
         return 'playoff'
-    elif 'semifinals' in line.lower():
+    elif 'semifinals' in line:
         return 'semifinals'
-    elif 'final' in line.lower() or \
-         'championship playoff' in line.lower():
+    elif final_stage_pattern.search(line):
         return 'final'
     else:
         return current_stage
@@ -188,80 +346,112 @@ def get_alpha_characters(raw_str):
     return raw_str
 
 
-def process_goals(goals_raw):
-    goals_vec = []
+def lex_goal(goal_raw):
+    # remove leading and trailing whitespaces
+    goal_raw = goal_raw.strip()
+    # remove every character that isn't number or letter
+    goal_raw = alphanum_pattern.sub('', goal_raw)
+    if goal_raw == '':
+        return None
+    # set default type of goal and the default time scored by a player
+    type_goal, times_scored = '', 1
+    # consider the case in which there is a number between parenthesis that
+    # indicates that a player scored more than one goal
+    if '(' in goal_raw and ')' in goal_raw:
+        try:
+            times_scored = int(goal_raw[goal_raw.find('(')+1:goal_raw.find(')')])
+            goal_raw = goal_raw[:goal_raw.find('(')].strip() + goal_raw[goal_raw.find(')')+1:].strip()
+        except ValueError:
+            pass
+    try:
+        minute = extract_number(goal_raw)
+    except ValueError:
+        minute = -1
+    # consider own goals
+    # e.g., M. Acosta 31 og
+    if 'og' in goal_raw:
+        type_goal = 'own goal'
+        goal_raw = goal_raw.replace('og', '').strip()
+    # consider penalty goals
+    # e.g., F. Caballero 90 pk or F. Esteche 19pen
+    if 'pk' in goal_raw or 'pen' in goal_raw:
+        type_goal = 'penalty'
+        goal_raw = goal_raw.replace('pk', '').strip()  # Remove reference to penalty
+        goal_raw = goal_raw.replace('pen', '').strip()  # Remove reference to penalty
+    # consider the case when a single player score more than one goal
+    # e.g., J. Paredes 30, 77
+    author = None if goal_raw.isdigit() else get_alpha_characters(goal_raw)
+    return GoalToken(author, minute, type_goal, times_scored)
+
+
+def lex_goals(goals_raw):
+    goal_tokens = []
     for goal_raw in goals_raw.split(','):
-        # remove leading and trailing whitespaces
-        goal_raw = goal_raw.strip()
-        # remove every character that isn't number or letter
-        goal_raw = alphanum_pattern.sub('', goal_raw)
-        if goal_raw != '':
-            # set default type of goal and the default time scored by a player
-            type_goal, times_scored = '', 1
-            # consider the case in which there is a number between parenthesis that
-            # indicates that a player scored more than one goal
-            if '(' in goal_raw and ')' in goal_raw:
-                try:
-                    times_scored = int(goal_raw[goal_raw.find('(')+1:goal_raw.find(')')])
-                    goal_raw = goal_raw[:goal_raw.find('(')].strip() + goal_raw[goal_raw.find(')')+1:].strip()
-                except ValueError:
-                    pass
-            try:
-                minute = extract_number(goal_raw)
-            except ValueError:
-                minute = -1
-            # consider own goals
-            # e.g., M. Acosta 31 og
-            if 'og' in goal_raw:
-                type_goal = 'own goal'
-                goal_raw = goal_raw.replace('og', '').strip()
-            # consider penalty goals
-            # e.g., F. Caballero 90 pk or F. Esteche 19pen
-            if 'pk' in goal_raw or 'pen' in goal_raw:
-                type_goal = 'penalty'
-                goal_raw = goal_raw.replace('pk', '').strip()  # Remove reference to penalty
-                goal_raw = goal_raw.replace('pen', '').strip()  # Remove reference to penalty
-            # consider the case when a single player score more than one goal
-            # e.g., J. Paredes 30, 77
-            if not goal_raw.isdigit():
-                author = get_alpha_characters(goal_raw)
-            # consider a very special case of penalty with the p at the end
-            # e.g., Aristides Masi 8p
-            if author[-1] == 'p' and author[-2] == ' ':
-                type_goal = 'penalty'
-                author = author[:-2].strip()
-            for ts in range(0, times_scored):
-                goals_vec.append(
-                    {'author': author.strip(),
-                     'minute': minute,
-                     'type': type_goal}
-                )
+        goal_token = lex_goal(goal_raw)
+        if goal_token is not None:
+            goal_tokens.append(goal_token)
+    return goal_tokens
+
+
+def expand_goals(goal_tokens):
+    goals_vec = []
+    for goal_token in goal_tokens:
+        type_goal = goal_token.type
+        if goal_token.author is not None:
+            author = goal_token.author
+        # consider a very special case of penalty with the p at the end
+        # e.g., Aristides Masi 8p
+        if author[-1] == 'p' and author[-2] == ' ':
+            type_goal = 'penalty'
+            author = author[:-2].strip()
+        for ts in range(0, goal_token.times):
+            goals_vec.append(
+                {'author': author.strip(),
+                 'minute': goal_token.minute,
+                 'type': type_goal}
+            )
     return goals_vec
 
 
+def process_goals(goals_raw):
+    return expand_goals(lex_goals(goals_raw))
+
+
 def get_goal_info(line, game):
-    ch_split = ''
-    if ';' in line:
-        ch_split = ';'
-    if '/' in line:
-        ch_split = '/'
-    if ch_split != '':
-        goals = line.split(ch_split)
-        game['home_team']['goals_info'].extend(process_goals(goals[0]))
-        game['away_team']['goals_info'].extend(process_goals(goals[1]))
+    line = to_line(line)
+    goal_sides = line.goal_sides
+    if goal_sides is not None:
+        game['home_team']['goals_info'].extend(expand_goals(goal_sides[0]))
+        game['away_team']['goals_info'].extend(expand_goals(goal_sides[1]))
     else:
         if len(game['home_team']['goals_info']) < game['home_team']['score']:
-            game['home_team']['goals_info'].extend(process_goals(line))
+            game['home_team']['goals_info'].extend(process_goals(line.text))
         elif len(game['away_team']['goals_info']) < game['away_team']['score']:
-            game['away_team']['goals_info'].extend(process_goals(line))
+            game['away_team']['goals_info'].extend(process_goals(line.text))
         else:
-            print('Dont understand this goal info %', line)
-
-
-def read_championship_results(championship):
-    results_fname = 'data/' + championship['results_local_file_name']
+            print('Dont understand this goal info %', line.text)
+
+
+def iter_lines_with_lookahead(lines):
+    # yield every line together with the next one, the last
+    # line is given as its own next line
+    lines = iter(lines)
+    try:
+        line = next(lines)
+    except StopIteration:
+        return
+    for next_line in lines:
+        yield line, next_line
+        line = next_line
+    yield line, line
+
+
+def iter_championship_results(championship, data_dir=DATA_DIR):
+    # read the results file lazily and yield every round as soon
+    # as all its games were read
+    results_fname = os.path.join(data_dir, championship['results_local_file_name'])
     in_round = False
-    championship_games = []
+    current_round = None
     num_round = -1
     start_pointer, end_pointer = championship['start_string'], championship['end_string']
     date_round = ''
@@ -270,80 +460,63 @@ def read_championship_results(championship):
     stadium = ''
     in_championship_section = True if start_pointer == '' else False
     reading_game_goals_info = False
-    debug = False
 
     with codecs.open(results_fname, 'rb', encoding='ISO-8859-1') as file:
-        lines = file.readlines()
-        file.close()
-
-    total_lines = len(lines)
-    for num_line in range(0, total_lines):
-        line = lines[num_line]
-        line = format_txt(line)
-        next_line = format_txt(lines[num_line+1]) if num_line+1 < total_lines else line
-        if start_pointer in line.lower():
-            in_championship_section = True
-        if in_championship_section and end_pointer in line.lower():
-            break
-        if in_championship_section:
-            championship_stage = update_championship_stage(line, championship_stage)
-            if in_round:
-                if line.strip() == '':
-                    in_round = False
-                    continue
-                else:
-                    if '-' in line:  # the line contains the result of a game
-                        game_info = get_game_info(line, date_round, championship_year, stadium)
-                        championship_games[num_round]['games'].append(game_info)
-                    elif u'\x96' in line:
-                        line = line.replace(u'\x96', '-')
+        for line, next_line in iter_lines_with_lookahead(lex_lines(file)):
+            if start_pointer in line.lowered:
+                in_championship_section = True
+            if in_championship_section and end_pointer in line.lowered:
+                break
+            if in_championship_section:
+                championship_stage = update_championship_stage(line, championship_stage)
+                if in_round:
+                    kind = line.kind
+                    if kind == BLANK_LINE:
+                        in_round = False
+                        yield current_round
+                        continue
+                    elif kind == GAME_LINE:  # the line contains the result of a game
+                        if '-' not in line.text:
+                            line = RsssfLine(line.text.replace(u'\x96', '-'))
                         game_info = get_game_info(line, date_round, championship_year, stadium)
-                        championship_games[num_round]['games'].append(game_info)
-                    else:
-                        # if the line doesnt contain a game result, it could contain
-                        # the date of games or data about a game's goal situations
-                        if is_date_in_line(line):
-                            date_round = get_round_date(line, championship_year)
-                        elif '[' in line and ']' in line:
-                            reading_game_goals_info = False
-                            try:
-                                get_goal_info(line, championship_games[num_round]['games'][-1])
-                            except IndexError:
-                                print('Dont understand the line %s', line)
-                        elif '[' in line :
+                        current_round['games'].append(game_info)
+                    # if the line doesnt contain a game result, it could contain
+                    # the date of games or data about a game's goal situations
+                    elif kind == DATE_LINE:
+                        date_round = get_round_date(line, championship_year)
+                    elif kind == GOALS_LINE or kind == GOALS_START_LINE or reading_game_goals_info:
+                        if kind == GOALS_START_LINE:
                             reading_game_goals_info = True
-                            try:
-                                get_goal_info(line, championship_games[num_round]['games'][-1])
-                            except IndexError:
-                                print('Dont understand the line %s', line)
-                        elif ']' in line and reading_game_goals_info:
+                        elif kind != OTHER_LINE:
                             reading_game_goals_info = False
-                            try:
-                                get_goal_info(line, championship_games[num_round]['games'][-1])
-                            except IndexError:
-                                print('Dont understand the line %s', line)
-                        elif reading_game_goals_info:
-                            try:
-                                get_goal_info(line, championship_games[num_round]['games'][-1])
-                            except IndexError:
-                                print('Dont understand the line %s', line)
-                        elif 'bye' in line:
-                            continue
-                        else:
-                            print('Dont understand the line %s', line)
-            if is_a_round_line(line, next_line, championship_year):
-                date_round = get_round_date(line, championship_year)
-                # consider the case when the stadium is mentioned in the round line
-                # e.g., First Leg [May 18, Defensores del Chaco]
-                if date_round and ',' in line and championship_stage == 'final':
-                    stadium = get_alpha_characters(line.split(',')[1].strip())
-                num_round += 1
-                championship_games.append({'tournament': championship['name'], 'stage': championship_stage,
-                                           'round': num_round+1, 'games': []})
-                in_round = True
-                continue
-
-    return championship_games
+                        try:
+                            get_goal_info(line, current_round['games'][-1])
+                        except IndexError:
+                            print('Dont understand the line %s', line.text)
+                    elif 'bye' in line.text:
+                        continue
+                    else:
+                        print('Dont understand the line %s', line.text)
+                if is_a_round_line(line, next_line, championship_year):
+                    if in_round:
+                        # the previous round wasn't closed by a blank line
+                        yield current_round
+                    date_round = get_round_date(line, championship_year)
+                    # consider the case when the stadium is mentioned in the round line
+                    # e.g., First Leg [May 18, Defensores del Chaco]
+                    if date_round and ',' in line.text and championship_stage == 'final':
+                        stadium = get_alpha_characters(line.text.split(',')[1].strip())
+                    num_round += 1
+                    current_round = {'tournament': championship['name'], 'stage': championship_stage,
+                                     'round': num_round+1, 'games': []}
+                    in_round = True
+                    continue
+    if in_round:
+        yield current_round
+
+
+def read_championship_results(championship, data_dir=DATA_DIR):
+    return list(iter_championship_results(championship, data_dir))
 
 
 def get_data(championship):
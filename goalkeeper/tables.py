@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-s
+
+__author__ = 'jorgesaldivar'
+
+from bs4 import CData, NavigableString
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+
+TEXT_TYPES = (NavigableString, CData)
+# footnote references. Every <sup> of a cell is left out, the scrapers
+# used to clear only the first one and kept the text of the others
+# (e.g. "olimpia2" for "olimpia<sup>1</sup><sup>2</sup>")
+SKIP_TAGS = ('sup',)
+
+
+def get_cell_text(cell, strip=False, skip_tags=SKIP_TAGS):
+    # text of the cell leaving out the tags in skip_tags, unlike
+    # clearing them the tree is not modified
+    parts = []
+    for descendant in cell.descendants:
+        if type(descendant) not in TEXT_TYPES:
+            continue
+        parent = descendant.parent
+        while parent is not cell and parent.name not in skip_tags:
+            parent = parent.parent
+        if parent is not cell:
+            continue
+        if strip:
+            descendant = descendant.strip()
+            if not descendant:
+                continue
+        parts.append(descendant)
+    return u''.join(parts)
+
+
+def get_span(cell, attr):
+    try:
+        return max(int(cell.get(attr, 1)), 1)
+    except ValueError:
+        return 1
+
+
+def rows_to_grid(rows, value=get_cell_text, expand_colspan=True, cell_tags=('td', 'th')):
+    """
+    Dense matrix with a row for each tr. A cell with rowspan (or colspan)
+    takes the same value in every row (or column) it covers, and the
+    positions that no cell covers are None. The rows are read once,
+    keeping only the cells of previous rows that still span downwards
+    """
+    grid = []
+    pending = {}  # column -> [rows left, value] of the cells spanning downwards
+    for row in rows:
+        grid_row = []
+        for cell in row.find_all(cell_tags, recursive=False):
+            while len(grid_row) in pending:
+                grid_row.append(pending[len(grid_row)][1])
+            cell_value = value(cell)
+            rowspan = get_span(cell, 'rowspan')
+            colspan = get_span(cell, 'colspan') if expand_colspan else 1
+            for i in range(0, colspan):
+                if rowspan > 1:
+                    pending[len(grid_row)] = [rowspan, cell_value]
+                grid_row.append(cell_value)
+        # cells of previous rows that span after the last cell of the row
+        for col in sorted(pending.keys()):
+            if col >= len(grid_row):
+                grid_row.extend([None] * (col - len(grid_row)))
+                grid_row.append(pending[col][1])
+        for col in pending.keys():
+            pending[col][0] -= 1
+            if pending[col][0] == 0:
+                del pending[col]
+        grid.append(grid_row)
+    num_cols = max([len(grid_row) for grid_row in grid]) if grid else 0
+    for grid_row in grid:
+        grid_row.extend([None] * (num_cols - len(grid_row)))
+    return grid
+
+
+def table_to_grid(table, value=get_cell_text, expand_colspan=True, output='list'):
+    """
+    Matrix of the cells of the table (see rows_to_grid) as a list of lists,
+    a numpy array of objects (output='numpy') or a pandas data frame whose
+    columns are the first row of the table (output='pandas')
+    """
+    grid = rows_to_grid(table.find_all('tr'), value, expand_colspan)
+    if output == 'numpy':
+        if numpy is None:
+            raise ImportError('numpy is required to get the table as an array')
+        array = numpy.empty((len(grid), len(grid[0]) if grid else 0), dtype=object)
+        for i, grid_row in enumerate(grid):
+            array[i, :] = grid_row
+        return array
+    elif output == 'pandas':
+        if pandas is None:
+            raise ImportError('pandas is required to get the table as a data frame')
+        if not grid:
+            return pandas.DataFrame()
+        return pandas.DataFrame(grid[1:], columns=grid[0])
+    else:
+        return grid
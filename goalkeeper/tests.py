@@ -1,6 +1,545 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from django.test import TestCase
+import BaseHTTPServer, SocketServer, io, json, os, random, requests, shutil, tempfile, threading, time, types
 
-# Create your tests here.
+from bs4 import BeautifulSoup
+from django.test import SimpleTestCase
+from goalkeeper import data_collector, parser_rsssf
+from goalkeeper.fetcher import Fetcher, get_default_fetcher
+from goalkeeper.page_cache import BLOBS_DIR, PageCache, PageNotCached, URLS_DIR, get_hash
+from goalkeeper.tables import get_cell_text, table_to_grid
+from goalkeeper.fixtures import TESTDATA_DIR, TOURNAMENT_INFO, FixtureFetcher, FixturePage
+from goalkeeper.wiki_scrapers import ParaguayanChampionshipResultsScraper, \
+    ParaguayanTournamentScraper
+
+
+try:
+    import lxml
+    PARSERS = ['html.parser', 'lxml']
+except ImportError:
+    PARSERS = ['html.parser']
+
+
+class PageHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the pages of its server, which are revalidated through their ETag.
+    The connections are kept alive, every response tells its length
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def send_empty_response(self, status_code):
+        self.send_response(status_code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('If-None-Match')))
+        time.sleep(self.server.delays.get(self.path, 0))
+        if self.server.failures.get(self.path):
+            # the server fails the next requests to the page
+            self.server.failures[self.path] -= 1
+            self.send_empty_response(503)
+            return
+        if self.path not in self.server.pages:
+            self.send_empty_response(404)
+            return
+        etag, content = self.server.pages[self.path]
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # the clients that time out close their connections
+        pass
+
+
+class PageServer(object):
+    """
+    HTTP server on localhost that runs in its own thread, every
+    connection is served by a thread of its own
+    """
+
+    def __init__(self, pages=None):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+        self.server.pages = pages or {}
+        self.server.requests = []
+        self.server.failures = {}
+        self.server.delays = {}
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def pages(self):
+        return self.server.pages
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def failures(self):
+        return self.server.failures
+
+    @property
+    def delays(self):
+        return self.server.delays
+
+    def get_url(self, path):
+        return 'http://127.0.0.1:{0}{1}'.format(self.server.server_port, path)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class RecordedResponse(object):
+
+    def __init__(self, content, etag=None):
+        self.content = content
+        self.status_code = 200
+        self.encoding = 'utf-8'
+        self.apparent_encoding = 'utf-8'
+        self.headers = {'ETag': etag} if etag else {}
+
+
+class ParserBackendsTest(SimpleTestCase):
+    """
+    The scrapers have to extract the same information no matter the
+    parser used to build the dom nor whether only the tables are parsed
+    """
+
+    def collect_tournament_info(self, parser, only_tables):
+        scraper = ParaguayanTournamentScraper('', fetcher=FixtureFetcher('tournament_2010.html'),
+                                              parser=parser, only_tables=only_tables)
+        return scraper.collect_tournament_info({'name': 'apertura', 'year': 2010,
+                                                'additional_info': TOURNAMENT_INFO})
+
+    def collect_championship_results(self, parser, only_tables):
+        scraper = ParaguayanChampionshipResultsScraper('', fetcher=FixtureFetcher('results_2010.html'),
+                                                       parser=parser, only_tables=only_tables)
+        return scraper.collect_championship_results({'year': '2010'})
+
+    def test_tournament_info(self):
+        expected = self.collect_tournament_info('html.parser', False)
+        self.assertEqual(len(expected['teams']), 3)
+        self.assertEqual(len(expected['championship']['top_scorers']), 2)
+        for parser in PARSERS:
+            for only_tables in [False, True]:
+                self.assertEqual(self.collect_tournament_info(parser, only_tables), expected,
+                                 '{0} (only tables: {1})'.format(parser, only_tables))
+
+    def test_championship_results(self):
+        expected = self.collect_championship_results('html.parser', False)
+        self.assertEqual([len(fixture) for fixture in expected], [2, 1])
+        self.assertEqual(len(expected[0][0]['goals']['home_goals']), 2)
+        for parser in PARSERS:
+            for only_tables in [False, True]:
+                self.assertEqual(self.collect_championship_results(parser, only_tables), expected,
+                                 '{0} (only tables: {1})'.format(parser, only_tables))
+
+    def test_stats(self):
+        scraper = ParaguayanChampionshipResultsScraper('', fetcher=FixtureFetcher('results_2010.html'))
+        scraper.collect_championship_results({'year': '2010'})
+        self.assertEqual(scraper.stats.num_requests, 1)
+        self.assertEqual(scraper.stats.num_bytes, len(FixturePage('results_2010.html').content))
+        self.assertGreater(scraper.stats.parse_time, 0)
+
+    def test_scrapers_dont_share_tables(self):
+        scraper = ParaguayanTournamentScraper('', fetcher=FixtureFetcher('tournament_2010.html'))
+        scraper.collect_tournament_info({'name': 'apertura', 'year': 2010,
+                                         'additional_info': TOURNAMENT_INFO})
+        self.assertTrue(scraper.tables)
+        other_scraper = ParaguayanTournamentScraper('', fetcher=FixtureFetcher('tournament_2010.html'))
+        self.assertEqual(other_scraper.tables, [])
+        self.assertEqual(other_scraper.table_index, {})
+        self.assertEqual(other_scraper.matching_tables, {})
+
+
+class FixtureMatrixTest(SimpleTestCase):
+    """
+    Matrices of the fixture tables of wikipedia, the cells with rowspan
+    are repeated in the rows they cover and the rows of goals (a single
+    wide cell) keep their other columns empty
+    """
+
+    HEADERS = ['Equipo local', 'Resultado', 'Equipo visitante', 'Estadio', 'D\xeda', 'Hora',
+               '\xc1rbitro<sup>[a]</sup>']
+
+    def get_matrix(self, table):
+        scraper = ParaguayanChampionshipResultsScraper('', fetcher=FixtureFetcher('results_2010.html'))
+        return scraper._ParaguayanChampionshipResultsScraper__table_to_matrix(table)
+
+    def random_table(self, rnd):
+        # html of a fixture with the matrix expected for its games
+        rows = ['<tr><th colspan="7">Fecha 1</th></tr>',
+                '<tr>{0}</tr>'.format(''.join(['<th>{0}</th>'.format(h) for h in self.HEADERS]))]
+        expected = []
+        stadium, stadium_left, day, day_left = None, 0, None, 0
+        for i in range(0, rnd.randint(1, 4)):
+            score = '{0}-{1}'.format(rnd.randint(0, 3), rnd.randint(0, 3))
+            cells = ['<td>Team {0}<sup>1</sup></td>'.format(i), '<td>{0}</td>'.format(score),
+                     '<td>Rival&nbsp;{0}</td>'.format(i)]
+            if stadium_left == 0:
+                stadium, stadium_left = 'Estadio {0}'.format(i), rnd.randint(1, 2)
+                cells.append('<td rowspan="{0}">{1}</td>'.format(stadium_left, stadium))
+            if day_left == 0:
+                day, day_left = '{0} de febrero'.format(i + 1), rnd.randint(1, 3)
+                cells.append('<td rowspan="{0}">{1}</td>'.format(day_left, day))
+            stadium_left, day_left = stadium_left - 1, day_left - 1
+            cells.extend(['<td>1{0}:00</td>'.format(i), '<td>Ref {0}</td>'.format(i)])
+            rows.append('<tr>{0}</tr>'.format(''.join(cells)))
+            expected.append(['team {0}'.format(i), score, 'rival {0}'.format(i), stadium.lower(), day,
+                             '1{0}:00'.format(i), 'ref {0}'.format(i)])
+            if stadium_left == 0 and day_left == 0 and rnd.random() < 0.5:
+                rows.append('<tr><td colspan="7">Goles: X 1\'</td></tr>')
+                expected.append(['goles: x 1\''] + [None] * 6)
+        return '<table>{0}</table>'.format(''.join(rows)), expected
+
+    def test_random_tables(self):
+        rnd = random.Random(5)
+        for i in range(0, 200):
+            html, expected = self.random_table(rnd)
+            table = BeautifulSoup(html, 'html.parser').table
+            matrix = self.get_matrix(table)
+            self.assertEqual([header['content'] for header in matrix[0]],
+                             ['equipo local', 'resultado', 'equipo visitante', 'estadio', 'dia', 'hora',
+                              'arbitro'])
+            self.assertEqual(matrix[1:], expected, html)
+            # the tree is left as it was
+            self.assertEqual(str(table), str(BeautifulSoup(html, 'html.parser').table))
+
+    def test_footnotes(self):
+        cell = BeautifulSoup('<td>Olimpia<sup>1</sup> <b>A</b><sup>[2]</sup></td>', 'html.parser').td
+        self.assertEqual(get_cell_text(cell), 'Olimpia A')
+        self.assertEqual(get_cell_text(cell, skip_tags=()), 'Olimpia1 A[2]')
+
+    def test_table_to_grid(self):
+        table = BeautifulSoup('<table><tr><th>a</th><th colspan="2">b</th></tr>'
+                              '<tr><td rowspan="2">1</td><td>2</td><td>3</td></tr>'
+                              '<tr><td colspan="2">4</td></tr><tr><td>5</td></tr></table>', 'html.parser').table
+        self.assertEqual(table_to_grid(table), [['a', 'b', 'b'], ['1', '2', '3'], ['1', '4', '4'],
+                                                ['5', None, None]])
+        self.assertEqual(table_to_grid(table, expand_colspan=False), [['a', 'b', None], ['1', '2', '3'],
+                                                                      ['1', '4', None], ['5', None, None]])
+
+
+class RsssfParserTest(SimpleTestCase):
+    """
+    campeonatos1998_apertura.json holds what the parser returned for the
+    season before it read the file lazily, the output can't change
+    """
+
+    CHAMPIONSHIP = {'name': 'Apertura', 'year': 1998, 'start_string': '', 'end_string': 'torneo clausura',
+                    'results_local_file_name': 'campeonatos1998.html'}
+
+    def setUp(self):
+        with io.open(os.path.join(TESTDATA_DIR, 'campeonatos1998_apertura.json'), encoding='utf-8') as f:
+            self.expected = json.load(f)
+
+    def test_recorded_output(self):
+        results = parser_rsssf.read_championship_results(self.CHAMPIONSHIP, TESTDATA_DIR)
+        self.assertEqual(len(results), 22)
+        self.assertEqual(sum([len(result['games']) for result in results]), 132)
+        self.assertEqual(results, self.expected)
+
+    def test_rounds_are_streamed(self):
+        rounds = parser_rsssf.iter_championship_results(self.CHAMPIONSHIP, TESTDATA_DIR)
+        self.assertIsInstance(rounds, types.GeneratorType)
+        self.assertEqual(next(rounds), self.expected[0])
+        self.assertEqual(list(rounds), self.expected[1:])
+
+
+class DataCollectorTest(SimpleTestCase):
+
+    META_CHAMPIONSHIPS = [{'name': 'Apertura', 'year': year} for year in ['1996', '1998', '2007', '2008', '2010']]
+
+    def get_years(self, *args, **kwargs):
+        return [int(championship['year']) for championship in
+                data_collector.select_championships(self.META_CHAMPIONSHIPS, *args, **kwargs)]
+
+    def test_select_championships(self):
+        self.assertEqual(self.get_years(), [1996, 1998, 2007])
+        self.assertEqual(self.get_years(from_year=1998), [1998, 2007])
+        self.assertEqual(self.get_years(1997, 2000), [1998])
+        # the later seasons aren't in rsssf, whatever the range asked
+        self.assertEqual(self.get_years(to_year=2010), [1996, 1998, 2007])
+        self.assertEqual(self.get_years(to_year=None), [1996, 1998, 2007])
+        self.assertEqual(self.get_years(from_year=2008, to_year=2010), [])
+
+    def test_results_file_name(self):
+        self.assertEqual(data_collector.get_results_file_name({'name': 'Apertura', 'year': '1998'}),
+                         '1998_apertura.json')
+        self.assertEqual(data_collector.get_results_file_name({'name': 'Torneo Integración (2ª fase)',
+                                                               'year': 1998}),
+                         '1998_torneo_integracion_2_fase.json')
+
+    def test_results_in_order(self):
+        # nothing is read for the clausura from the recorded file, which
+        # tells the results of the two seasons apart
+        clausura = dict(RsssfParserTest.CHAMPIONSHIP, name='Clausura', start_string='torneo clausura',
+                        end_string='')
+        championships = [clausura, RsssfParserTest.CHAMPIONSHIP, clausura, RsssfParserTest.CHAMPIONSHIP]
+        results = list(data_collector.iter_championships_results(championships, TESTDATA_DIR, num_workers=1))
+        self.assertEqual([championship for championship, _ in results], championships)
+        self.assertEqual([len(rounds) for _, rounds in results], [0, 22, 0, 22])
+        expected = parser_rsssf.read_championship_results(RsssfParserTest.CHAMPIONSHIP, TESTDATA_DIR)
+        self.assertEqual(results[1][1], expected)
+        self.assertEqual(results[3][1], expected)
+
+
+class RsssfLexerTest(SimpleTestCase):
+
+    def test_game_line_tokens(self):
+        line = parser_rsssf.RsssfLine('Olimpia 1-1  Cerro Porteño 4-2 pen [Dec 20]')
+        self.assertEqual([(token.kind, token.text) for token in line.tokens], [
+            ('word', 'Olimpia'), ('score', '1-1'), ('word', 'Cerro'), ('word', 'Porteño'), ('score', '4-2'),
+            ('word', 'pen'), ('mark', '[Dec'), ('mark', '20]')])
+        self.assertEqual(line.tokens[4].score, (4, 2))
+        self.assertEqual(line.tail('Porteño').segments, ['4-2', 'pen', '[Dec', '20]'])
+
+    def test_get_game_info(self):
+        game = parser_rsssf.get_game_info('Olimpia 1-1  Cerro Porteño 4-2 pen [Dec 20]', '1998-02-08', 1998)
+        self.assertEqual(game, {
+            'date': '1998-12-20', 'stadium': '',
+            'home_team': {'name': 'Olimpia', 'score': 1, 'penalties_home': 4, 'goals_info': []},
+            'away_team': {'name': 'Cerro Porteño', 'score': 1, 'penalties_away': 2, 'goals_info': []}})
+        # without date the game is played on the date of the round
+        game = parser_rsssf.get_game_info('Guarani 3-1 Nacional (player sent off)', '1998-02-08', 1998)
+        self.assertEqual((game['home_team']['name'], game['away_team']['name'], game['date']),
+                         ('Guarani', 'Nacional', '1998-02-08'))
+
+    def test_process_goals(self):
+        goals = parser_rsssf.process_goals('M. Acosta 31og, F. Caballero 90pk, Aristides Masi 8p, 77')
+        self.assertEqual(goals, [{'author': 'M Acosta', 'minute': 31, 'type': 'own goal'},
+                                 {'author': 'F Caballero', 'minute': 90, 'type': 'penalty'},
+                                 {'author': 'Aristides Masi', 'minute': 8, 'type': 'penalty'},
+                                 {'author': 'Aristides Masi', 'minute': 77, 'type': ''}])
+        # the minute alone is a goal of the previous author
+        self.assertEqual(parser_rsssf.lex_goals('J. Paredes 30, 77')[1].author, None)
+
+    def test_get_goal_info(self):
+        game = {'home_team': {'score': 2, 'goals_info': []}, 'away_team': {'score': 1, 'goals_info': []}}
+        parser_rsssf.get_goal_info('[C. Benítez 10, A. Paredes 67; V. Ledesma 33]', game)
+        self.assertEqual([goal['author'] for goal in game['home_team']['goals_info']], ['C Benítez', 'A Paredes'])
+        self.assertEqual([goal['author'] for goal in game['away_team']['goals_info']], ['V Ledesma'])
+        # without separator the goals go to the first side that misses them
+        game = {'home_team': {'score': 0, 'goals_info': []}, 'away_team': {'score': 2, 'goals_info': []}}
+        parser_rsssf.get_goal_info('[J. Paredes 30, 77]', game)
+        self.assertEqual([goal['minute'] for goal in game['away_team']['goals_info']], [30, 77])
+
+
+class PageCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.server = PageServer({'/season': ('"v1"', b'<html>season</html>')})
+        self.url = self.server.get_url('/season')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def get_fetcher(self, **options):
+        return Fetcher(cache=PageCache(self.cache_dir, **options))
+
+    def test_fresh_pages(self):
+        fetcher = self.get_fetcher()
+        self.assertEqual(fetcher.get(self.url).content, b'<html>season</html>')
+        page = fetcher.get(self.url)
+        self.assertTrue(page.from_cache)
+        self.assertEqual(page.content, b'<html>season</html>')
+        self.assertEqual(self.server.requests, [('/season', None)])
+        self.assertEqual(fetcher.get_metrics()['cache_hits'], 1)
+
+    def test_revalidation(self):
+        fetcher = self.get_fetcher(ttl=0)
+        fetcher.get(self.url)
+        # the stale page is still valid for the server
+        page = fetcher.get(self.url)
+        self.assertTrue(page.from_cache)
+        self.assertEqual(page.headers['ETag'], '"v1"')
+        self.assertEqual(self.server.requests, [('/season', None), ('/season', '"v1"')])
+        self.assertEqual(fetcher.get_metrics()['cache_revalidations'], 1)
+        # the page changed
+        self.server.pages['/season'] = ('"v2"', b'<html>season, updated</html>')
+        page = fetcher.get(self.url)
+        self.assertFalse(getattr(page, 'from_cache', False))
+        self.assertEqual(fetcher.get(self.url).content, b'<html>season, updated</html>')
+        self.assertEqual(self.server.requests[-1], ('/season', '"v2"'))
+
+    def test_ttl(self):
+        cache = PageCache(self.cache_dir, ttl=60)
+        meta = cache.put(self.url, RecordedResponse(b'<html>season</html>'))
+        self.assertTrue(cache.is_fresh(meta))
+        meta['fetched_at'] = time.time() - 61
+        self.assertFalse(cache.is_fresh(meta))
+        self.assertFalse(PageCache(self.cache_dir, ttl=None).is_fresh(cache.get_meta(self.url)))
+
+    def test_offline(self):
+        self.get_fetcher().get(self.url)
+        self.server.stop()
+        fetcher = self.get_fetcher(ttl=0, offline=True)
+        # stale pages are replayed without asking the server
+        self.assertEqual(fetcher.get(self.url).content, b'<html>season</html>')
+        with self.assertRaises(PageNotCached):
+            fetcher.get(self.server.get_url('/other-season'))
+        self.server = PageServer()
+
+    def test_lru_eviction(self):
+        cache = PageCache(self.cache_dir, max_size=25)
+        urls = ['http://example.com/{0}'.format(i) for i in range(0, 3)]
+        for i, url in enumerate(urls[:2]):
+            cache.put(url, RecordedResponse('page {0}'.format(i).ljust(10).encode('utf-8')))
+        # the first page is used after the second one was stored
+        now = time.time()
+        for i, url in enumerate(urls[:2]):
+            meta_file_name = os.path.join(self.cache_dir, URLS_DIR, get_hash(url) + '.json')
+            os.utime(meta_file_name, (now - 10 + i, now - 10 + i))
+        cache.get_page(urls[0], cache.get_meta(urls[0]))
+        cache.put(urls[2], RecordedResponse(b'page 2'.ljust(10)))
+        self.assertIsNotNone(cache.get_meta(urls[0]))
+        self.assertIsNone(cache.get_meta(urls[1]))
+        self.assertIsNotNone(cache.get_meta(urls[2]))
+        self.assertLessEqual(cache.get_size(), 25)
+        # the same content is stored once
+        cache.put(urls[1], RecordedResponse(b'page 2'.ljust(10)))
+        self.assertEqual(cache.get_size(), 20)
+
+    def test_unreadable_entries(self):
+        fetcher = self.get_fetcher()
+        fetcher.get(self.url)
+        cache = fetcher.cache
+        meta = cache.get_meta(self.url)
+        blob_file_name = os.path.join(self.cache_dir, BLOBS_DIR, meta['digest'])
+        # a partial snapshot is a miss and the page is downloaded again
+        with open(blob_file_name, 'wb') as f:
+            f.write(b'<html>sea')
+        self.assertIsNone(cache.get_page(self.url, meta))
+        self.assertEqual(fetcher.get(self.url).content, b'<html>season</html>')
+        self.assertEqual(len(self.server.requests), 2)
+        # the snapshot was evicted by another process after get_meta
+        os.remove(blob_file_name)
+        self.assertIsNone(cache.get_page(self.url, meta))
+        # partial metadata
+        meta_file_name = os.path.join(self.cache_dir, URLS_DIR, get_hash(self.url) + '.json')
+        with open(meta_file_name, 'wb') as f:
+            f.write(b'{"url": "')
+        self.assertIsNone(cache.get_meta(self.url))
+        self.assertEqual(fetcher.get(self.url).content, b'<html>season</html>')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertIsNotNone(cache.get_page(self.url, cache.get_meta(self.url)))
+
+    def test_revalidated_entry_evicted(self):
+        fetcher = self.get_fetcher(ttl=0)
+        fetcher.get(self.url)
+        meta = fetcher.cache.get_meta(self.url)
+        os.remove(os.path.join(self.cache_dir, BLOBS_DIR, meta['digest']))
+        fetcher.cache.get_meta = lambda url: meta
+        # the server validates the snapshot but it is gone
+        self.assertEqual(fetcher.get(self.url).content, b'<html>season</html>')
+        self.assertEqual(self.server.requests, [('/season', None), ('/season', '"v1"'), ('/season', None)])
+
+
+class FetcherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = PageServer({'/season': ('"v1"', b'<html>season</html>')})
+        self.url = self.server.get_url('/season')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def get_fetcher(self, **options):
+        fetcher = Fetcher(backoff_factor=0, **options)
+        self.addCleanup(fetcher.close)
+        return fetcher
+
+    def test_connections_are_reused(self):
+        fetcher = self.get_fetcher()
+        for i in range(0, 3):
+            self.assertEqual(fetcher.get(self.url).content, b'<html>season</html>')
+        metrics = fetcher.get_metrics()
+        self.assertEqual((metrics['requests'], metrics['failures'], metrics['bytes']), (3, 0, 57))
+        self.assertEqual((metrics['connections_opened'], metrics['connections_reused']), (1, 2))
+        self.assertGreater(metrics['max_latency'], 0)
+
+    def test_server_errors_are_retried(self):
+        self.server.failures['/season'] = 2
+        fetcher = self.get_fetcher()
+        self.assertEqual(fetcher.get(self.url).content, b'<html>season</html>')
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(fetcher.get_metrics()['failures'], 0)
+
+    def test_retries_are_bounded(self):
+        self.server.failures['/season'] = 5
+        fetcher = self.get_fetcher(retries=2)
+        self.assertEqual(fetcher.get(self.url).status_code, 503)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(fetcher.get_metrics()['failures'], 1)
+
+    def test_timeout(self):
+        self.server.delays['/season'] = 0.5
+        fetcher = self.get_fetcher(timeout=(1, 0.1), retries=0)
+        with self.assertRaises(requests.RequestException):
+            fetcher.get(self.url)
+        self.assertEqual(fetcher.get_metrics()['failures'], 1)
+
+    def test_scrapers_share_the_default_fetcher(self):
+        scrapers = [ParaguayanChampionshipResultsScraper(self.url), ParaguayanTournamentScraper(self.url)]
+        self.assertEqual([scraper.fetcher for scraper in scrapers], [get_default_fetcher()] * 2)
+
+
+class PrefetchTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = PageServer({'/season': ('"v1"', b'<html>season</html>')})
+        self.url = self.server.get_url('/season')
+        self.fetcher = Fetcher()
+
+    def tearDown(self):
+        self.fetcher.close()
+        self.server.stop()
+
+    def update_page(self):
+        self.server.pages['/season'] = ('"v2"', b'<html>season, updated</html>')
+
+    def test_prefetched_pages(self):
+        self.fetcher.prefetch([self.url, self.url])
+        self.update_page()
+        # the page is served as many times as it was asked for
+        self.assertEqual(self.fetcher.get(self.url).content, b'<html>season</html>')
+        self.assertEqual(self.fetcher.get(self.url).content, b'<html>season</html>')
+        self.assertEqual(self.fetcher.get(self.url).content, b'<html>season, updated</html>')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_pages_left_after_the_batch(self):
+        with self.fetcher.prefetching([self.url]):
+            pass
+        self.update_page()
+        self.assertEqual(self.fetcher.prefetched, {})
+        self.assertEqual(self.fetcher.get(self.url).content, b'<html>season, updated</html>')
+
+    def test_expired_pages(self):
+        fetcher = Fetcher(prefetch_ttl=60)
+        fetcher.prefetch([self.url])
+        self.update_page()
+        fetcher.prefetched[self.url][2] -= 61
+        self.assertEqual(fetcher.get(self.url).content, b'<html>season, updated</html>')
+        self.assertEqual(fetcher.prefetched, {})
+        fetcher.close()
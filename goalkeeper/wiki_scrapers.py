@@ -2,9 +2,12 @@
 
 __author__ = 'jorgesaldivar'
 
-import requests, utils, pytz, re
-from bs4 import BeautifulSoup, NavigableString
+import utils, pytz, re, time
+from collections import defaultdict
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer
 from datetime import date, datetime
+from fetcher import DEF_CONCURRENCY, DEF_HOST_DELAY, get_default_fetcher
+from tables import get_cell_text, rows_to_grid
 
 # Background color
 YELLOW_HEX = '#ffcc00;'
@@ -22,6 +25,50 @@ DARK_GREEN_HEX = '#66cdaa'
 GREEN_HEX2 = '#32cd32'
 RED_HEX = '#ff4444;'
 
+try:
+    import lxml
+    DEF_PARSER = 'lxml'
+except ImportError:
+    DEF_PARSER = 'html.parser'
+
+
+def parse_html(html, parser=None, only_tables=False):
+    # the scrapers only read the tables of the pages, with only_tables
+    # the rest of the document is skipped while parsing
+    parse_only = SoupStrainer('table') if only_tables else None
+    return BeautifulSoup(html, parser or DEF_PARSER, parse_only=parse_only)
+
+
+class ScraperStats(object):
+    """
+    Time spent by a scraper downloading and parsing its pages and the
+    bytes downloaded, the pages served by the cache count as requests too
+    """
+
+    def __init__(self):
+        self.num_requests = 0
+        self.num_bytes = 0
+        self.fetch_time = 0.0
+        self.max_latency = 0.0
+        self.parse_time = 0.0
+
+    def fetch(self, fetcher, url):
+        start = time.time()
+        response = fetcher.get(url)
+        latency = time.time() - start
+        self.num_requests += 1
+        self.num_bytes += len(response.content)
+        self.fetch_time += latency
+        self.max_latency = max(self.max_latency, latency)
+        return response
+
+    def parse(self, parse_func, *args):
+        start = time.time()
+        try:
+            return parse_func(*args)
+        finally:
+            self.parse_time += time.time() - start
+
 
 class ParaguayanChampionshipResultsScraper:
     url = ''
@@ -31,23 +78,32 @@ class ParaguayanChampionshipResultsScraper:
     num_pattern = ''
     alpha_pattern = ''
 
-    def __init__(self, url):
+    def __init__(self, url, fetcher=None, parser=None, only_tables=True):
         self.url = url
+        self.fetcher = fetcher or get_default_fetcher()
+        self.parser = parser
+        self.only_tables = only_tables
+        self.stats = ScraperStats()
         self.num_pattern = re.compile('[^0-9]')
         self.alpha_pattern = re.compile(r'[^A-Za-z\s]', re.UNICODE)
 
     def collect_championship_results(self, championship):
-        ret_rq = requests.get(self.url)
-        fixture_results = []
+        ret_rq = self.stats.fetch(self.fetcher, self.url)
         if ret_rq.status_code == 200:
-            self.dom = BeautifulSoup(ret_rq.text, 'html.parser')
-            championship_year = championship['year']
-            if int(championship_year) <= 2016:
-                fixture_tables = self.__get_fixture_tables()
-                for fixture_table in fixture_tables:
-                    fixture_results.append(self.__process_fixture_table(fixture_table, championship_year))
-            else:
-                fixture_results = self.__read_results_new_format(championship['num_teams'])
+            return self.stats.parse(self.parse_championship_results, ret_rq.text, championship)
+        else:
+            return []
+
+    def parse_championship_results(self, html, championship):
+        fixture_results = []
+        self.dom = parse_html(html, self.parser, self.only_tables)
+        championship_year = championship['year']
+        if int(championship_year) <= 2016:
+            fixture_tables = self.__get_fixture_tables()
+            for fixture_table in fixture_tables:
+                fixture_results.append(self.__process_fixture_table(fixture_table, championship_year))
+        else:
+            fixture_results = self.__read_results_new_format(championship['num_teams'])
         return fixture_results
 
     def __process_datetime_new_format(self, cell_content):
@@ -188,45 +244,8 @@ class ParaguayanChampionshipResultsScraper:
             stadium = {'name': utils.to_unicode(table_cell)}
         return stadium
 
-    def __insert_content_in_row_array(self, content, array):
-        # Insert content in the first empty (None) place of the array
-        array_length = len(array)
-        for i in range(0, array_length):
-            if array[i] is None:
-                array[i] = content
-                return array
-
-    def __get_column_for_content(self, type_content, headers):
-        m_h = len(headers)
-        for i in range(0, m_h):
-            header = headers[i]
-            if header['content'] in type_content:
-                return i
-
-    def __identify_type_content(self, content, pos_std, pos_yc):
-        if ' de ' in content:
-            return 'dia'
-        elif ':' in content:
-            return 'hora'
-        elif '/' in content:
-            if pos_yc == 0:
-                return 'tarjetas amarillas'
-            else:
-                return 'tarjetas rojas'
-        else:
-            content = content.replace('.', '')
-            if content.isdigit():
-                return 'asistencia o pagantes'
-            else:
-                if pos_std == 0:
-                    return 'estadio'
-                else:
-                    return 'arbitro'
-
     def __clean_text_tag(self, tag_txt):
-        if tag_txt.sup:
-            tag_txt.sup.clear()
-        content = utils.to_unicode(tag_txt.get_text().lower())
+        content = utils.to_unicode(get_cell_text(tag_txt).lower())
         content = content.replace(u'\xa0', u' ')  # Remove unicode representation of blank space (\xa0)
         if u'\u200b' in content:
             idx_square_bracket = content.find('[')
@@ -237,21 +256,23 @@ class ParaguayanChampionshipResultsScraper:
 
         return content
 
+    def __get_cell_content(self, table_cell):
+        return self.__clean_text_tag(table_cell).strip()
+
     def __table_to_matrix(self, table):
         table_matrix = []
         # Save table header
         row_header = []
         table_headers = table.find_all('th')
         for table_header in table_headers:
-            if 'fecha' in table_header.get_text(strip=True).lower():
+            header_content = table_header.get_text(strip=True)
+            if 'fecha' in header_content.lower():
                 continue
-            if 'goles' in table_header.get_text(strip=True).lower():
+            if 'goles' in header_content.lower():
                 continue
-            if table_header.get_text(strip=True) != '':
-                if table_header.sup:
-                    table_header.sup.clear()
+            if header_content != '':
                 row_header.append({
-                    'content': utils.normalize_text(table_header.get_text(strip=True).lower()),
+                    'content': utils.normalize_text(get_cell_text(table_header, strip=True).lower()),
                     'repeat_for': 0
                 })
             else:
@@ -268,33 +289,14 @@ class ParaguayanChampionshipResultsScraper:
                         })
         num_col_table = len(row_header)
         table_matrix.append(row_header)
-        # Save table body
+        # Save table body, the cells with rowspan are repeated in the rows
+        # below while colspans are not expanded so that the rows of goals
+        # (a single wide cell) keep empty (None) columns
         rows = table.find_all('tr')
-        num_rows = len(rows)
-        span_contents = []
-        for i in range(2, num_rows):
-            row_body = [None] * num_col_table
-            columns = rows[i].find_all('td')
-            num_col_row = len(columns)
-            pos_std, pos_yc = 0, 0
-            if num_col_row < num_col_table:
-                for span_content in span_contents:
-                    if i in span_content['affected_rows']:
-                        row_body[span_content['col']] = span_content['content']
-            for j in range(0, num_col_row):
-                content = self.__clean_text_tag(columns[j])
-                if columns[j].has_attr('rowspan'):
-                    type_content = self.__identify_type_content(content, pos_std, pos_yc)
-                    if type_content == 'tarjetas amarillas':
-                        pos_yc = 1
-                    if type_content == 'estadio':
-                        pos_std = 1
-                    span_contents.append({
-                        'content': content.strip(),
-                        'affected_rows': list(range(i, i+int(columns[j]['rowspan']))),
-                        'col': self.__get_column_for_content(type_content, row_header)
-                    })
-                row_body = self.__insert_content_in_row_array(content.strip(), row_body)
+        body = rows_to_grid(rows[2:], self.__get_cell_content, expand_colspan=False, cell_tags='td')
+        for row_body in body:
+            row_body = row_body[:num_col_table]
+            row_body.extend([None] * (num_col_table - len(row_body)))
             table_matrix.append(row_body)
 
         return table_matrix
@@ -516,8 +518,16 @@ class ParaguayanTournamentScraper:
     dom = None
     prefix_url = 'https://es.wikipedia.org'
 
-    def __init__(self, url):
+    def __init__(self, url, fetcher=None, parser=None, only_tables=True):
         self.url = url
+        self.fetcher = fetcher or get_default_fetcher()
+        self.parser = parser
+        self.only_tables = only_tables
+        self.stats = ScraperStats()
+        # index of the tables of the page, rebuilt every time a page is parsed
+        self.tables = []
+        self.table_index = {}
+        self.matching_tables = {}
 
     def __update_teams_info(self, teams, teams_extra_info, update_dict=True, new_key=''):
         if teams:
@@ -541,64 +551,68 @@ class ParaguayanTournamentScraper:
             return None
 
     def collect_tournament_info(self, championship):
-        ret = requests.get(self.url)
+        ret = self.stats.fetch(self.fetcher, self.url)
         if ret.status_code == 200:
-            self.dom = BeautifulSoup(ret.text, 'html.parser')
-            information_to_collect = self.__get_info_to_collect(championship)
-            if information_to_collect:
-                championship_year = str(championship['year'])
-                championship_name = championship['name']
-                teams = {}
-                champ = {}
-                if 'teams info' in information_to_collect:
-                    teams = self.__process_table_teams(
-                        self.__get_table_teams(championship_year)
-                    )
-                if 'season statuses' in information_to_collect:
-                    season_statuses = self.__process_table_season_statuses(
-                        self.__get_table_season_statuses(championship_year), championship_year
-                    )
-                    teams = self.__update_teams_info(teams, season_statuses, False, 'season')
-                if 'top scorers' in information_to_collect:
-                    champ['top_scorers'] = self.__process_table_top_scorers(
-                        self.__get_championship_top_scorers()
-                    )
-                if 'coach substitutions' in information_to_collect:
-                    champ['coach_substitutions'] = self.__process_table_coach_substitutions(
-                        self.__get_coach_substitutions_info(championship_name, championship_year),
-                        championship_year
-                    )
-                if 'team buyers' in information_to_collect:
-                    team_buyers = self.__process_table_team_buyers(
-                        self.__get_table_team_buyers()
-                    )
-                    teams = self.__update_teams_info(teams, team_buyers)
-                if 'game top audiences' in information_to_collect:
-                    champ['top_audiences'] = self.__process_table_top_audience_games(
-                        self.__get_info_games_large_audience()
-                    )
-                if 'team cards' in information_to_collect:
-                    team_cards = self.__process_table_team_cards(
-                        self.__get_table_team_cards()
-                    )
-                    teams = self.__update_teams_info(teams, team_cards)
-                if 'referees' in information_to_collect:
-                    champ['referees'] = self.__process_table_referees(
-                        self.__get_referees_info()
-                    )
-                if 'team audiences' in information_to_collect:
-                    team_audiences = self.__process_table_team_audience(
-                        self.__get_table_audience()
-                    )
-                    teams = self.__update_teams_info(teams, team_audiences)
-                return {
-                    'championship': champ,
-                    'teams': teams
-                }
-            else:
-                return {}
+            return self.stats.parse(self.parse_tournament_info, ret.text, championship)
+        else:
+            raise Exception('Request get the code ' + str(ret.status_code))
+
+    def parse_tournament_info(self, html, championship):
+        self.dom = parse_html(html, self.parser, self.only_tables)
+        self.__index_tables()
+        information_to_collect = self.__get_info_to_collect(championship)
+        if information_to_collect:
+            championship_year = str(championship['year'])
+            championship_name = championship['name']
+            teams = {}
+            champ = {}
+            if 'teams info' in information_to_collect:
+                teams = self.__process_table_teams(
+                    self.__get_table_teams(championship_year)
+                )
+            if 'season statuses' in information_to_collect:
+                season_statuses = self.__process_table_season_statuses(
+                    self.__get_table_season_statuses(championship_year), championship_year
+                )
+                teams = self.__update_teams_info(teams, season_statuses, False, 'season')
+            if 'top scorers' in information_to_collect:
+                champ['top_scorers'] = self.__process_table_top_scorers(
+                    self.__get_championship_top_scorers()
+                )
+            if 'coach substitutions' in information_to_collect:
+                champ['coach_substitutions'] = self.__process_table_coach_substitutions(
+                    self.__get_coach_substitutions_info(championship_name, championship_year),
+                    championship_year
+                )
+            if 'team buyers' in information_to_collect:
+                team_buyers = self.__process_table_team_buyers(
+                    self.__get_table_team_buyers()
+                )
+                teams = self.__update_teams_info(teams, team_buyers)
+            if 'game top audiences' in information_to_collect:
+                champ['top_audiences'] = self.__process_table_top_audience_games(
+                    self.__get_info_games_large_audience()
+                )
+            if 'team cards' in information_to_collect:
+                team_cards = self.__process_table_team_cards(
+                    self.__get_table_team_cards()
+                )
+                teams = self.__update_teams_info(teams, team_cards)
+            if 'referees' in information_to_collect:
+                champ['referees'] = self.__process_table_referees(
+                    self.__get_referees_info()
+                )
+            if 'team audiences' in information_to_collect:
+                team_audiences = self.__process_table_team_audience(
+                    self.__get_table_audience()
+                )
+                teams = self.__update_teams_info(teams, team_audiences)
+            return {
+                'championship': champ,
+                'teams': teams
+            }
         else:
-            raise Exception('Request get the code ' + ret.status_code)
+            return {}
 
     def __process_team_cell(self, table_cell):
         team_tags = table_cell.find_all('a')
@@ -692,20 +706,31 @@ class ParaguayanTournamentScraper:
             teams.append(team)
         return teams
 
+    def __index_tables(self):
+        # map every header to the position of the tables that contain it, so
+        # the tables of each section are found without walking the dom again.
+        # As find_all('th') is recursive, the headers of a nested table also
+        # belong to the tables that enclose it
+        self.tables = self.dom.find_all('table')
+        positions = dict([(id(table), pos) for pos, table in enumerate(self.tables)])
+        self.table_index = defaultdict(set)
+        for table_header in self.dom.find_all('th'):
+            header_content = table_header.get_text(strip=True).lower()
+            for parent in table_header.parents:
+                if parent.name == 'table':
+                    self.table_index[header_content].add(positions[id(parent)])
+        self.matching_tables = {}
+
     def __get_table(self, headers):
-        tables = self.dom.find_all('table')
-        match_tables = []
-        for table in tables:
-            dict_headers = {h: False for h in headers}
-            table_headers = table.find_all('th')
-            for table_header in table_headers:
-                header_content = table_header.get_text(strip=True).lower()
-                if dict_headers.get(header_content) is not None:
-                    dict_headers[header_content] = True
-            headers_found = [dict_headers[h] for h in dict_headers.keys()]
-            if False not in headers_found:
-                match_tables.append(table)
-        return match_tables
+        # tables that have all the headers, in the order of the page
+        key = frozenset(headers)
+        if key not in self.matching_tables:
+            if key:
+                positions = set.intersection(*[self.table_index.get(header, set()) for header in key])
+            else:
+                positions = range(len(self.tables))
+            self.matching_tables[key] = [self.tables[pos] for pos in sorted(positions)]
+        return list(self.matching_tables[key])
 
     '''
        Get all information about teams
@@ -1194,4 +1219,22 @@ class ParaguayanTournamentScraper:
 #         url=championship_test['results']
 #     )
 #     ret = ws.collect_championship_results(championship_test)
-#     pass
\ No newline at end of file
+#     pass
+
+
+def collect_seasons_results(seasons, fetcher=None, max_concurrency=DEF_CONCURRENCY,
+                            host_delay=DEF_HOST_DELAY):
+    # seasons is a list of (url, championship), their pages are downloaded
+    # concurrently and then parsed one after the other
+    fetcher = fetcher or get_default_fetcher()
+    with fetcher.prefetching([url for url, championship in seasons], max_concurrency, host_delay):
+        return [ParaguayanChampionshipResultsScraper(url, fetcher).collect_championship_results(championship)
+                for url, championship in seasons]
+
+
+def collect_seasons_info(seasons, fetcher=None, max_concurrency=DEF_CONCURRENCY,
+                         host_delay=DEF_HOST_DELAY):
+    fetcher = fetcher or get_default_fetcher()
+    with fetcher.prefetching([url for url, championship in seasons], max_concurrency, host_delay):
+        return [ParaguayanTournamentScraper(url, fetcher).collect_tournament_info(championship)
+                for url, championship in seasons]
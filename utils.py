@@ -3,6 +3,9 @@ __author__ = 'jorgesaldivar'
 import unicodedata, csv
 
 
+NAME_STOP_WORDS = ('club', 'estadio')
+
+
 def to_unicode(obj, encoding='utf-8'):
     if isinstance(obj, basestring):
         if not isinstance(obj, unicode):
@@ -27,6 +30,13 @@ def normalize_text(text):
     return unicodedata.normalize('NFD', to_unicode(text)).encode('ascii', 'ignore')
 
 
+def normalize_name(name, stop_words=NAME_STOP_WORDS):
+    # form in which names are stored to be looked up, accents are
+    # stripped, letters lowercased and the stop words removed
+    words = normalize_text(name).lower().split()
+    return ' '.join([word for word in words if word not in stop_words])
+
+
 def csv_to_dict(csv_file):
     with open(csv_file, 'r') as csv_file:
         csv_reader = csv.DictReader(csv_file, delimiter=',')